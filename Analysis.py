@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Schedule analysis: double-bookings per room, lecturer and group, free room
+slots and occupancy matrices over fetched events
+"""
+
+import csv
+from datetime import date, timedelta
+from heapq import heappop, heappush
+from Events import split_groups
+import config
+
+
+KINDS = ('room', 'lecturer', 'group')
+
+
+class Schedule:
+    """Fetched events as sorted per-resource interval lists
+    
+    Entries of one session (the same lecture at the same time in the same
+    room, listed once per group) are merged first, so a shared lecture isn't
+    reported as a double-booking. Canceled events and events whose date or
+    times don't parse are left out. Building sorts the sessions once
+    (O(n log n)); every per-resource list is then already in start order.
+    """
+    
+    def __init__(self, events):
+        sessions = {}
+        for event in events:
+            if (event.description or '').lower() == 'canceled' or not (event.day and event.start and event.end):
+                continue
+            start = _minutes(event.day, event.start)
+            end = _minutes(event.day, event.end)
+            if end <= start:
+                continue
+            key = (start, end, event.title, event.room, event.lecturer, event.type)
+            session = sessions.get(key)
+            if session is None:
+                sessions[key] = (start, end, [event])
+            else:
+                session[2].append(event)
+        
+        # (start, end, events), in start order
+        self.sessions = sorted(sessions.values(), key=lambda session: (session[0], session[1]))
+        # kind -> resource -> [(start, end, session index)], in start order
+        self._intervals = {kind: {} for kind in KINDS}
+        rooms, lecturers, groups = (self._intervals[kind] for kind in KINDS)
+        for index, (start, end, session_events) in enumerate(self.sessions):
+            interval = (start, end, index)
+            first = session_events[0]
+            if first.room:
+                rooms.setdefault(first.room, []).append(interval)
+            if first.lecturer:
+                lecturers.setdefault(first.lecturer, []).append(interval)
+            for group in {group for event in session_events for group in split_groups(event.group)}:
+                groups.setdefault(group, []).append(interval)
+    
+    def __len__(self):
+        return len(self.sessions)
+    
+    def resources(self, kind='room'):
+        """Distinct rooms, lecturers or groups"""
+        return sorted(self._intervals[kind])
+    
+    def conflicts(self, kind='room', resources=None):
+        """Overlapping sessions that share a room, lecturer or group
+        
+        A sweep over each resource's sessions keeps the ones still running in
+        a heap ordered by end time, so the cost is O(n log n + conflicts)
+        rather than a comparison of every pair. Returns dicts with "kind",
+        "resource", "date", "start" and "end" (of the overlap) and "events"
+        (one event of each session), ordered by resource, then time.
+        """
+        intervals = self._intervals[kind]
+        result = []
+        for resource in resources or sorted(intervals):
+            running = []
+            for start, end, index in intervals.get(resource, ()):
+                while running and running[0][0] <= start:
+                    heappop(running)
+                for other_end, other in running:
+                    result.append({
+                        "kind": kind,
+                        "resource": resource,
+                        "date": _date(start).isoformat(),
+                        "start": _clock(start),
+                        "end": _clock(min(end, other_end)),
+                        "events": (self.sessions[other][2][0], self.sessions[index][2][0]),
+                    })
+                heappush(running, (end, index))
+        return result
+    
+    def free_slots(self, date_from, date_to, rooms=None, min_minutes=None):
+        """Free time of each room within the working hours of every working day
+        
+        date_from and date_to are inclusive 'YYYY-MM-DD' strings; working
+        hours, days and the shortest reported slot come from config.ANALYSIS.
+        Returns {room: [(date, start, end), ...]} with 'HH:MM' times.
+        """
+        if min_minutes is None:
+            min_minutes = config.ANALYSIS["min_free_minutes"]
+        days = working_days(date_from, date_to)
+        result = {}
+        for room in rooms or self.resources('room'):
+            slots = []
+            for day, (window_start, window_end), busy in _busy_by_day(self._intervals['room'].get(room, ()), days):
+                cursor = window_start
+                for start, end in busy + [(window_end, window_end)]:
+                    if start - cursor >= min_minutes:
+                        slots.append((day.isoformat(), _clock(cursor), _clock(start)))
+                    cursor = max(cursor, end)
+            result[room] = slots
+        return result
+    
+    def occupancy(self, date_from, date_to, kind='room', resources=None):
+        """Share of the working hours each resource is busy, per working day
+        
+        Returns {"resources": [...], "dates": [...], "matrix": rows of fractions},
+        one row per resource and one column per date.
+        """
+        days = working_days(date_from, date_to)
+        resources = resources or self.resources(kind)
+        matrix = []
+        for resource in resources:
+            row = []
+            for _, (window_start, window_end), busy in _busy_by_day(self._intervals[kind].get(resource, ()), days):
+                row.append(round(sum(end - start for start, end in busy) / (window_end - window_start), 3))
+            matrix.append(row)
+        return {"resources": resources, "dates": [day.isoformat() for day in days], "matrix": matrix}
+
+
+def working_days(date_from, date_to):
+    """Dates from date_from to date_to (inclusive) on the configured working weekdays"""
+    first, last = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    weekdays = set(config.ANALYSIS["weekdays"])
+    return [first + timedelta(days=n) for n in range((last - first).days + 1)
+            if (first + timedelta(days=n)).weekday() in weekdays]
+
+
+def format_conflict(conflict):
+    """One report line per conflict"""
+    first, second = conflict["events"]
+    return (f"{conflict['date']} {conflict['start']}-{conflict['end']} {conflict['kind']} {conflict['resource']}: "
+            f"{first.title} [{first.group}] room {first.room or '-'} / "
+            f"{second.title} [{second.group}] room {second.room or '-'}")
+
+
+def write_occupancy(occupancy, filename):
+    """Occupancy matrix as CSV: one row per resource, one column per date"""
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["resource"] + occupancy["dates"])
+        for resource, row in zip(occupancy["resources"], occupancy["matrix"]):
+            writer.writerow([resource] + row)
+
+
+def _busy_by_day(intervals, days):
+    """Yield (day, (window start, end), merged busy intervals clipped to the window) for each day
+    
+    intervals and days are both in order, so one forward walk covers them.
+    """
+    day_start = _clock_minutes(config.ANALYSIS["day_start"])
+    day_end = _clock_minutes(config.ANALYSIS["day_end"])
+    position = 0
+    for day in days:
+        base = day.toordinal() * 1440
+        window_start, window_end = base + day_start, base + day_end
+        while position < len(intervals) and intervals[position][0] < window_start and \
+                intervals[position][1] <= window_start:
+            position += 1
+        busy = []
+        while position < len(intervals) and intervals[position][0] < window_end:
+            start, end = max(intervals[position][0], window_start), min(intervals[position][1], window_end)
+            if start < end:
+                if busy and start <= busy[-1][1]:
+                    busy[-1] = (busy[-1][0], max(busy[-1][1], end))
+                else:
+                    busy.append((start, end))
+            position += 1
+        yield day, (window_start, window_end), busy
+
+
+def _minutes(day, at):
+    """Minutes since 0001-01-01 00:00, so intervals of different days compare directly"""
+    return day.toordinal() * 1440 + at.hour * 60 + at.minute
+
+
+def _date(minutes):
+    return date.fromordinal(minutes // 1440)
+
+
+def _clock(minutes):
+    return f"{minutes % 1440 // 60:02d}:{minutes % 60:02d}"
+
+
+def _clock_minutes(value):
+    hours, _, minutes = value.partition(":")
+    return int(hours) * 60 + int(minutes)
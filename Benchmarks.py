@@ -0,0 +1,1602 @@
+#!/usr/bin/env python3
+"""
+TSI Calendar Scraper - Benchmarks
+Runs the scraper against a local stand-in for the mob-back portal
+"""
+
+import argparse
+import contextlib
+import glob
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import config
+from Events import Event
+
+
+def make_month_events(year, month, events_per_day=6, revision=0):
+    """Canned events_by_date payload for one month; each revision moves and adds a lecture"""
+    slots = [("08:45", "10:15"), ("10:30", "12:00"), ("12:45", "14:15"),
+             ("14:30", "16:00"), ("16:15", "17:45"), ("18:00", "19:30")]
+    events_by_date = {}
+    for day in range(1, 29):
+        date = f"{year}-{month:02d}-{day:02d}"
+        events_by_date[date] = [
+            {
+                "start_time": slots[i % len(slots)][0],
+                "end_time": slots[i % len(slots)][1],
+                "title": f"Course {i}",
+                "room": f"{100 + i}",
+                "group": f"{3400 + i}BNA",
+                "lecturer": f"Lecturer {i}",
+                "type": "Lesson",
+                "description": "",
+            }
+            for i in range(events_per_day)
+        ]
+    for n in range(1, revision + 1):
+        day = f"{year}-{month:02d}-{n % 28 + 1:02d}"
+        events_by_date[day][0] = dict(events_by_date[day][0], room=f"{200 + n}")
+        events_by_date[day].append({"start_time": "19:45", "end_time": "21:15", "title": f"Consultation {n}",
+                                    "room": "100", "group": "3400BNA", "lecturer": "Lecturer 0",
+                                    "type": "Consultation", "description": ""})
+    return events_by_date
+
+
+def make_events(count, year=2025):
+    """Flat list of synthetic events, as fetch_period would return them"""
+    events_per_day = max(1, count // (12 * 28) + 1)
+    events = []
+    for month in range(1, 13):
+        for date, date_events in make_month_events(year, month, events_per_day).items():
+            for event in date_events:
+                events.append(Event.from_dict(event, date))
+    return events[:count]
+
+
+def make_institute_events(year=2025, rooms=120, occupancy=0.6, conflict_rate=0.01, shared_rate=0.1, seed=1):
+    """A year of all-institute events: every room, group and lecturer, Monday to Saturday
+    
+    Each slot gives every group and lecturer at most one lecture, except for
+    injected double-bookings (conflict_rate); shared_rate of the lectures are
+    listed once per group, as the portal does for shared lectures.
+    """
+    import random
+    from datetime import date, timedelta
+    
+    rng = random.Random(seed)
+    slots = [("08:45", "10:15"), ("10:30", "12:00"), ("12:45", "14:15"),
+             ("14:30", "16:00"), ("16:15", "17:45"), ("18:00", "19:30")]
+    room_names = [f"{building}{number}" for building in "ABCL" for number in range(100, 100 + rooms // 4)]
+    groups = [f"{3400 + n}BNA" for n in range(rooms * 2)]
+    lecturers = [f"Lecturer {n}" for n in range(rooms * 2)]
+    
+    events = []
+    day = date(year, 1, 1)
+    while day.year == year:
+        if day.weekday() < 6:
+            date_str = day.isoformat()
+            for start, end in slots:
+                free_groups = rng.sample(groups, len(groups))
+                free_lecturers = rng.sample(lecturers, len(lecturers))
+                for room in room_names:
+                    if rng.random() > occupancy:
+                        continue
+                    session_groups = [free_groups.pop() for _ in range(2 if rng.random() < shared_rate else 1)]
+                    lecturer = free_lecturers.pop()
+                    title = f"Course {rng.randrange(400)}"
+                    if rng.random() < conflict_rate:
+                        # Double-book: a second lecture in the room, or a busy group or lecturer
+                        kind = rng.choice(("room", "group", "lecturer"))
+                        events.append(Event(date_str, start, end, f"Course {rng.randrange(400)}",
+                                            room if kind == "room" else rng.choice(room_names),
+                                            session_groups[0] if kind == "group" else free_groups.pop(),
+                                            lecturer if kind == "lecturer" else free_lecturers.pop(), "Lesson", ""))
+                    for group in session_groups:
+                        events.append(Event(date_str, start, end, title, room, group, lecturer, "Lesson", ""))
+        day += timedelta(days=1)
+    return events
+
+
+def portal_matches(event, filters):
+    """The stand-in server's room, lecturer and group filters, on raw payload dicts
+    
+    Kept apart from the scraper's own matching (EventStore), so the
+    split-locally benchmark compares it against an independent reference.
+    """
+    if filters["room"] != "reset_room" and event.get("room") != filters["room"]:
+        return False
+    lecturer = filters["lecturer"]
+    if lecturer != "reset_lecturer" and lecturer.lower() not in (event.get("lecturer") or "").lower():
+        return False
+    if filters["group"] != "reset_group" and filters["group"] not in [
+            group.strip() for group in (event.get("group") or "").split(",")]:
+        return False
+    return True
+
+
+def make_calendar_html(year, month, events_per_day=6, filters=None, revision=0):
+    """Build a month page with a canned `const events = {...};` payload"""
+    events_by_date = make_month_events(year, month, events_per_day, revision)
+    if filters:
+        events_by_date = {date: [e for e in day_events if portal_matches(e, filters)]
+                          for date, day_events in events_by_date.items()}
+    
+    # Month grid markup, as rendered around the script on the real page
+    cells = "".join(
+        f'<td class="day"><span class="num">{date[-2:]}</span>'
+        + "".join(f'<div class="event"><b>{e["start_time"]}</b> {e["title"]} '
+                  f'<i>{e["room"]}</i></div>' for e in day_events)
+        + "</td>"
+        for date, day_events in events_by_date.items()
+    )
+    
+    return ("<html><head><title>Calendar</title></head><body>"
+            f'<table id="calendar"><tr>{cells}</tr></table><a href="/logout">Logout</a>'
+            f"<script>const events = {json.dumps(events_by_date)};</script>"
+            "</body></html>")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves login, authenticate and calendar pages with injected latency"""
+    
+    # Keep-alive and gzip like the real portal
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    events_per_day = 6
+    requests = None
+    revisions = None    # {(year, month): revision} to simulate timetable changes
+    
+    def _count(self):
+        with self.requests["lock"]:
+            self.requests[urlparse(self.path).path] = self.requests.get(urlparse(self.path).path, 0) + 1
+    
+    def _send(self, body, etag=None, cookie=None):
+        time.sleep(self.latency)
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            data = gzip.compress(data, compresslevel=6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        if etag:
+            self.send_header("ETag", etag)
+        if cookie:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _logged_in(self):
+        return "tsi_session=bench-session" in self.headers.get("Cookie", "")
+    
+    def _redirect_to_login(self):
+        self.send_response(302)
+        self.send_header("Location", "/login")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+    
+    def do_HEAD(self):
+        self._count()
+        if urlparse(self.path).path == "/calendar" and not self._logged_in():
+            self._redirect_to_login()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+    
+    def do_GET(self):
+        self._count()
+        url = urlparse(self.path)
+        if url.path == "/calendar" and not self._logged_in():
+            self._redirect_to_login()
+        elif url.path == "/login":
+            self._send('<form><input type="hidden" name="_token" value="bench-token"></form>')
+        elif url.path == "/calendar":
+            params = parse_qs(url.query)
+            year, month = int(params["year"][0]), int(params["month"][0])
+            filters = {key: params.get(name, [f"reset_{key}"])[0]
+                       for key, name in (("room", "room"), ("lecturer", "lecturer"), ("group", "group"),
+                                         ("type", "type[]"))}
+            body = make_calendar_html(year, month, self.events_per_day, filters, self.revisions.get((year, month), 0))
+            etag = '"%s"' % hashlib.sha1(body.encode("utf-8")).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                time.sleep(self.latency)
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            else:
+                self._send(body, etag)
+        else:
+            self.send_error(404)
+    
+    def do_POST(self):
+        self._count()
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._send('<a href="/logout">Logout</a>', cookie="tsi_session=bench-session; Path=/")
+    
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def stand_in_server(latency=0.0, events_per_day=6):
+    """Run the stand-in portal on a free local port and point config at it"""
+    handler = type("Handler", (StandInHandler,), {"latency": latency, "events_per_day": events_per_day,
+                                                  "requests": {"lock": threading.Lock()}, "revisions": {}})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    
+    saved = (config.BASE_URL, config.LOGIN_PAGE, config.AUTH_URL, config.CALENDAR_URL, config.SESSION)
+    session_dir = tempfile.TemporaryDirectory()
+    config.BASE_URL = f"http://127.0.0.1:{server.server_port}"
+    config.LOGIN_PAGE = f"{config.BASE_URL}/login"
+    config.AUTH_URL = f"{config.BASE_URL}/authenticate"
+    config.CALENDAR_URL = f"{config.BASE_URL}/calendar"
+    config.SESSION = dict(config.SESSION, cookie_file=f"{session_dir.name}/session.json")
+    server.requests = handler.requests
+    server.revisions = handler.revisions
+    try:
+        yield server
+    finally:
+        config.BASE_URL, config.LOGIN_PAGE, config.AUTH_URL, config.CALENDAR_URL, config.SESSION = saved
+        session_dir.cleanup()
+        server.shutdown()
+        server.server_close()
+
+
+@contextlib.contextmanager
+def config_override(**sections):
+    """Temporarily update config dicts, e.g. config_override(OUTPUT={"formats": ["json"]})"""
+    saved = {name: dict(getattr(config, name)) for name in sections}
+    for name, values in sections.items():
+        getattr(config, name).update(values)
+    try:
+        yield
+    finally:
+        for name, values in saved.items():
+            getattr(config, name).clear()
+            getattr(config, name).update(values)
+
+
+def write_fixtures(directory, months=12, events_per_day=40):
+    """Store synthetic month pages, e.g. for `--fixtures 'DIR/*.html'`"""
+    os.makedirs(directory, exist_ok=True)
+    for month in range(1, months + 1):
+        path = os.path.join(directory, f"calendar_2025_{month:02d}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(make_calendar_html(2025, month, events_per_day))
+    print(f"Wrote {months} month pages ({events_per_day} events per day) to {directory}")
+
+
+def bench_fetch_period(months=12, latency=0.2, workers=(1, 4, 8)):
+    """Time fetch_period for each worker count against the stand-in server"""
+    from TSICalendar import TSICalendar, RESET_FILTERS
+    
+    to_year, to_month = 2025 + (months - 1) // 12, (months - 1) % 12 + 1
+    results = {}
+    with stand_in_server(latency):
+        for max_workers in workers:
+            calendar = TSICalendar()
+            calendar.cache = None
+            with contextlib.redirect_stdout(io.StringIO()):
+                calendar.login()
+                start = time.perf_counter()
+                events = calendar.fetch_period(2025, 1, to_year, to_month, max_workers=max_workers,
+                                               filters=RESET_FILTERS)
+                elapsed = time.perf_counter() - start
+            calendar.close()
+            timings = calendar.timings.summary()
+            results[max_workers] = elapsed
+            print(f"fetch_period  months={months:<3} workers={max_workers:<3} "
+                  f"{elapsed:8.3f}s  ({len(events)} events, {timings['new_connections']} new connections, "
+                  f"{timings['bytes'] / 1024:.0f} KiB, ttfb p95 {timings['ttfb']['p95'] * 1000:.0f} ms)")
+    
+    return results
+
+
+def bench_targets(targets=8, months=12, latency=0.2):
+    """Batch mode: per-target requests vs one unfiltered fetch split locally"""
+    from TSICalendar import TSICalendar
+    
+    to_year, to_month = 2025 + (months - 1) // 12, (months - 1) % 12 + 1
+    target_list = [{"lecturer": f"Lecturer {i}"} for i in range(targets)]
+    results = {}
+    with stand_in_server(latency) as server:
+        for split_locally in (False, True):
+            calendar = TSICalendar()
+            calendar.cache = None
+            with contextlib.redirect_stdout(io.StringIO()):
+                calendar.login()
+            before = server.requests.get("/calendar", 0)
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                fetched = calendar.fetch_targets(target_list, 2025, 1, to_year, to_month,
+                                                 split_locally=split_locally)
+                elapsed = time.perf_counter() - start
+            calendar.close()
+            requests_made = server.requests.get("/calendar", 0) - before
+            mode = "split" if split_locally else "per-target"
+            results[mode] = {"seconds": elapsed, "requests": requests_made,
+                             "events": {name: sorted(json.dumps(e.to_dict(), sort_keys=True) for e in events)
+                                        for name, events in fetched.items()}}
+            print(f"targets       {mode:<10} targets={targets:<3} {elapsed:8.3f}s  requests={requests_made:<4} "
+                  f"({sum(len(events) for events in fetched.values())} events)")
+    
+    # Local splitting must pick out what the server's own filters returned
+    same = results["split"]["events"] == results["per-target"]["events"]
+    print(f"targets       split matches per-target: {same}")
+    return results
+
+
+def bench_startup(latency=0.2):
+    """Cold login vs warm start from saved cookies vs a fully cached run (login + one month)"""
+    from TSICalendar import TSICalendar, RESET_FILTERS
+    from Cache import MonthCache
+    
+    results = {}
+    with stand_in_server(latency) as server, tempfile.TemporaryDirectory() as tmp:
+        for run in ("cold", "warm", "cached"):
+            before = sum(count for path, count in server.requests.items() if path != "lock")
+            calendar = TSICalendar()
+            # Only the last run may find the month in the cache (the warm run stores it)
+            calendar.cache = MonthCache(directory=tmp) if run != "cold" else None
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                if run != "cached":
+                    calendar.login()
+                calendar.fetch_month(2025, 1, RESET_FILTERS)
+                elapsed = time.perf_counter() - start
+                calendar.close()
+            requests_made = sum(count for path, count in server.requests.items() if path != "lock") - before
+            results[run] = {"seconds": elapsed, "requests": requests_made}
+            print(f"startup       {run:<6} {elapsed:8.3f}s  requests={requests_made}")
+    
+    return results
+
+
+def bench_imports(repeat=5):
+    """Fresh interpreter: the imports main.py used to do eagerly vs the lazy entry point"""
+    variants = {
+        "eager": "import requests, bs4, dateutil.relativedelta, pytz, zstandard, TSICalendar, Exporters, Transport",
+        "lazy": "import main, TSICalendar, Pipeline; Pipeline.load_exporter('table')",
+    }
+    results = {}
+    for name, code in variants.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            times.append(time.perf_counter() - start)
+        results[name] = sorted(times)[len(times) // 2]
+        print(f"imports       {name:<6} {results[name] * 1000:8.1f} ms  (median of {repeat} interpreter starts)")
+    
+    return results
+
+
+def bench_cache(months=12, latency=0.2):
+    """Compare a cold run with warm and revalidating re-runs of fetch_period"""
+    from Cache import MonthCache
+    from TSICalendar import TSICalendar, RESET_FILTERS
+    
+    to_year, to_month = 2025 + (months - 1) // 12, (months - 1) % 12 + 1
+    results = {}
+    with stand_in_server(latency) as server, tempfile.TemporaryDirectory() as cache_dir:
+        # The cold run stores already-expired entries so the next run revalidates them
+        for run, ttl in (("cold", 0), ("revalidate", 3600), ("warm", 3600)):
+            calendar = TSICalendar()
+            calendar.cache = MonthCache(directory=cache_dir, past_ttl=ttl, current_ttl=ttl)
+            with contextlib.redirect_stdout(io.StringIO()):
+                calendar.login()
+            before = server.requests.get("/calendar", 0)
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                calendar.fetch_period(2025, 1, to_year, to_month, filters=RESET_FILTERS)
+                elapsed = time.perf_counter() - start
+            calendar.close()
+            requests_made = server.requests.get("/calendar", 0) - before
+            results[run] = {"seconds": elapsed, "requests": requests_made, **calendar.cache.stats()}
+            print(f"cache         {run:<10} {elapsed:8.3f}s  requests={requests_made:<3} {calendar.cache.stats()}")
+    
+    return results
+
+
+def bench_plan(past_months=12, future_months=2, latency=0.2):
+    """Fetch plan on a range around today: requests per run with and without planning"""
+    from datetime import date
+    from Cache import MonthCache
+    from TSICalendar import TSICalendar, RESET_FILTERS
+    
+    today = date.today()
+    first = (today.year * 12 + today.month - 1) - past_months
+    last = (today.year * 12 + today.month - 1) + future_months
+    span = (first // 12, first % 12 + 1, last // 12, last % 12 + 1)
+    months = past_months + 1 + future_months
+    
+    results = {}
+    with stand_in_server(latency) as server, tempfile.TemporaryDirectory() as tmp:
+        def run(name, **cache):
+            with config_override(CACHE=dict({"enabled": True, "directory": tmp}, **cache)):
+                calendar = TSICalendar()
+                with contextlib.redirect_stdout(io.StringIO()) as log:
+                    calendar.login()
+                    before = server.requests.get("/calendar", 0)
+                    start = time.perf_counter()
+                    events = calendar.fetch_period(*span, filters=RESET_FILTERS)
+                    elapsed = time.perf_counter() - start
+                calendar.close()
+            requests_made = server.requests.get("/calendar", 0) - before
+            plan_line = next((line for line in log.getvalue().splitlines() if line.startswith("Plan:")), "")
+            results[name] = {"seconds": elapsed, "requests": requests_made, "events": len(events)}
+            print(f"plan          {name:<22} {elapsed:7.3f}s  requests={requests_made:<3} {plan_line}")
+        
+        print(f"plan          {months} months: {past_months} past, the current one, {future_months} future")
+        run("no cache", enabled=False)
+        run("cold")
+        run("re-run")
+        run("re-run, TTL only", plan=False)
+        
+        # Last month's snapshot taken an hour before the month ended: it may have missed late changes
+        cache = MonthCache(directory=tmp)
+        previous = first + past_months - 1
+        key = MonthCache.make_key(previous // 12, previous % 12 + 1, RESET_FILTERS)
+        entry = cache.get(key)
+        entry["stored"] = datetime(today.year, today.month, 1).timestamp() - 3600
+        with gzip.open(cache._path(key), "wt", encoding="utf-8") as f:
+            json.dump(entry, f)
+        run("re-run, unsettled month")
+        
+        # Every past snapshot older than past_ttl
+        run("re-run, 40 days later", past_ttl=0)
+    
+    return results
+
+
+class FakeClock:
+    """Manually advanced clock: time() for the current time, sleep() moves it forward"""
+    
+    def __init__(self, start):
+        self.now = start
+    
+    def time(self):
+        return self.now
+    
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def bench_watch(months=6, latency=0.02):
+    """Watch mode on a fake clock: requests per poll and what a changed month triggers"""
+    from TSICalendar import TSICalendar, RESET_FILTERS
+    from Cache import MonthCache
+    from Watch import Watcher
+    
+    clock = FakeClock(datetime(2025, 3, 10, 9, 0).timestamp())
+    watched = [(2025, month) for month in range(1, months + 1)]
+    exports = []
+    
+    with stand_in_server(latency) as server, tempfile.TemporaryDirectory() as tmp:
+        calendar = TSICalendar()
+        calendar.cache = MonthCache(directory=os.path.join(tmp, "cache"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            calendar.login()
+        watcher = Watcher(calendar, lambda events, changed: exports.append(sorted(changed)),
+                          filters=RESET_FILTERS, months=watched, clock=clock.time, sleep=clock.sleep,
+                          state_file=os.path.join(tmp, "watch.json"), change_log="")
+        
+        def step(label, advance=0, change=None):
+            clock.sleep(advance)
+            if change:
+                server.revisions[change] = server.revisions.get(change, 0) + 1
+            log = io.StringIO()
+            before = server.requests.get("/calendar", 0)
+            with contextlib.redirect_stdout(log):
+                start = time.perf_counter()
+                changed = watcher.poll()
+                elapsed = time.perf_counter() - start
+            requests_made = server.requests.get("/calendar", 0) - before
+            print(f"watch         {label:<22} {elapsed:8.3f}s  requests={requests_made:<3} "
+                  f"changed={[f'{y}-{m:02d}' for y, m in sorted(changed)]}")
+            for line in log.getvalue().splitlines():
+                if "] " in line and not line.endswith("(first poll)"):
+                    print(f"              {line.split('] ', 1)[1]}")
+        
+        step("first poll")
+        step("+15 min, no change", config.WATCH["near_interval"])
+        step("+15 min, March moved", config.WATCH["near_interval"], change=(2025, 3))
+        step("+1 min, nothing due", 60)
+        step("+6 h, January moved", config.WATCH["far_interval"], change=(2025, 1))
+        calendar.close()
+    
+    print(f"watch         exports triggered for {exports}")
+    return exports
+
+
+class FakeHttpError(Exception):
+    """Mimics googleapiclient.errors.HttpError for rate-limit responses"""
+    
+    def __init__(self, status, reason):
+        super().__init__(f"<HttpError {status} \"{reason}\">")
+        self.resp = type("Response", (), {"status": status})()
+        self.content = json.dumps({"error": {"errors": [{"reason": reason}]}}).encode("utf-8")
+
+
+class FakeBatch:
+    """Collects requests and runs them on execute(), like BatchHttpRequest"""
+    
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+    
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+    
+    def execute(self):
+        service = self.service
+        with service.lock:
+            service.calls["batch"] += 1
+        time.sleep(service.latency)
+        for request_id, request in self.requests:
+            with service.lock:
+                service.sub_requests += 1
+                # Every n-th sub-request is throttled, as is everything over a calendar's quota
+                throttled = (service.rate_limit_every and service.sub_requests % service.rate_limit_every == 0) \
+                    or service.over_quota(request.calendar_id)
+            if throttled:
+                with service.lock:
+                    service.rate_limited += 1
+                self.callback(request_id, None, FakeHttpError(403, "rateLimitExceeded"))
+                continue
+            self.callback(request_id, request.execute(), None)
+
+
+class FakeCalendarService:
+    """In-process stand-in for the Google Calendar service that counts calls
+    
+    Each calendarId gets its own event store. quota limits the requests per
+    second of each calendar; requests beyond it are answered with 403
+    rateLimitExceeded. Safe to share between threads.
+    """
+    
+    def __init__(self, page_size=2500, latency=0.0, rate_limit_every=0, quota=None):
+        self.page_size = page_size
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.quota = quota
+        self.calendars = {}
+        self.calls = {"list": 0, "insert": 0, "update": 0, "delete": 0, "batch": 0}
+        self.sub_requests = 0
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+        self.threads = {}   # calendarId -> threads that called it
+        self._recent = {}
+        self._next_id = 0
+    
+    @property
+    def store(self):
+        """Events of every calendar by id (a single calendar in most benchmarks)"""
+        with self.lock:
+            return {event_id: event for events in self.calendars.values() for event_id, event in events.items()}
+    
+    def over_quota(self, calendar_id):
+        """Count one request against a calendar's quota (call with the lock held)"""
+        if not self.quota:
+            return False
+        now = time.monotonic()
+        recent = self._recent.setdefault(calendar_id, [])
+        while recent and recent[0] <= now - 1.0:
+            recent.pop(0)
+        if len(recent) >= self.quota:
+            return True
+        recent.append(now)
+        return False
+    
+    def events(self):
+        return self
+    
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+    
+    def _request(self, name, calendar_id, result):
+        service = self
+        
+        class Request:
+            def execute(self):
+                with service.lock:
+                    service.calls[name] += 1
+                    service.threads.setdefault(calendar_id, set()).add(threading.get_ident())
+                    return result(service.calendars.setdefault(calendar_id, {}))
+        
+        request = Request()
+        request.calendar_id = calendar_id
+        return request
+    
+    def list(self, calendarId, timeMin=None, timeMax=None, pageToken=None, maxResults=250, fields=None, **kwargs):
+        def result(store):
+            def sort_key(event):
+                return [event["start"]["dateTime"], event["id"]]
+            
+            # Cursor-style page tokens stay valid while events are deleted
+            items = sorted(store.values(), key=sort_key)
+            if pageToken:
+                cursor = json.loads(pageToken)
+                items = [e for e in items if sort_key(e) > cursor]
+            page_size = min(maxResults, self.page_size)
+            page_items = items[:page_size]
+            if fields and "items(" in fields:
+                keep = fields.split("items(", 1)[1].rstrip(")").split(",")
+                page_items = [{k: e[k] for k in keep if k in e} for e in page_items]
+            page = {"items": page_items}
+            if len(items) > page_size:
+                page["nextPageToken"] = json.dumps(sort_key(items[page_size - 1]))
+            return page
+        return self._request("list", calendarId, result)
+    
+    def insert(self, calendarId, body):
+        def result(store):
+            self._next_id += 1
+            event = dict(body, id=f"ev{self._next_id}")
+            store[event["id"]] = event
+            return event
+        return self._request("insert", calendarId, result)
+    
+    def update(self, calendarId, eventId, body):
+        def result(store):
+            store[eventId] = dict(body, id=eventId)
+            return store[eventId]
+        return self._request("update", calendarId, result)
+    
+    def delete(self, calendarId, eventId):
+        return self._request("delete", calendarId, lambda store: store.pop(eventId) and "")
+
+
+def bench_google_sync(count=1000, changed=3):
+    """Count API calls of clear-and-reinsert vs incremental sync after a small change"""
+    from Exporters import GoogleCalendarExporter
+    
+    events = make_events(count)
+    window = ("2025-01-01T00:00:00Z", "2026-01-01T00:00:00Z")
+    service = FakeCalendarService()
+    exporter = GoogleCalendarExporter(service=service)
+    with contextlib.redirect_stdout(io.StringIO()):
+        exporter.sync(events, *window)
+    
+    # A few lectures move to another room
+    events = [Event.from_dict(e.to_dict()) for e in events]
+    for event in events[:changed]:
+        event["room"] = "L1 (125)"
+    
+    results = {}
+    for mode in ("incremental", "replace"):
+        for name in service.calls:
+            service.calls[name] = 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if mode == "replace":
+                exporter.clear_calendar(*window)
+                exporter.export(events, clear_first=False)
+            else:
+                exporter.sync(events, *window)
+        elapsed = time.perf_counter() - start
+        results[mode] = {"seconds": elapsed, "calls": dict(service.calls)}
+        http_calls = service.calls["list"] + service.calls["batch"]
+        print(f"google_sync   {mode:<12} {http_calls:6d} HTTP round trips  {service.calls}")
+    
+    return results
+
+
+def bench_google_batching(count=1000, latency=0.01, batch_sizes=(1, 50, 200), rate_limit_every=97):
+    """Time a full push through the batch path at several batch sizes"""
+    from Exporters import GoogleCalendarExporter
+    
+    events = make_events(count)
+    saved = dict(config.GOOGLE_CALENDAR)
+    results = {}
+    try:
+        config.GOOGLE_CALENDAR["retry_backoff"] = 0.01
+        for batch_size in batch_sizes:
+            config.GOOGLE_CALENDAR["batch_size"] = batch_size
+            service = FakeCalendarService(latency=latency, rate_limit_every=rate_limit_every)
+            exporter = GoogleCalendarExporter(service=service)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                exporter.export(events, clear_first=False)
+            elapsed = time.perf_counter() - start
+            results[batch_size] = {"seconds": elapsed, "batches": service.calls["batch"],
+                                   "stored": len(service.store)}
+            print(f"google_batch  size={batch_size:<4} {elapsed:8.3f}s  batches={service.calls['batch']:<5} "
+                  f"stored={len(service.store)}/{count}")
+    finally:
+        config.GOOGLE_CALENDAR.clear()
+        config.GOOGLE_CALENDAR.update(saved)
+    
+    return results
+
+
+def bench_google_calendars(count=4000, calendars=8, latency=0.05, parallel=(1, 4, 8), quota=40):
+    """Routed sync of one calendar per group: serial vs parallel workers, then a per-calendar quota with and
+    without a throttle"""
+    from Exporters import GoogleCalendarExporter
+    
+    events = make_events(count)
+    groups = sorted({event.group for event in events})[:calendars]
+    routes = [{"name": group, "calendar_id": f"{group}@group.calendar.google.com", "group": group}
+              for group in groups]
+    job = {"filters": config.FILTERS, "target": None, "months": None}
+    expected = {route["calendar_id"]: sum(1 for e in events if e.group == route["group"]) for route in routes}
+    
+    def sync(service, **settings):
+        with config_override(DATE_RANGE={"from_year": 2025, "from_month": 1, "to_year": 2025, "to_month": 12},
+                             GOOGLE_CALENDAR=dict(routes=routes, default_calendar=False, sync_mode="incremental",
+                                                  **settings)):
+            exporter = GoogleCalendarExporter(service=service)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                exporter.run(events, job)
+            elapsed = time.perf_counter() - start
+        stored = all(len(service.calendars.get(calendar_id, {})) == n for calendar_id, n in expected.items())
+        ordered = all(len(threads) == 1 for threads in service.threads.values())
+        requests = service.sub_requests + service.calls["list"]
+        return {"seconds": elapsed, "requests": requests, "per_second": requests / elapsed,
+                "rate_limited": service.rate_limited, "stored": stored, "one_worker_per_calendar": ordered}
+    
+    results = {}
+    for workers in parallel:
+        result = results[f"parallel_{workers}"] = sync(FakeCalendarService(latency=latency), max_calendars=workers)
+        print(f"google_calendars {len(routes)} calendars, {workers} at a time {result['seconds']:7.3f}s  "
+              f"{result['per_second']:6.0f} requests/s  stored={result['stored']}  "
+              f"in order={result['one_worker_per_calendar']}")
+    
+    # The fake answers 403 to everything over quota requests per second per calendar
+    for name, rate in (("unthrottled", None), ("throttled", quota)):
+        result = results[f"quota_{name}"] = sync(FakeCalendarService(latency=latency, quota=quota),
+                                                 max_calendars=max(parallel), batch_size=20,
+                                                 retry_backoff=0.5, requests_per_second=rate)
+        print(f"google_calendars quota {quota}/s, {name:<11} {result['seconds']:7.3f}s  "
+              f"{result['per_second']:6.0f} requests/s  rate-limited={result['rate_limited']:<5} "
+              f"stored={result['stored']}")
+    return results
+
+
+def bench_pipeline(count=5000, latency=0.05):
+    """A Google push (fake service), JSON and ICS run one after another vs concurrently"""
+    from Events import normalize_events
+    from Exporters import GoogleCalendarExporter
+    import Pipeline
+    
+    events = normalize_events(make_events(count), config.GOOGLE_CALENDAR["timezone"])
+    saved_output, saved_google = dict(config.OUTPUT), Pipeline.EXPORTERS["google_calendar"]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            config.OUTPUT.update(json_file=os.path.join(tmp, "events.json"), ics_file=os.path.join(tmp, "events.ics"))
+            Pipeline.register_exporter(
+                "google_calendar", lambda: GoogleCalendarExporter(service=FakeCalendarService(latency=latency)))
+            for max_workers in (1, 4):
+                pipeline = Pipeline.ExportPipeline(["google_calendar", "json", "ics"], max_workers=max_workers)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    outcomes = pipeline.run(events)
+                    elapsed = time.perf_counter() - start
+                results[max_workers] = elapsed
+                stages = ", ".join(f"{name} {outcome['seconds']:.2f}s (done at {outcome['finished']:.2f}s)"
+                                   for name, outcome in outcomes.items())
+                print(f"pipeline      workers={max_workers:<3} {elapsed:8.3f}s  ({stages})")
+        finally:
+            config.OUTPUT.clear()
+            config.OUTPUT.update(saved_output)
+            Pipeline.register_exporter("google_calendar", saved_google)
+    
+    return results
+
+
+def bench_clear_calendar(count=10000, page_size=250):
+    """Stream-delete a large calendar and check nothing is left behind"""
+    from Exporters import GoogleCalendarExporter
+    
+    service = FakeCalendarService(page_size=page_size)
+    exporter = GoogleCalendarExporter(service=service)
+    with contextlib.redirect_stdout(io.StringIO()):
+        exporter.sync(make_events(count), "2025-01-01T00:00:00Z", "2026-01-01T00:00:00Z")
+        service.calls.update({name: 0 for name in service.calls})
+        start = time.perf_counter()
+        exporter.clear_calendar("2025-01-01T00:00:00Z", "2026-01-01T00:00:00Z")
+        elapsed = time.perf_counter() - start
+    
+    print(f"clear_calendar events={count:<6} {elapsed:8.3f}s  pages={service.calls['list']:<4} "
+          f"batches={service.calls['batch']:<4} left={len(service.store)}")
+    return {"seconds": elapsed, "pages": service.calls["list"], "left": len(service.store)}
+
+
+def bench_normalize(count=100000):
+    """Per-event cost of the old per-exporter strptime/localize vs normalize_events"""
+    import pytz
+    from datetime import datetime
+    import Events
+    
+    timezone_name = config.GOOGLE_CALENDAR["timezone"]
+    payload = [event.to_dict() for event in make_events(count)]
+    
+    # Before: what each of ICSExporter and GoogleCalendarExporter did per event
+    timezone = pytz.timezone(timezone_name)
+    start = time.perf_counter()
+    for data in payload:
+        date_obj = datetime.strptime(data["date"], "%Y-%m-%d")
+        start_time = datetime.strptime(data["start_time"], "%H:%M")
+        end_time = datetime.strptime(data["end_time"], "%H:%M")
+        timezone.localize(date_obj.replace(hour=start_time.hour, minute=start_time.minute))
+        timezone.localize(date_obj.replace(hour=end_time.hour, minute=end_time.minute))
+    before = (time.perf_counter() - start) / count
+    
+    # After: parse at Event construction, then one memoized localize pass
+    Events._parse_date.cache_clear()
+    Events._parse_time.cache_clear()
+    Events._localize.cache_clear()
+    start = time.perf_counter()
+    events = [Event.from_dict(data) for data in payload]
+    built = time.perf_counter()
+    Events.normalize_events(events, timezone_name)
+    after_build = (built - start) / count
+    after_normalize = (time.perf_counter() - built) / count
+    
+    print(f"normalize     before {before * 1e6:7.2f} us/event per exporter")
+    print(f"normalize     after  {after_build * 1e6:7.2f} us/event to build + {after_normalize * 1e6:.2f} us/event "
+          f"to localize, once for all exporters ({count} events)")
+    return {"before": before, "after_build": after_build, "after_normalize": after_normalize}
+
+
+class CountingWriter:
+    """Text stream wrapper that counts write() calls reaching the underlying stream"""
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.writes = 0
+    
+    def write(self, text):
+        self.writes += 1
+        return self.stream.write(text)
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def isatty(self):
+        return False
+
+
+def bench_table(count=50000):
+    """Old print() per row vs the buffered TableExporter, to a line-buffered /dev/null like a terminal"""
+    from Exporters import TableExporter, _day_label
+    
+    events = make_events(count)
+    results = {}
+    with open(os.devnull, "w", buffering=1, encoding="utf-8") as devnull:
+        # Before: fixed widths, f-strings and one print (one line-buffered write) per row
+        out = CountingWriter(devnull)
+        w = {'date': 12, 'time': 13, 'title': 40, 'room': 10, 'group': 22, 'lecturer': 20, 'type': 12, 'note': 15}
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(out):
+            for event in events:
+                date_str = _day_label(event.day) if event.day else event.date or ''
+                title, group = event.get('title', 'N/A'), event.get('group', 'N/A')
+                lecturer, note = event.get('lecturer', 'N/A'), event.get('description', '') or '-'
+                if len(date_str) > w['date']: date_str = date_str[:w['date']]
+                if len(title) > w['title']: title = title[:w['title'] - 3] + "..."
+                if len(group) > w['group']: group = group[:w['group'] - 3] + "..."
+                if len(lecturer) > w['lecturer']: lecturer = lecturer[:w['lecturer'] - 3] + "..."
+                if len(note) > w['note']: note = note[:w['note'] - 3] + "..."
+                time_str = f"{event.get('start_time', 'N/A')}-{event.get('end_time', 'N/A')}"
+                print(f"{date_str:<{w['date']}} | {time_str:<{w['time']}} | {title:<{w['title']}} | "
+                      f"{event.get('room', '') or '-':<{w['room']}} | {group:<{w['group']}} | "
+                      f"{lecturer:<{w['lecturer']}} | {event.get('type', 'N/A'):<{w['type']}} | {note:<{w['note']}}")
+        results["print"] = {"seconds": time.perf_counter() - start, "writes": out.writes}
+        
+        for name, options in (("buffered", {}), ("paged", {"page_size": 5000}),
+                              ("csv", {"table_format": "csv"})):
+            out = CountingWriter(devnull)
+            TableExporter.stream = out
+            try:
+                start = time.perf_counter()
+                TableExporter.export(events, config.FILTERS, **options)
+                results[name] = {"seconds": time.perf_counter() - start, "writes": out.writes}
+            finally:
+                TableExporter.stream = None
+    
+    for name, result in results.items():
+        print(f"table         {name:<9} {result['seconds'] * 1000:8.1f} ms  {result['writes']:>6} writes  ({count} events)")
+    return results
+
+
+def iter_events(count, year=2025):
+    """Generate synthetic events lazily (nothing is kept in memory)"""
+    produced = 0
+    while produced < count:
+        for event in make_events(min(count - produced, 12 * 28 * 6), year):
+            yield event
+            produced += 1
+        year += 1
+
+
+def make_dst_events(timezone_name, year=2026):
+    """Lectures spanning each DST switch of a zone, plus one with a long multi-byte title"""
+    from dateutil import tz
+    
+    zone = tz.gettz(timezone_name)
+    day = datetime(year, 1, 1)
+    dates = [day.strftime("%Y-%m-%d")]
+    while day.year == year:
+        if day.replace(tzinfo=zone).utcoffset() != day.replace(hour=23, tzinfo=zone).utcoffset():
+            dates.append(day.strftime("%Y-%m-%d"))
+        day += timedelta(days=1)
+    # Starts before and ends after the switch, avoiding the skipped and repeated hours
+    events = [Event(date, "00:30", "05:00", "Night lab", "101", "3401BNA", "Lecturer 1", "Laboratory", "")
+              for date in dates]
+    title = "Programmēšanas valodu teorija; ģeometrija, šķirošana — 情報理論 " * 3
+    events.append(Event(dates[0], "10:30", "12:00", title, "202", "3402BNA,3403BNA", "Lecturer 2", "Lecture", ""))
+    return events
+
+
+def check_ics(filename, events):
+    """Parse an ICS file with icalendar and compare it with the exported events
+    
+    Returns a list of mismatches: UID, SUMMARY and the local DTSTART/DTEND
+    with their UTC offsets, resolved through the file's own VTIMEZONE.
+    """
+    import icalendar
+    from Events import with_stable_ids
+    
+    with open(filename, "rb") as f:
+        calendar = icalendar.Calendar.from_ical(f.read())
+    zones = calendar.walk("VTIMEZONE")
+    # lookup_tzid=False: build the zone from the file rather than the system tz database
+    zone = zones[0].to_tz(lookup_tzid=False) if zones else None
+    parsed = {str(component["UID"]): component for component in calendar.walk("VEVENT")}
+    
+    mismatches = []
+    for event_id, event in with_stable_ids(events):
+        component = parsed.pop(f"{event_id}@tsi.lv", None)
+        if component is None:
+            mismatches.append(f"{event.date} {event.start_time}: missing UID {event_id}")
+            continue
+        if str(component["SUMMARY"]) != event.title:
+            mismatches.append(f"{event.date} {event.start_time}: SUMMARY {str(component['SUMMARY'])!r}")
+        for name, expected in (("DTSTART", event.start_at), ("DTEND", event.end_at)):
+            local = component[name].dt.replace(tzinfo=None)
+            if local != expected.replace(tzinfo=None):
+                mismatches.append(f"{event.date} {event.start_time}: {name} {local}")
+            elif zone and expected.tzinfo and local.replace(tzinfo=zone).utcoffset() != expected.utcoffset():
+                mismatches.append(f"{event.date} {event.start_time}: {name} offset "
+                                  f"{local.replace(tzinfo=zone).utcoffset()} != {expected.utcoffset()}")
+    mismatches += [f"unexpected UID {uid}" for uid in parsed]
+    return mismatches
+
+
+def bench_ics(count=20000, filename=None, zones=("Europe/Riga", "America/New_York", "Australia/Sydney")):
+    """Write a streamed ICS file, report peak memory and check a parsed round trip per zone"""
+    import tracemalloc
+    from Exporters import ICSExporter
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = filename or f"{tmp}/bench.ics"
+        tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ICSExporter.export(iter_events(count), filename)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"ics           events={count:<7} {elapsed:8.3f}s  peak={peak / 1e6:.1f} MB")
+        
+        # Round trip through an independent parser when one is installed
+        results = {"seconds": elapsed, "peak_bytes": peak, "mismatches": {}}
+        if importlib.util.find_spec("icalendar") is None:
+            print("ics           round trip skipped (icalendar not installed)")
+            return results
+        for zone in zones:
+            events = make_dst_events(zone)
+            with config_override(GOOGLE_CALENDAR={"timezone": zone}), contextlib.redirect_stdout(io.StringIO()):
+                ICSExporter.export(events, f"{tmp}/round_trip.ics")
+                mismatches = check_ics(f"{tmp}/round_trip.ics", events)
+            results["mismatches"][zone] = mismatches
+            print(f"ics           round trip {zone:<18} events={len(events):<3} mismatches={len(mismatches)}")
+            for mismatch in mismatches[:5]:
+                print(f"                {mismatch}")
+    return results
+
+
+def bench_event_store(count=1000000, queries=50):
+    """Compound queries: EventStore vs list comprehension + sorted"""
+    from Events import EventStore
+    from TSICalendar import sort_events
+    
+    events = list(iter_events(count))
+    start = time.perf_counter()
+    store = EventStore(events)
+    build = time.perf_counter() - start
+    
+    groups = store.values("group")
+    rooms = store.values("room")
+    criteria = [{"group": groups[i % len(groups)], "room": rooms[(i * 7) % len(rooms)],
+                 "date_from": "2026-02-01", "date_to": "2026-05-31"} for i in range(queries)]
+    
+    start = time.perf_counter()
+    for query in criteria:
+        filters = {"room": query["room"], "lecturer": "reset_lecturer", "group": query["group"]}
+        scanned = sort_events([e for e in events if query["date_from"] <= e.date <= query["date_to"]
+                               and portal_matches(e, filters)])
+    scan = (time.perf_counter() - start) / queries
+    
+    start = time.perf_counter()
+    for query in criteria:
+        indexed = store.query(**query)
+    indexed_time = (time.perf_counter() - start) / queries
+    
+    assert indexed == scanned
+    print(f"event_store   events={count:<8} build {build:6.2f}s  scan+sort {scan * 1000:8.2f} ms/query  "
+          f"indexed {indexed_time * 1000:8.3f} ms/query")
+    return {"build_seconds": build, "scan_seconds": scan, "indexed_seconds": indexed_time}
+
+
+def bench_json(count=500000):
+    """File size, write and read time for every JSON mode and compression"""
+    from Exporters import JSONExporter, HAS_ZSTD
+    
+    events = list(iter_events(count))
+    compressions = [None, "gzip"] + (["zstd"] if HAS_ZSTD else [])
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in JSONExporter.MODES:
+            for compression in compressions:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    filename = JSONExporter.export(events, f"{tmp}/bench.json", mode, compression)
+                written = time.perf_counter() - start
+                size = os.path.getsize(filename)
+                start = time.perf_counter()
+                loaded = sum(1 for _ in JSONExporter.load(filename))
+                read = time.perf_counter() - start
+                os.remove(filename)
+                
+                name = f"{mode}+{compression or 'none'}"
+                results[name] = {"bytes": size, "write_seconds": written, "read_seconds": read}
+                print(f"json          {name:<14} {size / 1e6:8.1f} MB  write {written:6.2f}s  "
+                      f"read {read:6.2f}s  ({loaded} events)")
+    
+    return results
+
+
+def bench_archive(years=(2024, 2025), rooms=120):
+    """Report queries on a multi-year archive: load JSON and scan vs indexed SQLite (and Parquet)"""
+    import tracemalloc
+    from Exporters import JSONExporter, SQLiteExporter, ParquetExporter, HAS_PYARROW
+    from TSICalendar import sort_events
+    
+    events = [event for year in years for event in make_institute_events(year, rooms)]
+    # Payload keys outside Event.FIELDS must survive every archive format
+    events[0].extra = {"online_link": "https://example.org/lecture"}
+    last = years[-1]
+    queries = [
+        {"room": "A105", "date_from": f"{last}-03-01", "date_to": f"{last}-05-31"},
+        {"group": "3410BNA", "date_from": f"{last}-10-01", "date_to": f"{last}-10-31"},
+        {"lecturer": "lecturer 7"},
+    ]
+    
+    def matches(event, field, value):
+        """EventStore rules: lecturer by part of the name, group by one of its groups"""
+        if field == "lecturer":
+            return value.lower() in (event.lecturer or "").lower()
+        if field == "group":
+            return value in event.group.split(", ")
+        return getattr(event, field) == value
+    
+    def scan(loaded, query):
+        """A report without an index: test every event, then sort"""
+        date_from, date_to = query.get("date_from", ""), query.get("date_to", "9999")
+        criteria = [(field, value) for field, value in query.items() if field not in ("date_from", "date_to")]
+        return sort_events([event for event in loaded if date_from <= event.date <= date_to and all(
+            matches(event, field, value) for field, value in criteria)])
+    
+    def measure(run):
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result, elapsed, peak
+    
+    results = {"events": len(events)}
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        paths = {}
+        for name, export in (("json", lambda: JSONExporter.export(events, f"{tmp}/archive.json", "pretty")),
+                             ("ndjson", lambda: JSONExporter.export(events, f"{tmp}/archive.ndjson", "ndjson")),
+                             ("sqlite", lambda: SQLiteExporter.export(events, f"{tmp}/archive.sqlite")),
+                             ("parquet", lambda: HAS_PYARROW and ParquetExporter.export(events, f"{tmp}/parquet"))):
+            start = time.perf_counter()
+            paths[name] = export()
+            if paths[name]:
+                results[name] = {"write_seconds": time.perf_counter() - start,
+                                 "bytes": sum(os.path.getsize(os.path.join(root, file))
+                                              for root, _, files in os.walk(paths[name]) for file in files)
+                                 if os.path.isdir(paths[name]) else os.path.getsize(paths[name])}
+        
+        expected = None
+        for name in ("json", "ndjson", "sqlite", "parquet"):
+            if name not in results:
+                continue
+            if name == "sqlite":
+                run = lambda: [SQLiteExporter.query(paths[name], **query) for query in queries]
+            else:
+                load = ParquetExporter.load if name == "parquet" else JSONExporter.load
+                run = lambda: [scan(loaded, query) for loaded in [list(load(paths[name]))] for query in queries]
+            answers, elapsed, peak = measure(run)
+            loader = {"sqlite": SQLiteExporter.load, "parquet": ParquetExporter.load}.get(name, JSONExporter.load)
+            assert [e.extra for e in loader(paths[name]) if e.extra] == [events[0].extra], (name, "extra")
+            counts = [len(answer) for answer in answers]
+            assert expected is None or counts == expected, (name, counts, expected)
+            expected = counts
+            results[name].update({"query_seconds": elapsed, "query_peak_bytes": peak})
+        
+        # Re-export one month of a live archive
+        month = [event for event in events if event.date.startswith(f"{last}-10")]
+        start = time.perf_counter()
+        SQLiteExporter.export(month, paths["sqlite"])
+        results["sqlite"]["upsert_month_seconds"] = time.perf_counter() - start
+        assert len(SQLiteExporter.load(paths["sqlite"])) == len(events)
+    
+    print(f"archive       {len(events)} events over {len(years)} years; {len(queries)} report queries "
+          f"(answers: {', '.join(map(str, expected))})")
+    for name in ("json", "ndjson", "sqlite", "parquet"):
+        if name in results:
+            result = results[name]
+            print(f"archive       {name:<8} {result['bytes'] / 1e6:7.1f} MB  write {result['write_seconds']:6.2f}s  "
+                  f"load+query {result['query_seconds']:7.3f}s  peak {result['query_peak_bytes'] / 1e6:7.1f} MB")
+    if "parquet" not in results:
+        print("archive       parquet  skipped (pyarrow not installed)")
+    print(f"archive       sqlite upsert of one month ({len(month)} events) {results['sqlite']['upsert_month_seconds']:.2f}s")
+    return results
+
+
+def bench_parse_events(fixtures=None, repeat=20, events_per_day=40):
+    """Compare the fast-path event extractor with the BeautifulSoup fallback"""
+    from TSICalendar import TSICalendar
+    
+    if fixtures:
+        pages = []
+        for path in sorted(glob.glob(fixtures)):
+            with open(path, encoding="utf-8") as f:
+                pages.append(f.read())
+    else:
+        pages = [make_calendar_html(2025, month, events_per_day) for month in range(1, 13)]
+    
+    if not pages:
+        print(f"No fixture pages match '{fixtures}'")
+        return {}
+    
+    results = {}
+    for name, extract in (("soup", TSICalendar._extract_events_soup),
+                          ("fast", TSICalendar._extract_events_fast)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for page in pages:
+                extract(page)
+        elapsed = (time.perf_counter() - start) / (repeat * len(pages))
+        results[name] = elapsed
+        print(f"parse_events  {name:<5} {elapsed * 1000:8.3f} ms/page  ({len(pages)} pages)")
+    
+    print(f"parse_events  speedup {results['soup'] / results['fast']:.1f}x")
+    return results
+
+
+def bench_stages(events_per_day=40, months=12, repeat=3):
+    """Per-stage cost on synthetic month pages: parse, filter, sort, table, JSON, ICS, Google bodies"""
+    from TSICalendar import TSICalendar, filter_events, sort_events
+    from Events import normalize_events
+    from Exporters import TableExporter, JSONExporter, ICSExporter, GoogleCalendarExporter
+    
+    pages = [make_calendar_html(2025, month, events_per_day) for month in range(1, months + 1)]
+    results = {}
+    with config_override(CACHE={"enabled": False}, DISPLAY={"show_canceled": False}), \
+            tempfile.TemporaryDirectory() as tmp:
+        calendar = TSICalendar()
+        events = [event for page in pages for event in calendar._parse_events(page)]
+        normalize_events(events, config.GOOGLE_CALENDAR["timezone"])
+        google = GoogleCalendarExporter(service=FakeCalendarService())
+        
+        stages = {
+            "parse": lambda: [calendar._parse_events(page) for page in pages],
+            "filter": lambda: filter_events(events),
+            "sort": lambda: sort_events(events, "room"),
+            "table": lambda: TableExporter.export(events),
+            "json": lambda: JSONExporter.export(events, f"{tmp}/bench.json", "compact"),
+            "ics": lambda: ICSExporter.export(events, f"{tmp}/bench.ics"),
+            "google_body": lambda: [google._build_event_body(event) for event in events],
+        }
+        for name, stage in stages.items():
+            best = None
+            for _ in range(repeat):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    stage()
+                    elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = {"seconds": best, "us_per_event": best / len(events) * 1e6}
+            print(f"stage         {name:<12} {best * 1000:9.2f} ms  {results[name]['us_per_event']:7.2f} us/event  "
+                  f"({len(events)} events)")
+    
+    return results
+
+
+def bench_end_to_end(months=12, latency=0.2, events_per_day=6):
+    """main.py against the stand-in portal: a cold run (login, empty cache), then a cached re-run"""
+    from TSICalendar import RESET_FILTERS
+    from Exporters import JSONExporter
+    import main as cli
+    
+    to_year, to_month = 2025 + (months - 1) // 12, (months - 1) % 12 + 1
+    results = {}
+    with stand_in_server(latency, events_per_day) as server, tempfile.TemporaryDirectory() as tmp:
+        json_file = os.path.join(tmp, "calendar.json")
+        overrides = {
+            "FILTERS": RESET_FILTERS,
+            "DATE_RANGE": {"from_year": 2025, "from_month": 1, "to_year": to_year, "to_month": to_month},
+            "CACHE": {"enabled": True, "directory": os.path.join(tmp, "cache")},
+            "OUTPUT": {"formats": ["json", "ics"], "json_file": json_file, "ics_file": os.path.join(tmp, "calendar.ics")},
+        }
+        saved_targets, saved_argv = config.TARGETS, sys.argv
+        config.TARGETS, sys.argv = [], ["main.py"]
+        try:
+            with config_override(**overrides):
+                for run in ("cold", "cached"):
+                    before = sum(count for path, count in server.requests.items() if path != "lock")
+                    log = io.StringIO()
+                    with contextlib.redirect_stdout(log):
+                        start = time.perf_counter()
+                        cli.main()
+                        elapsed = time.perf_counter() - start
+                    if "Export completed successfully" not in log.getvalue():
+                        raise RuntimeError(f"end-to-end run failed:\n{log.getvalue()[-2000:]}")
+                    requests_made = sum(count for path, count in server.requests.items() if path != "lock") - before
+                    events = sum(1 for _ in JSONExporter.load(json_file))
+                    results[run] = {"seconds": elapsed, "requests": requests_made, "events": events}
+                    print(f"end_to_end    {run:<7} {elapsed:8.3f}s  requests={requests_made:<4} ({events} events)")
+        finally:
+            config.TARGETS, sys.argv = saved_targets, saved_argv
+    
+    return results
+
+
+# Runs main.py in a fresh interpreter against a given portal and records its peak RSS (KiB).
+# VmHWM is this process's own high-water mark; ru_maxrss also counts the parent's RSS at fork.
+_STREAM_RUN = """
+import json, re, resource, sys
+import config, main
+settings = json.loads(sys.argv[1])
+for name, value in settings["config"].items():
+    if isinstance(getattr(config, name), dict):
+        getattr(config, name).update(value)
+    else:
+        setattr(config, name, value)
+sys.argv = ["main.py"] + settings["args"]
+main.main()
+try:
+    with open("/proc/self/status") as f:
+        peak = int(re.search(r"VmHWM:\\s+(\\d+)", f.read()).group(1))
+except (OSError, AttributeError):
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+with open(settings["rss_file"], "w") as f:
+    f.write(str(peak))
+"""
+
+
+def bench_stream(months=24, events_per_day=100, latency=0.0, sort_orders=("date", "room")):
+    """Peak RSS and time of a full run, collected vs --stream, with the outputs compared"""
+    import re
+    import sqlite3
+    from TSICalendar import RESET_FILTERS
+    
+    to_year, to_month = 2025 + (months - 1) // 12, (months - 1) % 12 + 1
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    with stand_in_server(latency, events_per_day), tempfile.TemporaryDirectory() as tmp:
+        for sort_by in sort_orders:
+            outputs = {}
+            for mode in ("collected", "stream"):
+                prefix = os.path.join(tmp, f"{sort_by}_{mode}")
+                settings = {
+                    "config": {
+                        "BASE_URL": config.BASE_URL, "LOGIN_PAGE": config.LOGIN_PAGE, "AUTH_URL": config.AUTH_URL,
+                        "CALENDAR_URL": config.CALENDAR_URL, "SESSION": config.SESSION, "TARGETS": [],
+                        "FILTERS": RESET_FILTERS,
+                        "DATE_RANGE": {"from_year": 2025, "from_month": 1, "to_year": to_year, "to_month": to_month},
+                        "CACHE": {"enabled": False},
+                        "DISPLAY": {"sort_by": sort_by},
+                        "METRICS": {"enabled": False},
+                        "OUTPUT": {"formats": ["table", "json", "ics", "sqlite"], "json_file": f"{prefix}.json",
+                                   "ics_file": f"{prefix}.ics", "sqlite_file": f"{prefix}.sqlite"},
+                    },
+                    "args": ["--stream"] if mode == "stream" else [],
+                    "rss_file": f"{prefix}.rss",
+                }
+                with open(f"{prefix}.log", "w", encoding="utf-8") as log:
+                    start = time.perf_counter()
+                    subprocess.run([sys.executable, "-c", _STREAM_RUN, json.dumps(settings)], cwd=here,
+                                   stdout=log, stderr=subprocess.STDOUT, check=True)
+                    elapsed = time.perf_counter() - start
+                with open(f"{prefix}.rss", encoding="utf-8") as f:
+                    peak_mib = int(f.read()) / 1024
+                
+                # Digests only, so this process stays small while the runs are compared
+                digests = {"json": hashlib.sha1(), "ics": hashlib.sha1(), "sqlite": hashlib.sha1()}
+                with open(f"{prefix}.json", "rb") as f:
+                    for line in f:
+                        digests["json"].update(line)
+                with open(f"{prefix}.ics", "rb") as f:
+                    for line in f:
+                        digests["ics"].update(re.sub(rb"DTSTAMP:\S+", b"", line))
+                connection = sqlite3.connect(f"{prefix}.sqlite")
+                events = 0
+                for row in connection.execute("SELECT * FROM events ORDER BY event_key"):
+                    digests["sqlite"].update(repr(row).encode("utf-8"))
+                    events += 1
+                connection.close()
+                outputs[mode] = {name: digest.hexdigest() for name, digest in digests.items()}
+                for suffix in (".json", ".ics", ".sqlite", ".sqlite-wal", ".sqlite-shm", ".log"):
+                    with contextlib.suppress(OSError):
+                        os.remove(prefix + suffix)
+                results[f"{sort_by}.{mode}"] = {"seconds": elapsed, "peak_rss_mib": peak_mib, "events": events}
+                print(f"stream  sort={sort_by:<6} {mode:<9} {elapsed:7.2f}s  peak RSS {peak_mib:7.1f} MiB  "
+                      f"({events} events)")
+            
+            same = outputs["collected"] == outputs["stream"]
+            results[f"{sort_by}.identical"] = same
+            print(f"stream  sort={sort_by:<6} JSON, ICS and SQLite outputs identical: {same}")
+    return results
+
+
+def bench_metrics(calls=200000, events_per_day=40, months=12):
+    """Cost of the instrumentation per call, disabled and enabled, and what one instrumented run records"""
+    import Metrics
+    from TSICalendar import TSICalendar, sort_events
+    from Events import normalize_events
+    from Exporters import JSONExporter, ICSExporter
+    
+    @Metrics.timed("bench")
+    def noop():
+        pass
+    
+    def plain():
+        pass
+    
+    def per_call(function):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        return (time.perf_counter() - start) / calls * 1e9
+    
+    operations = {
+        "call": plain,
+        "timed": noop,
+        "timer": lambda: Metrics.timer("bench").__enter__().__exit__(None, None, None),
+        "count": lambda: Metrics.count("bench", outcome="hits"),
+        "observe": lambda: Metrics.observe("bench_seconds", 0.02),
+    }
+    results = {}
+    was_enabled = Metrics.enabled()
+    try:
+        for state in ("disabled", "enabled"):
+            Metrics.enable() if state == "enabled" else Metrics.disable()
+            results[state] = {name: per_call(function) for name, function in operations.items()}
+            print(f"metrics       {state:<8} " + "  ".join(f"{name} {ns:6.0f} ns"
+                                                      for name, ns in results[state].items()))
+        
+        pages = [make_calendar_html(2025, month, events_per_day) for month in range(1, months + 1)]
+        with config_override(CACHE={"enabled": False}, DISPLAY={"show_canceled": False}), \
+                tempfile.TemporaryDirectory() as tmp:
+            calendar = TSICalendar()
+            # The first pass only warms up caches and the allocator
+            for state in ("warm-up", "disabled", "enabled"):
+                Metrics.disable()
+                if state == "enabled":
+                    Metrics.enable()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    events = [event for page in pages for event in calendar._parse_events(page)]
+                    normalize_events(events, config.GOOGLE_CALENDAR["timezone"])
+                    events = sort_events(events, "date")
+                    JSONExporter.export(events, f"{tmp}/bench.json", "compact")
+                    ICSExporter.export(events, f"{tmp}/bench.ics")
+                    elapsed = time.perf_counter() - start
+                if state == "warm-up":
+                    continue
+                results[f"run_{state}"] = elapsed
+                print(f"metrics       run {state:<8} {elapsed * 1000:8.1f} ms  ({len(events)} events)")
+            
+            Metrics.write(f"{tmp}/metrics.prom", "prometheus")
+            with open(f"{tmp}/metrics.prom", encoding="utf-8") as f:
+                exposition = f.read()
+            results["series"] = sum(1 for line in exposition.splitlines() if not line.startswith("#"))
+            print(f"metrics       {results['series']} Prometheus series, e.g.")
+            for line in exposition.splitlines():
+                if "stage_seconds_total" in line and not line.startswith("#"):
+                    print(f"                {line}")
+    finally:
+        Metrics.enable() if was_enabled else Metrics.disable()
+    
+    return results
+
+
+def bench_analysis(rooms=120, sizes=(2000, 4000, 8000)):
+    """Conflicts, free slots and occupancy over a synthetic all-institute year; sweep line vs pairwise"""
+    from Analysis import Schedule, KINDS
+    
+    events = make_institute_events(rooms=rooms)
+    results = {"events": len(events)}
+    
+    start = time.perf_counter()
+    schedule = Schedule(events)
+    results["build_seconds"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    conflicts = {kind: len(schedule.conflicts(kind)) for kind in KINDS}
+    results["conflict_seconds"] = time.perf_counter() - start
+    results["conflicts"] = conflicts
+    
+    start = time.perf_counter()
+    slots = schedule.free_slots("2025-01-01", "2025-12-31")
+    results["free_slot_seconds"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    occupancy = schedule.occupancy("2025-01-01", "2025-12-31")
+    results["occupancy_seconds"] = time.perf_counter() - start
+    
+    print(f"analysis      {len(events)} events, {len(schedule)} sessions, {len(schedule.resources('room'))} rooms, "
+          f"{len(schedule.resources('group'))} groups")
+    print(f"analysis      build {results['build_seconds']:.2f}s  conflicts {results['conflict_seconds']:.2f}s "
+          f"({', '.join(f'{kind} {count}' for kind, count in conflicts.items())})")
+    print(f"analysis      free slots {results['free_slot_seconds']:.2f}s "
+          f"({sum(map(len, slots.values()))} slots)  occupancy {results['occupancy_seconds']:.2f}s "
+          f"({len(occupancy['resources'])} x {len(occupancy['dates'])})")
+    
+    # Pairwise comparison of every session, on growing prefixes of the year
+    results["scaling"] = {}
+    for size in sizes:
+        subset = Schedule(events[:size])
+        start = time.perf_counter()
+        swept = sum(len(subset.conflicts(kind)) for kind in KINDS)
+        sweep = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        sessions = [(s, e, items[0].room, items[0].lecturer,
+                     {group.strip() for item in items for group in item.group.split(",")})
+                    for s, e, items in subset.sessions]
+        pairwise = 0
+        for i, (start_a, end_a, room_a, lecturer_a, groups_a) in enumerate(sessions):
+            for start_b, end_b, room_b, lecturer_b, groups_b in sessions[i + 1:]:
+                if start_a < end_b and start_b < end_a:
+                    pairwise += (room_a == room_b) + (lecturer_a == lecturer_b) + len(groups_a & groups_b)
+        pairwise_time = time.perf_counter() - start
+        
+        assert swept == pairwise, (swept, pairwise)
+        results["scaling"][size] = {"sweep": sweep, "pairwise": pairwise_time}
+        print(f"analysis      events={size:<6} sweep {sweep * 1000:8.2f} ms  pairwise {pairwise_time * 1000:9.1f} ms  "
+              f"({swept} conflicts)")
+    return results
+
+
+# name -> function(args) returning that benchmark's results
+BENCHMARKS = {
+    "fetch": lambda args: bench_fetch_period(args.months, args.latency, args.workers),
+    "startup": lambda args: {"login": bench_startup(args.latency), "imports": bench_imports()},
+    "targets": lambda args: bench_targets(months=args.months, latency=args.latency),
+    "cache": lambda args: bench_cache(args.months, args.latency),
+    "plan": lambda args: bench_plan(latency=args.latency),
+    "parse": lambda args: bench_parse_events(args.fixtures, events_per_day=args.events_per_day or 40),
+    "stages": lambda args: bench_stages(args.events_per_day or 40, min(args.months, 12)),
+    "normalize": lambda args: bench_normalize(),
+    "store": lambda args: bench_event_store(),
+    "table": lambda args: bench_table(),
+    "analysis": lambda args: bench_analysis(),
+    "ics": lambda args: bench_ics(),
+    "json": lambda args: bench_json(),
+    "archive": lambda args: bench_archive(),
+    "google": lambda args: {"sync": bench_google_sync(), "batching": bench_google_batching(),
+                            "clear": bench_clear_calendar(), "calendars": bench_google_calendars()},
+    "pipeline": lambda args: bench_pipeline(),
+    "watch": lambda args: bench_watch(min(args.months, 12), args.latency),
+    "e2e": lambda args: bench_end_to_end(args.months, args.latency, args.events_per_day or 6),
+    "stream": lambda args: bench_stream(max(args.months, 24), args.events_per_day or 100),
+    "metrics": lambda args: bench_metrics(events_per_day=args.events_per_day or 40, months=min(args.months, 12)),
+}
+
+
+def run_metadata(args):
+    """Where and how the results were produced"""
+    import platform
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+    }
+
+
+def flatten_results(results, prefix=""):
+    """{"fetch": {"4": 0.12}} -> {"fetch.4": 0.12}, numeric leaves only"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_results(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare_results(baseline_file, results, threshold=0.1):
+    """Print every shared metric next to its baseline; '!' marks changes beyond threshold"""
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = flatten_results(baseline["results"])
+    new = flatten_results(json.loads(json.dumps(results, default=str)))
+    print(f"\nCompared with {baseline_file} (commit {baseline['meta'].get('commit')}):")
+    for key in sorted(old.keys() & new.keys()):
+        change = (new[key] - old[key]) / old[key] if old[key] else 0.0
+        flag = "!" if abs(change) > threshold else " "
+        print(f"{flag} {key:<50} {old[key]:>12.4g} -> {new[key]:>12.4g}  {change:+7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TSI Calendar Scraper benchmarks")
+    parser.add_argument("bench", nargs="*",
+                        help=f"Benchmarks to run: all (default), {', '.join(BENCHMARKS)}")
+    parser.add_argument("--months", type=int, default=12, help="Months to fetch")
+    parser.add_argument("--latency", type=float, default=0.2, help="Injected server latency (seconds)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="Worker counts to compare")
+    parser.add_argument("--events-per-day", type=int, help="Scale of the synthetic month pages")
+    parser.add_argument("--fixtures", help="Glob of stored month pages for the parse benchmark")
+    parser.add_argument("--write-fixtures", metavar="DIR", help="Store synthetic month pages in DIR and exit")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare with results written by --output")
+    args = parser.parse_args()
+    
+    if args.write_fixtures:
+        write_fixtures(args.write_fixtures, min(args.months, 12), args.events_per_day or 40)
+        return
+    
+    unknown = [name for name in args.bench if name != "all" and name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+    names = list(BENCHMARKS) if not args.bench or "all" in args.bench else args.bench
+    results = {name: BENCHMARKS[name](args) for name in names}
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"meta": run_metadata(args), "results": results}, f, indent=2, default=str)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare_results(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
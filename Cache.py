@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+On-disk cache for parsed month pages
+"""
+
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+from dateutil.relativedelta import relativedelta
+import config
+import Metrics
+
+
+class AtomicFile:
+    """A file written under a unique temp name and moved over path on commit()
+    
+    Readers see the old file or the new one, never a partial write; overlapping
+    runs (cron) and threads never share a temp file. The file gets permissions
+    (owner-only by default). Used as a context manager it commits on success
+    and aborts on an error.
+    """
+    
+    def __init__(self, path, mode="w", permissions=0o600, **open_args):
+        self.path = path
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            os.fchmod(fd, permissions)
+            self.file = os.fdopen(fd, mode, **open_args)
+        except BaseException:
+            os.close(fd)
+            self._remove()
+            raise
+    
+    def commit(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+    
+    def abort(self):
+        self.file.close()
+        self._remove()
+    
+    def _remove(self):
+        with contextlib.suppress(OSError):
+            os.remove(self.tmp_path)
+    
+    def __enter__(self):
+        return self.file
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                self.commit()
+            except BaseException:
+                self._remove()
+                raise
+        else:
+            self.abort()
+
+
+class MonthCache:
+    """Stores parsed month events as gzipped JSON, one file per query"""
+    
+    def __init__(self, directory=None, past_ttl=None, current_ttl=None):
+        self.directory = directory or config.CACHE["directory"]
+        self.past_ttl = config.CACHE["past_ttl"] if past_ttl is None else past_ttl
+        self.current_ttl = config.CACHE["current_ttl"] if current_ttl is None else current_ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+    
+    @staticmethod
+    def make_key(year, month, filters=None):
+        """Build the cache key (year, month, room, lecturer, group, type)"""
+        filters = filters or config.FILTERS
+        return (year, month, filters["room"], filters["lecturer"], filters["group"], filters["type"])
+    
+    def _path(self, key):
+        digest = hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json.gz")
+    
+    def ttl_for(self, year, month):
+        """Past months rarely change, the current and future ones do"""
+        today = date.today()
+        if (year, month) < (today.year, today.month):
+            return self.past_ttl
+        return self.current_ttl
+    
+    def get(self, key):
+        """Return the stored entry for key (fresh or stale), or None"""
+        try:
+            with gzip.open(self._path(key), "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def is_fresh(entry):
+        return time.time() - entry["stored"] < entry["ttl"]
+    
+    def put(self, key, events, etag=None, last_modified=None):
+        """Store parsed events together with the validators the server sent"""
+        entry = {
+            "stored": time.time(),
+            "ttl": self.ttl_for(key[0], key[1]),
+            "etag": etag,
+            "last_modified": last_modified,
+            "events": events,
+        }
+        path = self._path(key)
+        with AtomicFile(path, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            json.dump(entry, f, separators=(",", ":"), ensure_ascii=False)
+        return entry
+    
+    def plan(self, months, filters=None, now=None):
+        """Split a range into months to request and months served from their snapshots
+        
+        Current and future months are always refreshed (revalidated when a
+        snapshot exists). A past month is reused when its snapshot was taken
+        after the month ended and is still fresh (younger than past_ttl and
+        its own TTL); otherwise it is refreshed too. Returns
+        {"refresh": {(year, month): reason}, "reuse": {(year, month): stored}},
+        reason being "current", "new", "unsettled" (snapshot taken before the
+        month ended) or "stale". Reused snapshots aren't kept: callers read
+        them with get() when they need the events, one month at a time.
+        """
+        now = time.time() if now is None else now
+        today = date.fromtimestamp(now)
+        refresh = {}
+        reuse = {}
+        for year, month in months:
+            if (year, month) >= (today.year, today.month):
+                refresh[(year, month)] = "current"
+                continue
+            entry = self.get(self.make_key(year, month, filters))
+            if entry is None:
+                reason = "new"
+            elif entry["stored"] < _month_end(year, month):
+                reason = "unsettled"
+            elif now - entry["stored"] >= min(entry["ttl"], self.past_ttl):
+                reason = "stale"
+            else:
+                reuse[(year, month)] = entry["stored"]
+                continue
+            refresh[(year, month)] = reason
+        return {"refresh": refresh, "reuse": reuse}
+    
+    def touch(self, key, entry):
+        """Restart the TTL of an entry the server confirmed as unchanged"""
+        return self.put(key, entry["events"], entry.get("etag"), entry.get("last_modified"))
+    
+    def record(self, outcome):
+        """Count a lookup outcome: 'hits', 'misses' or 'revalidated'"""
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        Metrics.count("cache_lookups", outcome=outcome)
+    
+    def clear(self):
+        """Remove every cached entry"""
+        for name in os.listdir(self.directory):
+            if name.endswith(".json.gz"):
+                os.remove(os.path.join(self.directory, name))
+    
+    def stats(self):
+        return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses}
+
+
+def _month_end(year, month):
+    """Timestamp of the first local midnight after a month"""
+    return (datetime(year, month, 1) + relativedelta(months=1)).timestamp()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Compact event model shared by the scraper and the exporters
+"""
+
+import hashlib
+import importlib.util
+import sys
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from datetime import date, datetime, time
+from functools import lru_cache
+
+# Optional: timezone-aware datetimes with correct DST (imported on first use)
+HAS_PYTZ = importlib.util.find_spec("pytz") is not None
+
+
+class Event:
+    """One calendar event with its date and times parsed once
+    
+    Behaves like the old per-event dict for reading (event['room'],
+    event.get('room', '-'), dict(event)), while storing fields in slots.
+    """
+    
+    FIELDS = ('date', 'start_time', 'end_time', 'title', 'room', 'group', 'lecturer', 'type', 'description')
+    
+    __slots__ = FIELDS + ('day', 'start', 'end', 'start_at', 'end_at', 'extra')
+    
+    def __init__(self, date=None, start_time=None, end_time=None, title=None, room=None, group=None,
+                 lecturer=None, type=None, description=None, extra=None):
+        # Rooms, groups, lecturers etc. repeat across thousands of events
+        self.date = _intern(date)
+        self.start_time = _intern(start_time)
+        self.end_time = _intern(end_time)
+        self.title = _intern(title)
+        self.room = _intern(room)
+        self.group = _intern(group)
+        self.lecturer = _intern(lecturer)
+        self.type = _intern(type)
+        self.description = _intern(description)
+        self.extra = extra or None
+        self._parse()
+    
+    def _parse(self):
+        """Derive day, start and end (None when the strings don't parse)"""
+        self.day = _parse_date(self.date)
+        self.start = _parse_time(self.start_time)
+        self.end = _parse_time(self.end_time)
+        # Set by normalize_events()
+        self.start_at = None
+        self.end_at = None
+    
+    @classmethod
+    def from_dict(cls, data, date=None):
+        """Build an event from a portal payload dict; unknown keys go to extra"""
+        fields = {}
+        extra = {}
+        for key, value in data.items():
+            if key in cls.FIELDS:
+                fields[key] = value
+            else:
+                extra[key] = value
+        if date is not None:
+            fields['date'] = date
+        return cls(extra=extra, **fields)
+    
+    def to_dict(self):
+        """Plain dict in the shape the portal payload had"""
+        data = {}
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+    
+    # Dict-compatible view for code written against the old dicts
+    
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+        elif self.extra:
+            value = self.extra.get(key)
+        else:
+            value = None
+        return default if value is None else value
+    
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+    
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, _intern(value))
+            if key in ('date', 'start_time', 'end_time'):
+                self._parse()
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+    
+    def __contains__(self, key):
+        return self.get(key) is not None
+    
+    def keys(self):
+        return self.to_dict().keys()
+    
+    def items(self):
+        return self.to_dict().items()
+    
+    def __eq__(self, other):
+        if isinstance(other, Event):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+    
+    def __repr__(self):
+        return f"Event({self.date} {self.start_time}-{self.end_time} {self.title!r})"
+
+
+class EventStore:
+    """Events held in date/time order with hash indexes for local queries
+    
+    Built once from a (possibly all-inclusive) fetch, it answers compound
+    queries such as "group X in room Y between two dates" from the indexes,
+    returning events already sorted by date and time.
+    """
+    
+    INDEXED = ('room', 'lecturer', 'group', 'type')
+    
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda e: (e.date or '', e.start_time or ''))
+        self._dates = [e.date or '' for e in self.events]
+        self._indexes = {field: {} for field in self.INDEXED}
+        self._memo = {}
+        
+        # Positions are added in ascending order, so every posting list is sorted
+        for pos, event in enumerate(self.events):
+            for field in ('room', 'lecturer', 'type'):
+                value = getattr(event, field)
+                if value:
+                    self._indexes[field].setdefault(value, []).append(pos)
+            for group in split_groups(event.group):
+                self._indexes['group'].setdefault(group, []).append(pos)
+    
+    def __len__(self):
+        return len(self.events)
+    
+    def values(self, field):
+        """Distinct values of an indexed field"""
+        return sorted(self._indexes[field])
+    
+    def _postings(self, field, value):
+        """Sorted positions matching one criterion (same rules as the portal filters)"""
+        key = (field, value)
+        if key not in self._memo:
+            index = self._indexes[field]
+            if field == 'lecturer':
+                # Portal matches lecturer names by part, e.g. "Gercevs"
+                needle = value.lower()
+                lists = [positions for name, positions in index.items() if needle in name.lower()]
+                self._memo[key] = lists[0] if len(lists) == 1 else list(merge(*lists))
+            else:
+                self._memo[key] = index.get(value, [])
+        return self._memo[key]
+    
+    def query(self, room=None, lecturer=None, group=None, type=None, date_from=None, date_to=None,
+              show_canceled=True):
+        """Events matching every given criterion, in date/time order
+        
+        date_from and date_to are inclusive 'YYYY-MM-DD' strings.
+        """
+        lo = bisect_left(self._dates, date_from) if date_from else 0
+        hi = bisect_right(self._dates, date_to) if date_to else len(self._dates)
+        
+        criteria = (('room', room), ('lecturer', lecturer), ('group', group), ('type', type))
+        postings = sorted((self._postings(field, value) for field, value in criteria if value is not None), key=len)
+        
+        if not postings:
+            result = self.events[lo:hi]
+        else:
+            # Walk the shortest list inside the date window, probe the others
+            shortest, others = postings[0], postings[1:]
+            result = []
+            for pos in shortest[bisect_left(shortest, lo):bisect_left(shortest, hi)]:
+                if all(_contains(other, pos) for other in others):
+                    result.append(self.events[pos])
+        
+        if not show_canceled:
+            result = [e for e in result if (e.description or '').lower() != 'canceled']
+        return result
+
+
+def normalize_events(events, timezone_name):
+    """Attach timezone-aware start_at/end_at to every event that lacks them
+    
+    Localizing is memoized per (date, time), so a year of events costs a few
+    thousand pytz calls however many groups it covers. Without pytz the
+    datetimes stay naive. Events whose date or time didn't parse are left
+    with start_at/end_at set to None.
+    """
+    for event in events:
+        if event.start_at is None and event.day is not None and event.start and event.end:
+            event.start_at = _localize(event.day, event.start, timezone_name)
+            event.end_at = _localize(event.day, event.end, timezone_name)
+    return events
+
+
+@lru_cache(maxsize=65536)
+def _localize(day, at, timezone_name):
+    naive = datetime.combine(day, at)
+    if not HAS_PYTZ:
+        return naive
+    import pytz
+    return pytz.timezone(timezone_name).localize(naive)
+
+
+def stable_id(event):
+    """Identity of a TSI event: the same lecture keeps its id across runs"""
+    key = "|".join(event.get(field, '') for field in ('date', 'start_time', 'title', 'group', 'type'))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def with_stable_ids(events, seen=None):
+    """Yield (id, event) pairs; a lecture listed twice gets '#2', '#3'... suffixes
+    
+    Pass the same seen set for every chunk of a streamed export.
+    """
+    if seen is None:
+        seen = set()
+    for event in events:
+        event_id = base_id = stable_id(event)
+        n = 1
+        while event_id in seen:
+            n += 1
+            event_id = f"{base_id}#{n}"
+        seen.add(event_id)
+        yield event_id, event
+
+
+def split_groups(value):
+    """Groups of an event; shared lectures list several: "3401BNA, 3403BNA"""
+    return [group.strip() for group in value.split(',') if group.strip()] if value else []
+
+
+def _contains(sorted_list, value):
+    i = bisect_left(sorted_list, value)
+    return i < len(sorted_list) and sorted_list[i] == value
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+# Few distinct dates and slot times: parse each once and share the objects
+@lru_cache(maxsize=4096)
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=1024)
+def _parse_time(value):
+    try:
+        return time.fromisoformat(value)
+    except (TypeError, ValueError):
+        pass
+    # fromisoformat wants zero-padded hours; the portal sometimes sends "9:00"
+    try:
+        return datetime.strptime(value, "%H:%M").time()
+    except (TypeError, ValueError):
+        return None
@@ -3,154 +3,596 @@
 Export calendar events to various formats
 """
 
+import contextlib
+import csv
+import gzip
+import hashlib
+import importlib.util
+import io
+import itertools
 import json
+import operator
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
+from dateutil.relativedelta import relativedelta
+from Cache import AtomicFile
+from Events import Event, HAS_PYTZ, normalize_events, with_stable_ids, split_groups
+from Pipeline import LineWriter
 import config
+import Metrics
 
-# Optional imports
-try:
-    from ics import Calendar, Event
-    HAS_ICS = True
-except ImportError:
-    HAS_ICS = False
+# Optional: zstd-compressed JSON output (imported on first use)
+HAS_ZSTD = importlib.util.find_spec("zstandard") is not None
+# Optional: Parquet output (imported on first use)
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+def output_filename(filename, target_name=None):
+    """Per-target file name: calendar_tsi.json -> calendar_tsi_<target>.json"""
+    if not target_name:
+        return filename
+    safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in target_name)
+    base, dot, extension = filename.rpartition(".")
+    return f"{base}_{safe_name}.{extension}" if dot else f"{filename}_{safe_name}"
+
+
+def _event_datetimes(event):
+    """Timezone-aware start and end of an event (normalized once, then reused)"""
+    if event.start_at is None:
+        normalize_events((event,), config.GOOGLE_CALENDAR["timezone"])
+    if event.day is None:
+        raise ValueError(f"invalid date '{event.date}'")
+    if event.start_at is None:
+        raise ValueError(f"invalid time '{event.start_time}-{event.end_time}'")
+    return event.start_at, event.end_at
+
+
+@lru_cache(maxsize=4096)
+def _day_label(day):
+    """'2025-11-01 Sat' style label, built once per distinct date"""
+    return f"{day.isoformat()} {day.strftime('%a')}"
 
 
 class TableExporter:
-    """Export events in table format"""
+    """Export events in table format
+    
+    Rows are formatted into a buffer and written in chunks of CHUNK_ROWS
+    lines. Column widths follow the data (up to each column's maximum) and
+    shrink to fit the terminal. With DISPLAY["page_size"] the table is
+    rendered page by page, each page with its own header and widths, so
+    huge sets stream out without formatting every row up front. The "csv"
+    and "tsv" table formats write plain delimited rows for piping.
+    """
+    
+    # Writes to the terminal, so the pipeline runs it on its own
+    interactive = True
+    
+    # Header and maximum width of each column
+    # (header, maximum width); None = as wide as the longest value
+    COLUMNS = (("Date", None), ("Time", None), ("Title", 40), ("Room", None),
+               ("Group", 22), ("Lecturer", 20), ("Type", None), ("Note", 15))
+    # Columns (by index) that narrow, widest first, when the table is wider than the terminal
+    SHRINKABLE = (2, 4, 5, 7)
+    MIN_WIDTH = 6
+    # Rows per write() call
+    CHUNK_ROWS = 2000
+    # Output stream; None = sys.stdout at the time of the call
+    stream = None
+    
+    @staticmethod
+    def run(events, job):
+        """Pipeline entry point; in watch mode only the changed months are shown"""
+        if job.get("months"):
+            events = [e for e in events if e.day and (e.day.year, e.day.month) in job["months"]]
+        TableExporter.export(events, job["filters"])
     
     @staticmethod
-    def export(events):
-        """Display events in table format"""
+    @Metrics.timed("export", format="table")
+    def export(events, filters=None, table_format=None, page_size=None, max_width=None):
+        """Display events in table format (or as CSV/TSV rows)
+        
+        table_format, page_size and max_width default to DISPLAY["table_format"],
+        DISPLAY["page_size"] (0 = one page) and DISPLAY["max_width"] (None = the
+        terminal width when writing to a terminal, otherwise unlimited).
+        """
         if not events:
             print("No events to display")
             return
+        Metrics.count("events_exported", len(events), format="table")
         
-        # Column widths
-        w = {'date': 12, 'time': 13, 'title': 40, 'room': 10, 'group': 22, 'lecturer': 20, 'type': 12, 'note': 15}
-        separator = "-" * 160
-        
-        # Header
-        print("\n" + "=" * 160)
-        print(f"{'TSI CALENDAR EVENTS':^160}")
-        print(f"Total: {len(events)} events | Filters: Room={config.FILTERS['room']}, "
-              f"Lecturer={config.FILTERS['lecturer']}, Group={config.FILTERS['group']}")
-        print("=" * 160)
-        
-        header = (f"{'Date':<{w['date']}} | {'Time':<{w['time']}} | {'Title':<{w['title']}} | "
-                  f"{'Room':<{w['room']}} | {'Group':<{w['group']}} | {'Lecturer':<{w['lecturer']}} | "
-                  f"{'Type':<{w['type']}} | {'Note':<{w['note']}}")
-        print(header)
-        print(separator)
-        
-        # Rows
-        for event in events:
-            # Parse date
-            try:
-                date_obj = datetime.strptime(event['date'], "%Y-%m-%d")
-                date_str = f"{date_obj.strftime('%Y-%m-%d')} {date_obj.strftime('%a')}"
-            except:
-                date_str = event['date']
-            
-            # Get fields
-            title = event.get('title', 'N/A')
-            room = event.get('room', '') or '-'
-            group = event.get('group', 'N/A')
-            start = event.get('start_time', 'N/A')
-            end = event.get('end_time', 'N/A')
-            time = f"{start}-{end}"
-            lecturer = event.get('lecturer', 'N/A')
-            event_type = event.get('type', 'N/A')
-            note = event.get('description', '') or '-'
-            
-            # Truncate if needed
-            if len(date_str) > w['date']: date_str = date_str[:w['date']]
-            if len(title) > w['title']: title = title[:w['title']-3] + "..."
-            if len(group) > w['group']: group = group[:w['group']-3] + "..."
-            if len(lecturer) > w['lecturer']: lecturer = lecturer[:w['lecturer']-3] + "..."
-            if len(note) > w['note']: note = note[:w['note']-3] + "..."
-            
-            row = (f"{date_str:<{w['date']}} | {time:<{w['time']}} | {title:<{w['title']}} | "
-                   f"{room:<{w['room']}} | {group:<{w['group']}} | {lecturer:<{w['lecturer']}} | "
-                   f"{event_type:<{w['type']}} | {note:<{w['note']}}")
-            print(row)
+        if filters is None:
+            filters = config.FILTERS
+        out = TableExporter.stream or sys.stdout
+        display = config.DISPLAY
+        table_format = table_format or display.get("table_format", "table")
+        
+        if table_format in ("csv", "tsv"):
+            TableExporter._write_delimited(events, out, "," if table_format == "csv" else "\t")
+            return
+        if table_format != "table":
+            raise ValueError(f"Unknown table format '{table_format}'")
+        
+        if page_size is None:
+            page_size = display.get("page_size", 0)
+        if max_width is None:
+            max_width = display.get("max_width")
+        if max_width is None and hasattr(out, "isatty") and out.isatty():
+            max_width = shutil.get_terminal_size().columns
+        
+        pages = [events] if not page_size else (events[i:i + page_size] for i in range(0, len(events), page_size))
+        banner = [f"Total: {len(events)} events | Filters: Room={filters['room']}, "
+                  f"Lecturer={filters['lecturer']}, Group={filters['group']}"]
+        for page in pages:
+            rule_width = TableExporter._write_page(out, page, max_width, banner)
+            banner = None
+        out.write("=" * rule_width + "\n\n")
+        out.flush()
+    
+    @staticmethod
+    def open_stream(job):
+        """Pipeline entry point for streamed runs: one or more pages per chunk, the total at the end"""
+        return _TableStream(job["filters"])
+    
+    @staticmethod
+    def _write_page(out, page, max_width, banner=None):
+        """Write one page (header, rows) in chunks of CHUNK_ROWS; banner lines open the table"""
+        rows, widths = TableExporter._layout(page, max_width)
+        rule_width = sum(widths) + 3 * (len(widths) - 1)
+        lines = [""]
+        if banner is not None:
+            lines += ["=" * rule_width, f"{'TSI CALENDAR EVENTS':^{rule_width}}"] + banner + ["=" * rule_width]
+        
+        # The last column isn't padded, so rows carry no trailing spaces
+        row_format = " | ".join([f"{{:<{width}}}" for width in widths[:-1]] + ["{}"])
+        lines += [row_format.format(*(header for header, _ in TableExporter.COLUMNS)), "-" * rule_width]
+        for i in range(0, len(rows), TableExporter.CHUNK_ROWS):
+            lines += [row_format.format(*row) for row in rows[i:i + TableExporter.CHUNK_ROWS]]
+            out.write("\n".join(lines) + "\n")
+            lines = []
+        return rule_width
+    
+    @staticmethod
+    def _cells(event):
+        """Display strings of one row (slots are read directly: this runs once per event)"""
+        return (
+            _day_label(event.day) if event.day else (event.date or ''),
+            f"{event.start_time or 'N/A'}-{event.end_time or 'N/A'}",
+            event.title or 'N/A',
+            event.room or '-',
+            event.group or 'N/A',
+            event.lecturer or 'N/A',
+            event.type or 'N/A',
+            event.description or '-',
+        )
+    
+    @staticmethod
+    def _layout(events, max_width=None):
+        """Rows of display strings, cut with "..." to fit, and the width of each column"""
+        columns = [list(column) for column in zip(*map(TableExporter._cells, events))]
+        widths = []
+        for (header, limit), column in zip(TableExporter.COLUMNS, columns):
+            width = max(len(header), max(map(len, column)))
+            widths.append(width if limit is None else min(limit, width))
+        
+        if max_width:
+            # Never narrower than the header, so the header row stays aligned
+            floors = [max(TableExporter.MIN_WIDTH, len(header)) for header, _ in TableExporter.COLUMNS]
+            excess = sum(widths) + 3 * (len(widths) - 1) - max_width
+            while excess > 0:
+                widest = max(TableExporter.SHRINKABLE, key=lambda i: widths[i] - floors[i])
+                if widths[widest] <= floors[widest]:
+                    break
+                widths[widest] -= 1
+                excess -= 1
+        
+        # Only columns with values longer than their width need a pass to cut them
+        for i, (column, width) in enumerate(zip(columns, widths)):
+            if max(map(len, column)) > width:
+                columns[i] = [value if len(value) <= width else value[:width - 3] + "..." for value in column]
+        return list(zip(*columns)), widths
+    
+    @staticmethod
+    def _write_delimited(events, out, delimiter, header=True):
+        """Untruncated rows with a header line, e.g. for `python main.py | ...`"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=delimiter, lineterminator="\n")
+        if header:
+            writer.writerow(Event.FIELDS)
+        fields = operator.attrgetter(*Event.FIELDS)
+        for i in range(0, len(events), TableExporter.CHUNK_ROWS):
+            # csv writes None as an empty field
+            writer.writerows(map(fields, events[i:i + TableExporter.CHUNK_ROWS]))
+            out.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+        out.flush()
+
+
+class _TableStream:
+    """TableExporter output for a stream of chunks: each chunk is paged on its own"""
+    
+    def __init__(self, filters):
+        self.filters = filters
+        self.out = TableExporter.stream or sys.stdout
+        self.table_format = config.DISPLAY.get("table_format", "table")
+        if self.table_format not in ("table", "csv", "tsv"):
+            raise ValueError(f"Unknown table format '{self.table_format}'")
+        self.page_size = config.DISPLAY.get("page_size", 0)
+        self.max_width = config.DISPLAY.get("max_width")
+        if self.max_width is None and hasattr(self.out, "isatty") and self.out.isatty():
+            self.max_width = shutil.get_terminal_size().columns
+        self.count = 0
+        self.rule_width = 0
+    
+    @Metrics.timed("export", format="table")
+    def write(self, events):
+        if not events:
+            return
+        if self.table_format in ("csv", "tsv"):
+            TableExporter._write_delimited(events, self.out, "," if self.table_format == "csv" else "\t",
+                                           header=not self.count)
+            self.count += len(events)
+            return
         
-        print("=" * 160 + "\n")
+        page_size = self.page_size or len(events)
+        for i in range(0, len(events), page_size):
+            banner = None
+            if not self.count:
+                banner = [f"Filters: Room={self.filters['room']}, Lecturer={self.filters['lecturer']}, "
+                          f"Group={self.filters['group']}"]
+            self.rule_width = TableExporter._write_page(self.out, events[i:i + page_size], self.max_width, banner)
+            self.count += len(events[i:i + page_size])
+    
+    def close(self):
+        Metrics.count("events_exported", self.count, format="table")
+        if not self.count:
+            print("No events to display")
+        elif self.table_format == "table":
+            self.out.write(f"{'=' * self.rule_width}\nTotal: {self.count} events\n\n")
+        self.out.flush()
 
 
 class JSONExporter:
-    """Export events to JSON format"""
+    """Export events to JSON format
+    
+    Modes: "pretty" (indented array), "compact" (array without whitespace) and
+    "ndjson" (one event per line). Compact and NDJSON output are written
+    event by event. Output can be gzip or zstd compressed.
+    """
+    
+    MODES = ("pretty", "compact", "ndjson")
+    EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
     
     @staticmethod
-    def export(events, filename=None):
+    def run(events, job):
+        """Pipeline entry point"""
+        return JSONExporter.export(events, output_filename(config.OUTPUT["json_file"], job.get("target")))
+    
+    @staticmethod
+    @Metrics.timed("export", format="json")
+    def export(events, filename=None, mode=None, compression=None):
         """Export events to JSON file"""
+        writer = JSONExporter.writer(filename, mode, compression)
+        try:
+            writer.write(events)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+    
+    @staticmethod
+    def open_stream(job):
+        """Pipeline entry point for streamed runs"""
+        return JSONExporter.writer(output_filename(config.OUTPUT["json_file"], job.get("target")))
+    
+    @staticmethod
+    def writer(filename=None, mode=None, compression=None):
+        """Open an export that takes events chunk by chunk"""
         if filename is None:
             filename = config.OUTPUT["json_file"]
+        if mode is None:
+            mode = config.OUTPUT.get("json_mode", "pretty")
+        if compression is None:
+            compression = config.OUTPUT.get("json_compression")
         
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(events, f, indent=2, ensure_ascii=False)
+        if mode not in JSONExporter.MODES:
+            raise ValueError(f"Unknown JSON mode '{mode}'. Options: {', '.join(JSONExporter.MODES)}")
+        if compression == "zstd" and not HAS_ZSTD:
+            raise RuntimeError("zstd compression requires 'zstandard' package. Install with: pip install zstandard")
         
-        print(f"Events exported to {filename}")
-        return filename
+        extension = JSONExporter.EXTENSIONS.get(compression, "")
+        if extension and not filename.endswith(extension):
+            filename += extension
+        return _JSONWriter(filename, mode, compression)
+    
+    @staticmethod
+    def load(filename):
+        """Yield Events back from any file export() wrote
+        
+        NDJSON is read line by line; JSON arrays have to be decoded whole.
+        """
+        compression = next((name for name, ext in JSONExporter.EXTENSIONS.items()
+                            if filename.endswith(ext)), None)
+        with JSONExporter._open(filename, 'r', compression) as f:
+            first = f.read(1)
+            while first and first.isspace():
+                first = f.read(1)
+            
+            if first == '[':
+                for data in json.loads(first + f.read()):
+                    yield Event.from_dict(data)
+                return
+            
+            decode = json.JSONDecoder().decode
+            line = first + f.readline()
+            while line:
+                if line.strip():
+                    yield Event.from_dict(decode(line))
+                line = f.readline()
+    
+    @staticmethod
+    def _open(file, mode, compression):
+        """Open a text stream over a filename or a binary file, (de)compressing on the fly"""
+        if compression == "gzip":
+            return gzip.open(file, f'{mode}t', encoding='utf-8', compresslevel=6)
+        raw = open(file, f'{mode}b') if isinstance(file, str) else file
+        if compression == "zstd":
+            import zstandard
+            if mode == 'w':
+                raw = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+            else:
+                raw = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(raw, encoding='utf-8')
+
+
+class _JSONWriter:
+    """Writes events one by one in any JSON mode to a temp file, moved into place by close()
+    
+    After abort() (or a crash) the previous export is left as it was.
+    """
+    
+    def __init__(self, filename, mode, compression):
+        self.filename = filename
+        self.mode = mode
+        self.count = 0
+        # indent=2 lays out each event as json.dump(events, indent=2) would inside the array
+        self.encode = json.JSONEncoder(ensure_ascii=False, default=Event.to_dict,
+                                       **({"indent": 2} if mode == "pretty" else {"separators": (',', ':')})).encode
+        self.target = AtomicFile(filename, 'wb', permissions=0o644)
+        self.f = JSONExporter._open(self.target.file, 'w', compression)
+        if mode != "ndjson":
+            self.f.write('[')
+    
+    def write(self, events):
+        f, encode, count = self.f, self.encode, self.count
+        if self.mode == "ndjson":
+            for event in events:
+                f.write(encode(event))
+                f.write('\n')
+                count += 1
+        elif self.mode == "compact":
+            for event in events:
+                if count:
+                    f.write(',')
+                f.write(encode(event))
+                count += 1
+        else:
+            for event in events:
+                f.write(',\n  ' if count else '\n  ')
+                f.write(encode(event).replace('\n', '\n  '))
+                count += 1
+        self.count = count
+    
+    def close(self):
+        if self.mode == "pretty":
+            self.f.write('\n]' if self.count else ']')
+        elif self.mode == "compact":
+            self.f.write(']')
+        self.f.close()
+        self.target.commit()
+        Metrics.count("events_exported", self.count, format="json")
+        print(f"Events exported to {self.filename} ({self.mode} JSON) - {self.count} events")
+        return self.filename
+    
+    def abort(self):
+        with contextlib.suppress(Exception):
+            self.f.close()
+        self.target.abort()
 
 
 class ICSExporter:
-    """Export events to ICS (iCalendar) format with proper timezone support"""
+    """Export events to ICS (iCalendar, RFC 5545) format with proper timezone support
+    
+    Events are serialized and written one by one, so memory use does not grow
+    with the number of events.
+    """
+    
+    PRODID = "-//TSI Calendar Scraper//EN"
+    
+    @staticmethod
+    def run(events, job):
+        """Pipeline entry point"""
+        return ICSExporter.export(events, output_filename(config.OUTPUT["ics_file"], job.get("target")))
     
     @staticmethod
+    @Metrics.timed("export", format="ics")
     def export(events, filename=None):
         """Export events to ICS file"""
-        if not HAS_ICS:
-            print("Error: ICS export requires 'ics' package. Install with: pip install ics")
-            return None
-        
+        writer = ICSExporter.writer(filename)
+        try:
+            writer.write(events)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+    
+    @staticmethod
+    def open_stream(job):
+        """Pipeline entry point for streamed runs"""
+        return ICSExporter.writer(output_filename(config.OUTPUT["ics_file"], job.get("target")))
+    
+    @staticmethod
+    def writer(filename=None):
+        """Open an export that takes events chunk by chunk"""
         if filename is None:
             filename = config.OUTPUT["ics_file"]
-        
-        # Try to get timezone
-        try:
-            import pytz
-            timezone = pytz.timezone(config.GOOGLE_CALENDAR["timezone"])
-            has_timezone = True
-        except ImportError:
+        if not HAS_PYTZ:
             print("Warning: pytz not installed. Timezone info will not be included in ICS file.")
-            has_timezone = False
+        return _ICSWriter(filename, config.GOOGLE_CALENDAR["timezone"])
+    
+    @staticmethod
+    def _vtimezone(timezone_str, year=None):
+        """VTIMEZONE for the configured zone, built from pytz's transition table
         
-        calendar = Calendar()
-        success_count = 0
+        Transitions from ten years back to ten years ahead are grouped into
+        daylight and standard ones. A group that follows one rule every year
+        (month, weekday of the week, local time, offsets) becomes an RRULE;
+        otherwise each of its transitions is listed with its own DTSTART.
+        """
+        import pytz
+        timezone = pytz.timezone(timezone_str)
+        year = year or datetime.now().year
+        first, last = datetime(year - 10, 1, 1), datetime(year + 11, 1, 1)
         
-        for event_data in events:
-            event = Event()
-            
-            # Set title
-            event.name = event_data.get('title', 'Untitled Event')
-            
-            # Parse date and time
-            date_str = event_data.get('date', '')
-            start_time_str = event_data.get('start_time', '00:00')
-            end_time_str = event_data.get('end_time', '00:00')
-            
+        # (onset in local time before the switch, offset before, offset after, dst, name)
+        times = getattr(timezone, "_utc_transition_times", [])
+        infos = getattr(timezone, "_transition_info", [])
+        transitions = [(times[i] + infos[i - 1][0], infos[i - 1][0], infos[i][0], bool(infos[i][1]), infos[i][2])
+                       for i in range(1, len(times)) if first <= times[i] < last]
+        
+        lines = ["BEGIN:VTIMEZONE", f"TZID:{timezone_str}"]
+        if transitions:
+            # The offset in force before the first transition
+            onset, offset, _, _, _ = transitions[0]
+            base = timezone.localize(onset - timedelta(days=1))
+            lines += _ics_observance(bool(base.dst()), datetime(1970, 1, 1), offset, offset, base.tzname())
+        else:
+            base = timezone.localize(datetime(year, 1, 1))
+            lines += _ics_observance(False, datetime(1970, 1, 1), base.utcoffset(), base.utcoffset(), base.tzname())
+        
+        table_end = times[-1].year if times else last.year
+        for dst in (True, False):
+            group = [transition for transition in transitions if transition[3] == dst]
+            if not group:
+                continue
+            rule = _yearly_rule(group, min(last.year - 1, table_end))
+            if rule:
+                onset, offset_from, offset_to, _, name = group[0]
+                lines += _ics_observance(dst, onset, offset_from, offset_to, name, rule)
+            else:
+                for onset, offset_from, offset_to, _, name in group:
+                    lines += _ics_observance(dst, onset, offset_from, offset_to, name)
+        lines.append("END:VTIMEZONE")
+        return lines
+    
+    @staticmethod
+    def _fold_lines(lines):
+        """Join content lines with CRLF, folding any longer than 75 octets"""
+        out = []
+        for line in lines:
+            if len(line.encode('utf-8')) <= 75:
+                out.append(line)
+                continue
+            # Fold between characters, never inside a multi-byte UTF-8 sequence
+            chunk = []
+            size = 0
+            limit = 75
+            for char in line:
+                char_size = len(char.encode('utf-8'))
+                if size + char_size > limit:
+                    out.append(("" if limit == 75 else " ") + "".join(chunk))
+                    chunk = []
+                    size = 0
+                    limit = 74  # continuation lines start with a space
+                chunk.append(char)
+                size += char_size
+            out.append(" " + "".join(chunk))
+        return "\r\n".join(out) + "\r\n"
+
+
+_ICS_WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+
+def _ics_offset(offset):
+    """UTC offset as +HHMM/-HHMM"""
+    minutes = int(offset.total_seconds() // 60)
+    sign = "+" if minutes >= 0 else "-"
+    return f"{sign}{abs(minutes) // 60:02d}{abs(minutes) % 60:02d}"
+
+
+def _ics_observance(dst, onset, offset_from, offset_to, name, rrule=None):
+    """STANDARD or DAYLIGHT sub-component of a VTIMEZONE"""
+    kind = "DAYLIGHT" if dst else "STANDARD"
+    lines = [f"BEGIN:{kind}", f"DTSTART:{onset.strftime('%Y%m%dT%H%M%S')}"]
+    if rrule:
+        lines.append(f"RRULE:{rrule}")
+    lines += [f"TZOFFSETFROM:{_ics_offset(offset_from)}", f"TZOFFSETTO:{_ics_offset(offset_to)}",
+              f"TZNAME:{name}", f"END:{kind}"]
+    return lines
+
+
+def _yearly_rule(transitions, last_year):
+    """RRULE matching transitions that fall once a year up to last_year on one rule, or None
+    
+    The week is counted from the end of the month (-1SU) when the day is in
+    its last seven days, e.g. "last Sunday of March", otherwise from the start.
+    """
+    years = [onset.year for onset, *_ in transitions]
+    if len(years) < 2 or years != list(range(years[0], last_year + 1)):
+        return None
+    rules = set()
+    for onset, offset_from, offset_to, _, name in transitions:
+        week = -1 if (onset + timedelta(days=7)).month != onset.month else (onset.day - 1) // 7 + 1
+        rules.add((onset.month, week, onset.weekday(), onset.time(), offset_from, offset_to, name))
+    if len(rules) != 1:
+        return None
+    month, week, weekday, _, _, _, _ = rules.pop()
+    return f"FREQ=YEARLY;BYMONTH={month};BYDAY={week}{_ICS_WEEKDAYS[weekday]}"
+
+
+def _ics_escape(text):
+    """Escape a TEXT property value (RFC 5545, 3.3.11)"""
+    return (text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+class _ICSWriter:
+    """Writes the calendar header when opened, VEVENTs per write() and the footer on close()
+    
+    The calendar is written to a temp file that close() moves into place.
+    """
+    
+    def __init__(self, filename, timezone_str):
+        self.filename = filename
+        self.stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        self.tzid = f";TZID={timezone_str}" if HAS_PYTZ else ""
+        self.seen = set()
+        self.count = 0
+        # newline='' keeps the CRLF line endings RFC 5545 requires
+        self.target = AtomicFile(filename, 'w', permissions=0o644, encoding='utf-8', newline='')
+        self.f = self.target.file
+        self.f.write(ICSExporter._fold_lines([
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            f"PRODID:{ICSExporter.PRODID}",
+            "CALSCALE:GREGORIAN",
+        ]))
+        if HAS_PYTZ:
+            self.f.write(ICSExporter._fold_lines(ICSExporter._vtimezone(timezone_str)))
+    
+    def write(self, events):
+        f, stamp, tzid = self.f, self.stamp, self.tzid
+        for event_id, event_data in with_stable_ids(events, self.seen):
             try:
-                # Create datetime objects
-                date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-                start_time = datetime.strptime(start_time_str, "%H:%M" if ':' in start_time_str else "%H:%M:%S")
-                end_time = datetime.strptime(end_time_str, "%H:%M" if ':' in end_time_str else "%H:%M:%S")
-                
-                # Combine date and time - create naive datetime first
-                start_datetime_naive = date_obj.replace(hour=start_time.hour, minute=start_time.minute)
-                end_datetime_naive = date_obj.replace(hour=end_time.hour, minute=end_time.minute)
-                
-                # Make timezone-aware to properly handle DST
-                if has_timezone:
-                    start_datetime = timezone.localize(start_datetime_naive)
-                    end_datetime = timezone.localize(end_datetime_naive)
-                else:
-                    start_datetime = start_datetime_naive
-                    end_datetime = end_datetime_naive
-                
-                event.begin = start_datetime
-                event.end = end_datetime
-                success_count += 1
-                
+                # Timezone-aware (when pytz is installed) to properly handle DST
+                start_datetime, end_datetime = _event_datetimes(event_data)
             except Exception as e:
                 print(f"Warning: Could not parse date/time for event '{event_data.get('title', 'Unknown')}': {e}")
                 continue
@@ -166,47 +608,462 @@ class ICSExporter:
             if event_data.get('description'):
                 description_parts.append(f"Note: {event_data['description']}")
             
-            event.description = "\n".join(description_parts)
+            lines = [
+                "BEGIN:VEVENT",
+                f"UID:{event_id}@tsi.lv",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART{tzid}:{start_datetime.strftime('%Y%m%dT%H%M%S')}",
+                f"DTEND{tzid}:{end_datetime.strftime('%Y%m%dT%H%M%S')}",
+                f"SUMMARY:{_ics_escape(event_data.get('title', 'Untitled Event'))}",
+            ]
+            if description_parts:
+                description = "\n".join(description_parts)
+                lines.append(f"DESCRIPTION:{_ics_escape(description)}")
             
             # Set location
             if event_data.get('room'):
-                event.location = f"Room {event_data['room']}, TSI"
+                location = f"Room {event_data['room']}, TSI"
+                lines.append(f"LOCATION:{_ics_escape(location)}")
+            lines.append("END:VEVENT")
             
-            # Add event to calendar
-            calendar.events.add(event)
+            f.write(ICSExporter._fold_lines(lines))
+            self.count += 1
+    
+    def close(self):
+        self.f.write("END:VCALENDAR\r\n")
+        self.target.commit()
+        Metrics.count("events_exported", self.count, format="ics")
+        print(f"Events exported to {self.filename} (ICS format) - {self.count} events")
+        return self.filename
+    
+    def abort(self):
+        self.target.abort()
+
+
+class SQLiteExporter:
+    """Export events to an indexed SQLite database
+    
+    An export replaces the months it covers (those of the events, plus the
+    changed months in watch mode), so an archive grows by exporting new
+    months into the same file. Events are indexed by date, room, lecturer
+    and group (every group of a shared lecture), and query() answers
+    reports from the indexes without loading the archive.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            event_key INTEGER PRIMARY KEY,
+            id TEXT NOT NULL,
+            month TEXT NOT NULL,
+            date TEXT NOT NULL,
+            start_time TEXT,
+            end_time TEXT,
+            title TEXT,
+            room TEXT,
+            "group" TEXT,
+            lecturer TEXT,
+            type TEXT,
+            description TEXT,
+            extra TEXT
+        );
+        CREATE TABLE IF NOT EXISTS event_groups (
+            event_key INTEGER NOT NULL,
+            name TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS months (
+            month TEXT PRIMARY KEY,
+            events INTEGER NOT NULL,
+            exported TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS events_date ON events (date, start_time);
+        CREATE INDEX IF NOT EXISTS events_month ON events (month);
+        CREATE INDEX IF NOT EXISTS events_room ON events (room, date);
+        CREATE INDEX IF NOT EXISTS events_lecturer ON events (lecturer, date);
+        CREATE INDEX IF NOT EXISTS event_groups_name ON event_groups (name, event_key);
+        CREATE INDEX IF NOT EXISTS event_groups_key ON event_groups (event_key);
+    """
+    
+    # event_key is an integer row key (cheap to index); id is stable_id(), as in the other exports
+    COLUMNS = ("event_key", "id", "month") + Event.FIELDS + ("extra",)
+    
+    @staticmethod
+    def run(events, job):
+        """Pipeline entry point"""
+        return SQLiteExporter.export(events, output_filename(config.OUTPUT["sqlite_file"], job.get("target")),
+                                     job.get("months"))
+    
+    @staticmethod
+    def connect(filename):
+        """Open (and if needed create) an archive"""
+        connection = sqlite3.connect(filename)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SQLiteExporter.SCHEMA)
+        return connection
+    
+    @staticmethod
+    @Metrics.timed("export", format="sqlite")
+    def export(events, filename=None, months=None):
+        """Write events, replacing every month they cover; months adds (year, month) pairs to replace"""
+        writer = SQLiteExporter.writer(filename, months)
+        try:
+            writer.write(events)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+    
+    @staticmethod
+    def open_stream(job):
+        """Pipeline entry point for streamed runs"""
+        return SQLiteExporter.writer(output_filename(config.OUTPUT["sqlite_file"], job.get("target")),
+                                     job.get("months"))
+    
+    @staticmethod
+    def writer(filename=None, months=None):
+        """Open an export that takes events chunk by chunk, committed as one transaction on close()"""
+        if filename is None:
+            filename = config.OUTPUT["sqlite_file"]
+        return _SQLiteWriter(filename, months)
+    
+    @staticmethod
+    def query(filename, room=None, lecturer=None, group=None, type=None, date_from=None, date_to=None,
+              show_canceled=True):
+        """Events matching every given criterion, in date/time order
+        
+        Matches as EventStore.query does: lecturer by part of the name, case
+        insensitive ("Gercevs"), group by one group of a shared lecture, the
+        rest exactly; date_from and date_to are inclusive 'YYYY-MM-DD' strings.
+        """
+        connection = sqlite3.connect(filename)
+        try:
+            conditions = []
+            parameters = []
+            for column, value in (("room", room), ("type", type)):
+                if value is not None:
+                    conditions.append(f"{column} = ?")
+                    parameters.append(value)
+            if lecturer is not None:
+                # The distinct names are few: match them in Python, then use the lecturer index
+                needle = lecturer.lower()
+                names = [name for (name,) in connection.execute("SELECT DISTINCT lecturer FROM events")
+                         if name and needle in name.lower()]
+                conditions.append(f"lecturer IN ({', '.join('?' * len(names))})")
+                parameters.extend(names)
+            if group is not None:
+                conditions.append("event_key IN (SELECT event_key FROM event_groups WHERE name = ?)")
+                parameters.append(group)
+            if date_from:
+                conditions.append("date >= ?")
+                parameters.append(date_from)
+            if date_to:
+                conditions.append("date <= ?")
+                parameters.append(date_to)
+            if not show_canceled:
+                conditions.append("lower(coalesce(description, '')) != 'canceled'")
+            
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            columns = ", ".join(f'"{field}"' for field in Event.FIELDS + ("extra",))
+            rows = connection.execute(
+                f"SELECT {columns} FROM events{where} ORDER BY date, start_time", parameters).fetchall()
+        finally:
+            connection.close()
+        return [Event(*row[:-1], extra=json.loads(row[-1]) if row[-1] else None) for row in rows]
+    
+    @staticmethod
+    def load(filename):
+        """All events of an archive, in date/time order"""
+        return SQLiteExporter.query(filename)
+
+
+class _SQLiteWriter:
+    """Inserts each chunk as it arrives; a month's old rows are deleted when the month first shows up
+    
+    Nothing is committed before close(), so readers see either the old or the
+    new months, never a half-written export.
+    """
+    
+    def __init__(self, filename, months):
+        self.filename = filename
+        self.counts = {f"{year}-{month:02d}": 0 for year, month in months or ()}
+        self.replaced = set()
+        self.seen = set()
+        self.fields = operator.attrgetter(*Event.FIELDS)
+        self.connection = SQLiteExporter.connect(filename)
+        self.next_key = self.connection.execute("SELECT coalesce(max(event_key), 0) FROM events").fetchone()[0] + 1
+    
+    def write(self, events):
+        fields, counts = self.fields, self.counts
+        rows = []
+        group_rows = []
+        key = self.next_key
+        for event_id, event in with_stable_ids(events, self.seen):
+            if not event.date:
+                continue
+            month = event.date[:7]
+            counts[month] = counts.get(month, 0) + 1
+            rows.append((key, event_id, month) + fields(event) +
+                        (json.dumps(event.extra, ensure_ascii=False) if event.extra else None,))
+            group_rows.extend((key, group) for group in split_groups(event.group))
+            key += 1
+        self.next_key = key
         
-        # Write to file
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.writelines(calendar)
+        self._replace([month for month in counts if month not in self.replaced])
+        self.connection.executemany(
+            f"INSERT INTO events VALUES ({', '.join('?' * len(SQLiteExporter.COLUMNS))})", rows)
+        self.connection.executemany("INSERT INTO event_groups VALUES (?, ?)", group_rows)
+    
+    def close(self):
+        connection = self.connection
+        try:
+            with connection:
+                self._replace([month for month in self.counts if month not in self.replaced])
+                stamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+                connection.executemany("INSERT OR REPLACE INTO months VALUES (?, ?, ?)",
+                                       [(month, count, stamp) for month, count in self.counts.items()])
+        finally:
+            connection.close()
         
-        print(f"Events exported to {filename} (ICS format) - {success_count} events")
-        return filename
+        total = sum(self.counts.values())
+        Metrics.count("events_exported", total, format="sqlite")
+        print(f"Events exported to {self.filename} (SQLite) - {total} events, {len(self.counts)} months replaced")
+        return self.filename
+    
+    def abort(self):
+        self.connection.rollback()
+        self.connection.close()
+    
+    def _replace(self, months):
+        """Delete the archived rows of months this export hasn't touched yet"""
+        replaced = [(month,) for month in months]
+        self.connection.executemany("DELETE FROM event_groups WHERE event_key IN "
+                                    "(SELECT event_key FROM events WHERE month = ?)", replaced)
+        self.connection.executemany("DELETE FROM events WHERE month = ?", replaced)
+        self.replaced.update(months)
+
+
+class ParquetExporter:
+    """Export events to a Parquet dataset partitioned by month (requires pyarrow)
+    
+    The dataset is a directory with one subdirectory per month
+    (month=2025-09/). An export rewrites only the months it covers, so new
+    months can be added to an archive. Columns are id, the event fields and
+    extra (other payload keys as JSON, as in the SQLite archive); read()
+    returns a pyarrow Table for analytics.
+    """
+    
+    @staticmethod
+    def run(events, job):
+        """Pipeline entry point"""
+        return ParquetExporter.export(events, output_filename(config.OUTPUT["parquet_dir"], job.get("target")),
+                                      job.get("months"))
+    
+    @staticmethod
+    @Metrics.timed("export", format="parquet")
+    def export(events, directory=None, months=None):
+        """Write events, replacing every month they cover; months adds (year, month) pairs to replace"""
+        if directory is None:
+            directory = config.OUTPUT["parquet_dir"]
+        if not HAS_PYARROW:
+            raise RuntimeError("Parquet export requires 'pyarrow' package. Install with: pip install pyarrow")
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        
+        columns = {name: [] for name in ("id",) + Event.FIELDS + ("extra", "month")}
+        for event_id, event in with_stable_ids(events):
+            if not event.date:
+                continue
+            columns["id"].append(event_id)
+            for field in Event.FIELDS:
+                columns[field].append(getattr(event, field))
+            columns["extra"].append(json.dumps(event.extra, ensure_ascii=False) if event.extra else None)
+            columns["month"].append(event.date[:7])
+        
+        # Changed months without events are not rewritten by write_dataset; drop them here
+        written = set(columns["month"])
+        for year, month in months or ():
+            partition = os.path.join(directory, f"month={year}-{month:02d}")
+            if f"{year}-{month:02d}" not in written and os.path.isdir(partition):
+                shutil.rmtree(partition)
+        
+        if columns["id"]:
+            schema = pa.schema([(name, pa.string()) for name in columns])
+            ds.write_dataset(
+                pa.table(columns, schema=schema), directory, format="parquet",
+                partitioning=ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive"),
+                basename_template="part-{i}.parquet",
+                existing_data_behavior="delete_matching",
+            )
+        
+        count = len(columns["id"])
+        Metrics.count("events_exported", count, format="parquet")
+        print(f"Events exported to {directory} (Parquet) - {count} events, {len(written)} months")
+        return directory
+    
+    @staticmethod
+    def read(directory, columns=None, filter=None):
+        """The dataset as a pyarrow Table, e.g. filter=pyarrow.dataset.field("room") == "L8" """
+        import pyarrow.dataset as ds
+        return ds.dataset(directory, format="parquet", partitioning="hive").to_table(columns=columns, filter=filter)
+    
+    @staticmethod
+    def load(directory):
+        """Yield Events back from a dataset, in date/time order"""
+        table = ParquetExporter.read(directory, columns=list(Event.FIELDS) + ["extra"])
+        table = table.sort_by([("date", "ascending"), ("start_time", "ascending")])
+        for data in table.to_pylist():
+            extra = data.pop("extra")
+            yield Event(**data, extra=json.loads(extra) if extra else None)
 
 
 class GoogleCalendarExporter:
-    """Export events to Google Calendar"""
+    """Export events to Google Calendar
     
-    def __init__(self):
-        self.service = None
-        self.calendar_id = config.GOOGLE_CALENDAR["calendar_id"]
-        # Import pytz for timezone handling
-        try:
-            import pytz
-            self.pytz = pytz
-            self.timezone = pytz.timezone(config.GOOGLE_CALENDAR["timezone"])
-        except ImportError:
+    Events go to calendar_id and to every calendar of a matching route in
+    GOOGLE_CALENDAR["routes"]. Several calendars are synced in parallel, one
+    worker (with its own API client and throttle) per calendar, so the calls
+    to one calendar keep their order.
+    """
+    
+    def __init__(self, service=None, calendar_id=None):
+        self.service = service
+        self.calendar_id = calendar_id or config.GOOGLE_CALENDAR["calendar_id"]
+        self.throttle = _Throttle(config.GOOGLE_CALENDAR.get("requests_per_second"))
+        self._credentials = None
+        if not HAS_PYTZ:
             print("Warning: pytz not installed. Timezone handling may be incorrect.")
             print("Install with: pip install pytz")
-            self.pytz = None
-            self.timezone = None
+    
+    def run(self, events, job):
+        """Pipeline entry point: sync (only the changed months in watch mode) or replace every routed calendar"""
+        calendars = self.route(events)
+        if list(calendars) == [self.calendar_id]:
+            return self._run_calendar(events, job)
+        return self.run_calendars(calendars, job)
+    
+    @staticmethod
+    def route(events, routes=None, default_calendar=None):
+        """Split events into {calendar_id: events} by the routing rules
+        
+        A route is a dict with "calendar_id", an optional "name" and criteria:
+        "group", "lecturer" and/or "type", each a value or a list of values. An
+        event matches when every criterion does; group matches any group of a
+        shared lecture, lecturer matches part of the name case-insensitively
+        ("Gercevs"), as FILTERS and TARGETS do. Every routed calendar is listed,
+        even without events, so removed lectures are deleted from it.
+        default_calendar (GOOGLE_CALENDAR["default_calendar"]) also sends every
+        event to calendar_id, once even if a route names that calendar too.
+        """
+        settings = config.GOOGLE_CALENDAR
+        if routes is None:
+            routes = settings.get("routes") or []
+        if default_calendar is None:
+            default_calendar = settings.get("default_calendar", True) or not routes
+        
+        calendars = {settings["calendar_id"]: list(events)} if default_calendar else {}
+        # calendar_id -> ids of the events already there (several routes may share a calendar)
+        routed = {calendar_id: set(map(id, calendar_events)) for calendar_id, calendar_events in calendars.items()}
+        for route in routes:
+            calendar_events = calendars.setdefault(route["calendar_id"], [])
+            seen = routed.setdefault(route["calendar_id"], set())
+            criteria = [(field, {str(value).lower() if field == "lecturer" else value
+                                 for value in (route[field] if isinstance(route[field], (list, tuple, set))
+                                               else [route[field]])})
+                        for field in ("group", "lecturer", "type") if route.get(field)]
+            for event in events:
+                if id(event) not in seen and all(_route_matches(event, field, values) for field, values in criteria):
+                    seen.add(id(event))
+                    calendar_events.append(event)
+        return calendars
+    
+    def for_calendar(self, calendar_id):
+        """Exporter for one calendar, with its own throttle and (when authenticated here) API client"""
+        service = self.service
+        if self._credentials is not None:
+            # googleapiclient services share one httplib2 connection and aren't thread-safe
+            from googleapiclient.discovery import build
+            service = build('calendar', 'v3', credentials=self._credentials)
+        return GoogleCalendarExporter(service=service, calendar_id=calendar_id)
+    
+    def run_calendars(self, calendars, job=None):
+        """Sync {calendar_id: events}, up to GOOGLE_CALENDAR["max_calendars"] calendars at a time
+        
+        Output lines are prefixed with the calendar's route name. Returns
+        {calendar_id: result}. A calendar that fails doesn't stop the others;
+        once all are done, RuntimeError names the failed ones, so the export
+        counts as failed (and watch mode retries the months).
+        """
+        if not self.service:
+            self.authenticate()
+        job = job or {}
+        names = {route["calendar_id"]: route.get("name") or route["calendar_id"].split("@")[0]
+                 for route in config.GOOGLE_CALENDAR.get("routes") or []}
+        names.setdefault(config.GOOGLE_CALENDAR["calendar_id"], "default")
+        for calendar_events in calendars.values():
+            normalize_events(calendar_events, config.GOOGLE_CALENDAR["timezone"])
+        
+        workers = {calendar_id: self.for_calendar(calendar_id) for calendar_id in calendars}
+        parallel = max(1, min(config.GOOGLE_CALENDAR.get("max_calendars", 4), len(calendars)))
+        print(f"Syncing {len(calendars)} Google calendars ({parallel} in parallel)...")
+        
+        def sync_one(calendar_id):
+            with output.labeled(names.get(calendar_id, calendar_id)):
+                try:
+                    return workers[calendar_id]._run_calendar(calendars[calendar_id], job)
+                except Exception as e:
+                    print(f"Error syncing calendar: {e}")
+                    return {"error": str(e)}
+        
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            # Inside a parallel pipeline run stdout already is a LineWriter; stdout is swapped
+            # (process-wide) only when this is the only thing running
+            output = sys.stdout
+            if not isinstance(output, LineWriter):
+                output = LineWriter(sys.stdout)
+                stack.callback(output.close)
+                stack.enter_context(contextlib.redirect_stdout(output))
+            with ThreadPoolExecutor(max_workers=parallel) as pool:
+                results = dict(zip(calendars, pool.map(sync_one, calendars)))
+        elapsed = time.perf_counter() - start
+        
+        requests = sum(worker.throttle.sent for worker in workers.values())
+        waited = sum(worker.throttle.waited for worker in workers.values())
+        failed = [calendar_id for calendar_id, result in results.items()
+                  if isinstance(result, dict) and "error" in result]
+        print(f"Google calendars: {len(calendars)} synced in {elapsed:.1f}s, {requests} API requests "
+              f"({requests / elapsed if elapsed else 0:.0f}/s), {waited:.1f}s throttled"
+              + (f", {len(failed)} failed" if failed else ""))
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(calendars)} Google calendars failed: "
+                               + ", ".join(names.get(calendar_id, calendar_id) for calendar_id in failed))
+        return results
+    
+    def _run_calendar(self, events, job):
+        """Sync (only the changed months in watch mode) or replace this exporter's calendar"""
+        if job.get("months"):
+            results = []
+            for year, month in sorted(job["months"]):
+                start = datetime(year, month, 1)
+                month_events = [e for e in events if e.day and (e.day.year, e.day.month) == (year, month)]
+                results.append(self.sync(month_events, start.isoformat() + 'Z',
+                                         (start + relativedelta(months=1)).isoformat() + 'Z'))
+            return results
+        if config.GOOGLE_CALENDAR.get("sync_mode", "incremental") == "incremental":
+            return self.sync(events)
+        return self.export(events, clear_first=True)
     
     def authenticate(self):
         """Authenticate with Google Calendar API"""
         import os
-        from google.auth.transport.requests import Request
-        from google.oauth2.credentials import Credentials
-        from google_auth_oauthlib.flow import InstalledAppFlow
-        from googleapiclient.discovery import build
+        try:
+            from google.auth.transport.requests import Request
+            from google.oauth2.credentials import Credentials
+            from google_auth_oauthlib.flow import InstalledAppFlow
+            from googleapiclient.discovery import build
+        except ImportError as e:
+            raise RuntimeError("Google Calendar export requires google-auth, google-auth-oauthlib, "
+                               "and google-api-python-client packages") from e
         
         SCOPES = ['https://www.googleapis.com/auth/calendar']
         creds = None
@@ -230,6 +1087,7 @@ class GoogleCalendarExporter:
             with open(token_file, 'w') as token:
                 token.write(creds.to_json())
         
+        self._credentials = creds
         self.service = build('calendar', 'v3', credentials=creds)
         print("Google Calendar authentication successful")
     
@@ -243,23 +1101,139 @@ class GoogleCalendarExporter:
         if end_date is None:
             end_date = datetime(datetime.now().year, 12, 31, 23, 59, 59).isoformat() + 'Z'
         
-        print(f"Fetching events to delete from Google Calendar...")
-        events_result = self.service.events().list(
-            calendarId=self.calendar_id,
-            timeMin=start_date,
-            timeMax=end_date,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
+        print(f"Deleting events from Google Calendar...")
+        start = time.perf_counter()
+        
+        # Listing and deleting are pipelined: each page of ids is turned into
+        # delete requests that go out as soon as a batch is full
+        remote_events = self._iter_remote_events(start_date, end_date, fields='nextPageToken,items(id)')
+        requests = ((event['id'], self.service.events().delete(calendarId=self.calendar_id, eventId=event['id']))
+                    for event in remote_events)
+        done, failed = self._execute_batched(requests)
+        
+        print(f"Cleared {done} events from calendar in {time.perf_counter() - start:.1f}s")
+        if failed:
+            print(f"✗ Failed to delete {len(failed)} events")
+    
+    @staticmethod
+    def _is_rate_limited(exception):
+        """True for 429 and 403 rateLimitExceeded/userRateLimitExceeded errors"""
+        status = getattr(getattr(exception, 'resp', None), 'status', None)
+        if status == 429:
+            return True
+        content = getattr(exception, 'content', b'') or b''
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'replace')
+        return status == 403 and ('rateLimitExceeded' in content or 'userRateLimitExceeded' in content)
+    
+    def _execute_batched(self, requests):
+        """Send (label, request) pairs as batch requests, retrying rate-limited ones
         
-        events = events_result.get('items', [])
+        requests may be a generator; it is consumed one batch at a time.
+        Returns the number of successful requests and the failed (label, error) pairs.
+        """
+        batch_size = config.GOOGLE_CALENDAR.get("batch_size", 50)
+        max_retries = config.GOOGLE_CALENDAR.get("max_retries", 5)
+        backoff = config.GOOGLE_CALENDAR.get("retry_backoff", 1.0)
         
-        for event in events:
-            self.service.events().delete(calendarId=self.calendar_id, eventId=event['id']).execute()
-            print(f"Deleted: {event.get('summary', 'Untitled')}")
+        done = 0
+        failed = []
+        latencies = []
+        retries = 0
+        requests = iter(requests)
         
-        print(f"Cleared {len(events)} events from calendar")
+        while True:
+            pending = list(itertools.islice(requests, batch_size))
+            if not pending:
+                break
+            
+            for attempt in range(max_retries + 1):
+                outcome = {}
+                
+                def callback(request_id, response, exception):
+                    outcome[int(request_id)] = exception
+                
+                batch = self.service.new_batch_http_request(callback=callback)
+                for n, (label, request) in enumerate(pending):
+                    batch.add(request, request_id=str(n))
+                
+                self.throttle.acquire(len(pending))
+                start = time.perf_counter()
+                try:
+                    batch.execute()
+                except Exception as e:
+                    # The batch itself failed: every sub-request shares the error
+                    outcome = {n: e for n in range(len(pending))}
+                latencies.append(time.perf_counter() - start)
+                Metrics.count("google_batches")
+                Metrics.count("google_requests", len(pending))
+                Metrics.observe("google_batch_seconds", latencies[-1])
+                
+                retry = []
+                for n, (label, request) in enumerate(pending):
+                    exception = outcome.get(n)
+                    if exception is None:
+                        done += 1
+                    elif self._is_rate_limited(exception) and attempt < max_retries:
+                        retry.append((label, request))
+                    else:
+                        failed.append((label, exception))
+                        Metrics.count("google_failures")
+                        print(f"Warning: Request failed for '{label}': {exception}")
+                
+                if not retry:
+                    self.throttle.speed_up()
+                    break
+                
+                # Exponential backoff with jitter before resending the rate-limited part
+                self.throttle.slow_down()
+                retries += len(retry)
+                Metrics.count("google_retries", len(retry))
+                time.sleep(backoff * (2 ** attempt) + random.uniform(0, backoff))
+                pending = retry
+            
+            print(f"Progress: {done + len(failed)} requests sent...")
+        
+        if latencies:
+            print(f"Batches: {len(latencies)} sent, avg {sum(latencies) / len(latencies) * 1000:.0f} ms, "
+                  f"max {max(latencies) * 1000:.0f} ms, {retries} retried, {len(failed)} failed"
+                  + (f", {self.throttle.waited:.1f}s throttled" if self.throttle.waited else ""))
+        
+        return done, failed
     
+    def _build_event_body(self, event_data):
+        """Build the API body for one TSI event with proper DST handling"""
+        timezone_str = config.GOOGLE_CALENDAR["timezone"]
+        location = config.GOOGLE_CALENDAR["location"]
+        
+        # Localized once per event (DST is resolved for each date)
+        start_datetime, end_datetime = _event_datetimes(event_data)
+        
+        # Create event body
+        return {
+            'summary': event_data.get('title', 'Untitled Event'),
+            'location': location,
+            'description': f"Lecturer: {event_data.get('lecturer', 'N/A')}\n"
+                           f"Room: {event_data.get('room', 'N/A')}\n"
+                           f"Group: {event_data.get('group', 'N/A')}\n"
+                           f"Note: {event_data.get('description', '')}",
+            'start': {
+                'dateTime': start_datetime.isoformat(),
+                'timeZone': timezone_str,
+            },
+            'end': {
+                'dateTime': end_datetime.isoformat(),
+                'timeZone': timezone_str,
+            },
+            'reminders': {
+                'useDefault': False,
+                'overrides': [
+                    {'method': 'popup', 'minutes': 15},
+                ],
+            },
+        }
+    
+    @Metrics.timed("export", format="google_calendar", mode="replace")
     def export(self, events, clear_first=True):
         """Export events to Google Calendar with proper DST handling"""
         if not self.service:
@@ -268,76 +1242,197 @@ class GoogleCalendarExporter:
         if clear_first:
             self.clear_calendar()
         
-        timezone_str = config.GOOGLE_CALENDAR["timezone"]
-        location = config.GOOGLE_CALENDAR["location"]
-        
-        success_count = 0
+        normalize_events(events, config.GOOGLE_CALENDAR["timezone"])
+        requests = []
         error_count = 0
         
         for event_data in events:
-            # Parse date and time
-            date_str = event_data.get('date', '')
-            start_time_str = event_data.get('start_time', '00:00')
-            end_time_str = event_data.get('end_time', '00:00')
-            
             try:
-                # Create datetime objects
-                date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-                start_time = datetime.strptime(start_time_str, "%H:%M" if ':' in start_time_str else "%H:%M:%S")
-                end_time = datetime.strptime(end_time_str, "%H:%M" if ':' in end_time_str else "%H:%M:%S")
-                
-                # Combine date and time - create naive datetime first
-                start_datetime_naive = date_obj.replace(hour=start_time.hour, minute=start_time.minute)
-                end_datetime_naive = date_obj.replace(hour=end_time.hour, minute=end_time.minute)
-                
-                # Make timezone-aware using pytz to properly handle DST
-                if self.timezone and self.pytz:
-                    # Use localize() to properly handle DST transitions
-                    # This will automatically determine if DST is active for the given date
-                    start_datetime = self.timezone.localize(start_datetime_naive)
-                    end_datetime = self.timezone.localize(end_datetime_naive)
-                else:
-                    # Fallback: use naive datetime (not recommended)
-                    start_datetime = start_datetime_naive
-                    end_datetime = end_datetime_naive
-                
-                # Create event body
-                event_body = {
-                    'summary': event_data.get('title', 'Untitled Event'),
-                    'location': location,
-                    'description': f"Lecturer: {event_data.get('lecturer', 'N/A')}\n"
-                                   f"Room: {event_data.get('room', 'N/A')}\n"
-                                   f"Group: {event_data.get('group', 'N/A')}\n"
-                                   f"Note: {event_data.get('description', '')}",
-                    'start': {
-                        'dateTime': start_datetime.isoformat(),
-                        'timeZone': timezone_str,
-                    },
-                    'end': {
-                        'dateTime': end_datetime.isoformat(),
-                        'timeZone': timezone_str,
-                    },
-                    'reminders': {
-                        'useDefault': False,
-                        'overrides': [
-                            {'method': 'popup', 'minutes': 15},
-                        ],
-                    },
-                }
-                
-                # Insert event
-                self.service.events().insert(calendarId=self.calendar_id, body=event_body).execute()
-                success_count += 1
-                
-                # Show progress every 10 events
-                if success_count % 10 == 0:
-                    print(f"Progress: {success_count}/{len(events)} events exported...")
-                
+                event_body = self._build_event_body(event_data)
             except Exception as e:
                 error_count += 1
-                print(f"Warning: Could not export event '{event_data.get('title', 'Unknown')}' on {date_str}: {e}")
+                print(f"Warning: Could not export event '{event_data.get('title', 'Unknown')}' on "
+                      f"{event_data.get('date', '')}: {e}")
+                continue
+            
+            label = f"{event_body['summary']} on {event_data.get('date', '')}"
+            requests.append((label, self.service.events().insert(calendarId=self.calendar_id, body=event_body)))
+        
+        # Insert events
+        success_count, failed = self._execute_batched(requests)
+        error_count += len(failed)
+        Metrics.count("events_exported", success_count, format="google_calendar")
         
         print(f"\n✓ Successfully exported {success_count} events to Google Calendar")
         if error_count > 0:
             print(f"✗ Failed to export {error_count} events")
+    
+    @staticmethod
+    def body_hash(event_body):
+        """Fingerprint of everything we write, used to detect changed events"""
+        payload = json.dumps(event_body, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    
+    def _iter_remote_events(self, time_min, time_max, fields=None):
+        """Yield calendar events in the range, streaming through every page
+        
+        fields is a partial-response projection, e.g. 'nextPageToken,items(id)'.
+        """
+        page_token = None
+        pages = 0
+        while True:
+            params = {
+                'calendarId': self.calendar_id,
+                'timeMin': time_min,
+                'timeMax': time_max,
+                'singleEvents': True,
+                'maxResults': config.GOOGLE_CALENDAR.get("page_size", 2500),
+            }
+            if fields:
+                params['fields'] = fields
+            if page_token:
+                params['pageToken'] = page_token
+            
+            self.throttle.acquire()
+            result = self.service.events().list(**params).execute()
+            pages += 1
+            Metrics.count("google_list_pages")
+            yield from result.get('items', [])
+            
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                print(f"Listed {pages} page(s) of calendar events")
+                return
+    
+    def plan_sync(self, events, remote_events):
+        """Work out which events to insert, update and delete"""
+        desired = {}
+        for tsi_id, event_data in with_stable_ids(events):
+            try:
+                body = self._build_event_body(event_data)
+            except ValueError as e:
+                print(f"Warning: Could not parse date/time for event '{event_data.get('title', 'Unknown')}': {e}")
+                continue
+            
+            body_hash = self.body_hash(body)
+            body['extendedProperties'] = {'private': {'tsiId': tsi_id, 'tsiHash': body_hash}}
+            desired[tsi_id] = body
+        
+        inserts, updates, deletes = [], [], []
+        seen = set()
+        for remote in remote_events:
+            private = remote.get('extendedProperties', {}).get('private', {})
+            tsi_id = private.get('tsiId')
+            # Unmanaged events and duplicates are removed, as clear_calendar would
+            if tsi_id not in desired or tsi_id in seen:
+                deletes.append(remote['id'])
+                continue
+            seen.add(tsi_id)
+            body = desired[tsi_id]
+            if private.get('tsiHash') != body['extendedProperties']['private']['tsiHash']:
+                updates.append((remote['id'], body))
+        
+        for tsi_id, body in desired.items():
+            if tsi_id not in seen:
+                inserts.append(body)
+        
+        return inserts, updates, deletes
+    
+    @Metrics.timed("export", format="google_calendar", mode="sync")
+    def sync(self, events, time_min=None, time_max=None):
+        """Bring the calendar in line with events, touching only what changed"""
+        if not self.service:
+            self.authenticate()
+        
+        if time_min is None:
+            time_min = datetime(config.DATE_RANGE["from_year"], config.DATE_RANGE["from_month"], 1).isoformat() + 'Z'
+        if time_max is None:
+            time_max = (datetime(config.DATE_RANGE["to_year"], config.DATE_RANGE["to_month"], 1)
+                        + relativedelta(months=1)).isoformat() + 'Z'
+        
+        print("Comparing events with Google Calendar...")
+        remote_events = list(self._iter_remote_events(
+            time_min, time_max, fields='nextPageToken,items(id,extendedProperties)'))
+        
+        inserts, updates, deletes = self.plan_sync(events, remote_events)
+        
+        print(f"Sync plan: {len(inserts)} to insert, {len(updates)} to update, {len(deletes)} to delete, "
+              f"{len(remote_events) - len(updates) - len(deletes)} unchanged")
+        
+        events_api = self.service.events()
+        requests = [(f"delete {event_id}", events_api.delete(calendarId=self.calendar_id, eventId=event_id))
+                    for event_id in deletes]
+        requests += [(f"update {body['summary']}",
+                      events_api.update(calendarId=self.calendar_id, eventId=event_id, body=body))
+                     for event_id, body in updates]
+        requests += [(f"insert {body['summary']}", events_api.insert(calendarId=self.calendar_id, body=body))
+                     for body in inserts]
+        
+        _, failed = self._execute_batched(requests)
+        error_count = len(failed)
+        Metrics.count("events_exported", len(inserts) + len(updates), format="google_calendar")
+        
+        print(f"\n✓ Google Calendar synced: {len(inserts)} inserted, {len(updates)} updated, {len(deletes)} deleted")
+        if error_count > 0:
+            print(f"✗ {error_count} changes failed")
+        
+        return {"inserted": len(inserts), "updated": len(updates), "deleted": len(deletes), "errors": error_count}
+
+
+def _route_matches(event, field, values):
+    if field == "group":
+        return any(group in values for group in split_groups(event.group))
+    if field == "lecturer":
+        lecturer = (event.lecturer or '').lower()
+        return any(value in lecturer for value in values)
+    return event.type in values
+
 
+class _Throttle:
+    """Token bucket for the API requests of one calendar that slows down when Google rate-limits
+    
+    rate is requests per second; None turns the throttle off (rate-limited
+    requests are still retried with backoff). Every rate-limited batch halves
+    the rate, every clean batch raises it by a tenth again, up to the
+    configured rate. Used by one worker only.
+    """
+    
+    MIN_RATE = 1.0
+    
+    def __init__(self, rate=None, clock=time.monotonic, sleep=time.sleep):
+        self.ceiling = rate
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self.sent = 0
+        self.waited = 0.0
+        self.available = 0.0
+        self.updated = None
+    
+    def acquire(self, count=1):
+        """Wait until count more requests fit the rate (a batch counts each sub-request)"""
+        self.sent += count
+        if self.rate is None:
+            return
+        now = self.clock()
+        if self.updated is None:
+            self.updated = now
+        # Unused capacity doesn't carry over: Google counts requests over a sliding window
+        self.available = min(0.0, self.available + (now - self.updated) * self.rate) - count
+        self.updated = now
+        if self.available < 0:
+            wait = -self.available / self.rate
+            self.sleep(wait)
+            self.waited += wait
+            self.available = 0.0
+            self.updated = now + wait
+            Metrics.observe("google_throttle_seconds", wait)
+    
+    def slow_down(self):
+        if self.rate is not None:
+            self.rate = max(self.MIN_RATE, self.rate / 2)
+            Metrics.count("google_throttle_slowdowns")
+    
+    def speed_up(self):
+        if self.rate is not None:
+            self.rate = min(self.ceiling, self.rate * 1.1)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Run metrics: stage timers, counters and histograms, written as JSON lines
+or as a Prometheus textfile
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+import config
+
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """Metrics of one process; every update takes the lock, so workers can share it"""
+    
+    def __init__(self):
+        self.counters = {}
+        self.timers = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+    
+    def count(self, key, value):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def add_time(self, key, seconds):
+        with self._lock:
+            calls, total = self.timers.get(key, (0, 0.0))
+            self.timers[key] = (calls + 1, total + seconds)
+    
+    def observe(self, key, value):
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+                    break
+            histogram["count"] += 1
+            histogram["sum"] += value
+    
+    def snapshot(self):
+        """Plain-dict copy of every metric; keys are 'name' or 'name{label=value,...}'"""
+        with self._lock:
+            return {
+                "counters": {_flat_key(key): value for key, value in self.counters.items()},
+                "timers": {_flat_key(key): {"calls": calls, "seconds": total}
+                           for key, (calls, total) in self.timers.items()},
+                "histograms": {_flat_key(key): {"count": h["count"], "sum": h["sum"],
+                                                "buckets": dict(zip(map(str, BUCKETS), _cumulative(h["buckets"])))}
+                               for key, h in self.histograms.items()},
+            }
+    
+    def prometheus(self, prefix="tsi"):
+        """Prometheus text exposition format"""
+        lines = []
+        
+        def family(name, kind):
+            header = f"# TYPE {name} {kind}"
+            if header not in lines:
+                lines.append(header)
+        
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                family(f"{prefix}_{name}_total", "counter")
+                lines.append(f"{prefix}_{name}_total{_prom_labels(labels)} {value}")
+            for (name, labels), (calls, total) in sorted(self.timers.items()):
+                stage = (("stage", name),) + labels
+                family(f"{prefix}_stage_seconds_total", "counter")
+                lines.append(f"{prefix}_stage_seconds_total{_prom_labels(stage)} {total:.6f}")
+            for (name, labels), (calls, total) in sorted(self.timers.items()):
+                stage = (("stage", name),) + labels
+                family(f"{prefix}_stage_calls_total", "counter")
+                lines.append(f"{prefix}_stage_calls_total{_prom_labels(stage)} {calls}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                family(f"{prefix}_{name}", "histogram")
+                for bound, count in zip(BUCKETS, _cumulative(h["buckets"])):
+                    lines.append(f"{prefix}_{name}_bucket{_prom_labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{prefix}_{name}_bucket{_prom_labels(labels + (('le', '+Inf'),))} {h['count']}")
+                lines.append(f"{prefix}_{name}_sum{_prom_labels(labels)} {h['sum']:.6f}")
+                lines.append(f"{prefix}_{name}_count{_prom_labels(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    __slots__ = ("registry", "key", "start")
+    
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.registry.add_time(self.key, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+# None while metrics are disabled: every call below is then a single check
+_registry = None
+
+
+def enable():
+    """Start collecting (idempotent); returns the registry"""
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
+
+
+def disable():
+    global _registry
+    _registry = None
+
+
+def enabled():
+    return _registry is not None
+
+
+def configure():
+    """Enable collection when config.METRICS says so"""
+    if config.METRICS.get("enabled"):
+        enable()
+
+
+def timer(name, **labels):
+    """Context manager adding the wall time of the block to a stage timer"""
+    if _registry is None:
+        return _NULL_TIMER
+    return _Timer(_registry, (name, tuple(sorted(labels.items()))))
+
+
+def timed(name, **labels):
+    """Decorator: time every call of the function with timer(name, **labels)"""
+    key = (name, tuple(sorted(labels.items())))
+    
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _registry is None:
+                return function(*args, **kwargs)
+            with _Timer(_registry, key):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1, **labels):
+    """Add value to a counter, e.g. count("cache_lookups", outcome="hits")"""
+    if _registry is not None:
+        _registry.count((name, tuple(sorted(labels.items()))), value)
+
+
+def observe(name, value, **labels):
+    """Record one value (seconds) in a histogram"""
+    if _registry is not None:
+        _registry.observe((name, tuple(sorted(labels.items()))), value)
+
+
+def write(filename=None, output_format=None):
+    """Write the collected metrics: append a JSON line, or replace the Prometheus textfile"""
+    if _registry is None:
+        return None
+    output_format = output_format or config.METRICS.get("format", "jsonl")
+    filename = filename or config.METRICS["file"]
+    
+    if output_format == "prometheus":
+        # node_exporter may read the file at any time, so replace it atomically
+        tmp_path = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(_registry.prometheus())
+        os.replace(tmp_path, filename)
+    else:
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), **_registry.snapshot()}
+        with open(filename, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+    return filename
+
+
+def _flat_key(key):
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{label}={value}" for label, value in labels) + "}"
+
+
+def _prom_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+def _cumulative(counts):
+    total = 0
+    result = []
+    for value in counts:
+        total += value
+        result.append(total)
+    return result
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Export pipeline: a registry of output formats run side by side on one event list
+"""
+
+import contextlib
+import importlib
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config
+
+
+# Output format -> exporter class or "module:Class" (imported only when the format is used)
+EXPORTERS = {
+    "table": "Exporters:TableExporter",
+    "json": "Exporters:JSONExporter",
+    "ics": "Exporters:ICSExporter",
+    "sqlite": "Exporters:SQLiteExporter",
+    "parquet": "Exporters:ParquetExporter",
+    "google_calendar": "Exporters:GoogleCalendarExporter",
+}
+
+
+def register_exporter(name, exporter):
+    """Add (or replace) an output format
+    
+    exporter is a class or a "module:Class" string. The class is instantiated
+    without arguments and must provide run(events, job), where job holds
+    "filters", "target" (batch target name or None) and "months" (the changed
+    (year, month) pairs in watch mode, otherwise None). Exporters must not
+    modify the events: they are shared with the other exporters. Formats that
+    can be streamed (--stream) also provide open_stream(job), returning a
+    writer with write(events), called once per chunk, and close().
+    """
+    EXPORTERS[name] = exporter
+
+
+def load_exporter(name):
+    """Exporter class for a format name, importing its module on first use"""
+    exporter = EXPORTERS[name]
+    if isinstance(exporter, str):
+        module_name, _, class_name = exporter.partition(":")
+        exporter = EXPORTERS[name] = getattr(importlib.import_module(module_name), class_name)
+    return exporter
+
+
+class ExportPipeline:
+    """Feeds one normalized event list to several exporters concurrently
+    
+    Exporters that write to the terminal (interactive = True) run first, one
+    at a time, so their output isn't interleaved; the others share a thread
+    pool. A failing exporter is reported and doesn't stop the rest. Exporter
+    instances are kept, so e.g. Google authenticates once per pipeline.
+    """
+    
+    def __init__(self, formats=None, max_workers=None):
+        if formats is None:
+            formats = config.OUTPUT["formats"]
+        self.formats = [format_type.lower().strip() for format_type in formats]
+        self.max_workers = max_workers or config.OUTPUT.get("max_workers", 4)
+        self._exporters = {}
+    
+    def _exporter(self, name):
+        if name not in self._exporters:
+            self._exporters[name] = load_exporter(name)()
+        return self._exporters[name]
+    
+    def _run_one(self, name, events, job, started):
+        """Run one exporter, capturing its result or error, its duration and when it finished"""
+        start = time.perf_counter()
+        try:
+            result = self._exporter(name).run(events, job)
+            outcome = {"ok": True, "result": result}
+        except Exception as e:
+            print(f"Error exporting to {name}: {e}")
+            outcome = {"ok": False, "error": str(e)}
+        outcome["seconds"] = time.perf_counter() - start
+        outcome["finished"] = time.perf_counter() - started
+        return outcome
+    
+    def run(self, events, filters=None, target_name=None, months=None):
+        """Export events in every format
+        
+        Returns {format: outcome}; outcome has "ok", "result" or "error",
+        "seconds" (run time) and "finished" (seconds since the pipeline started).
+        """
+        job = {"filters": filters or config.FILTERS, "target": target_name, "months": months}
+        started = time.perf_counter()
+        results = {}
+        parallel = []
+        
+        for name in self.formats:
+            if name not in EXPORTERS:
+                print(f"Warning: Unknown export format '{name}'")
+                continue
+            try:
+                interactive = getattr(load_exporter(name), "interactive", False)
+            except (ImportError, AttributeError) as e:
+                print(f"Error exporting to {name}: {e}")
+                results[name] = {"ok": False, "error": str(e), "seconds": 0.0, "finished": 0.0}
+                continue
+            if interactive:
+                results[name] = self._run_one(name, events, job, started)
+            else:
+                parallel.append(name)
+        
+        if len(parallel) == 1 or self.max_workers == 1:
+            for name in parallel:
+                results[name] = self._run_one(name, events, job, started)
+        elif parallel:
+            output = LineWriter(sys.stdout)
+            with contextlib.redirect_stdout(output), \
+                    ThreadPoolExecutor(max_workers=min(self.max_workers, len(parallel))) as executor:
+                futures = {name: executor.submit(self._run_one, name, events, job, started) for name in parallel}
+                for name, future in futures.items():
+                    results[name] = future.result()
+            output.close()
+        
+        results = {name: results[name] for name in self.formats if name in results}
+        self.report(results)
+        return results
+    
+    def run_stream(self, chunks, filters=None, target_name=None):
+        """Export a stream of event chunks in every format that can take one
+        
+        A format streams when its exporter has open_stream(job), returning a
+        writer with write(events) and close(); the others are skipped with a
+        warning. Every chunk goes to each writer in turn before the next one
+        is pulled, so only one chunk is held at a time. Returns {format: outcome}
+        as run() does.
+        """
+        job = {"filters": filters or config.FILTERS, "target": target_name, "months": None}
+        started = time.perf_counter()
+        results = {}
+        writers = {}
+        
+        for name in self.formats:
+            if name not in EXPORTERS:
+                print(f"Warning: Unknown export format '{name}'")
+                continue
+            start = time.perf_counter()
+            try:
+                if not hasattr(load_exporter(name), "open_stream"):
+                    print(f"Warning: {name} output does not support streaming; skipped")
+                    continue
+                writers[name] = self._exporter(name).open_stream(job)
+                results[name] = {"ok": True, "seconds": time.perf_counter() - start}
+            except Exception as e:
+                print(f"Error exporting to {name}: {e}")
+                results[name] = {"ok": False, "error": str(e), "seconds": time.perf_counter() - start,
+                                 "finished": 0.0}
+        
+        try:
+            for chunk in chunks:
+                for name, writer in list(writers.items()):
+                    start = time.perf_counter()
+                    try:
+                        writer.write(chunk)
+                    except Exception as e:
+                        print(f"Error exporting to {name}: {e}")
+                        results[name].update(ok=False, error=str(e), finished=time.perf_counter() - started)
+                        del writers[name]
+                        with contextlib.suppress(Exception):
+                            getattr(writer, "abort", writer.close)()
+                    results[name]["seconds"] += time.perf_counter() - start
+        except BaseException:
+            # The chunks failed (e.g. a month fetch): leave every previous output as it was
+            for writer in writers.values():
+                with contextlib.suppress(Exception):
+                    getattr(writer, "abort", writer.close)()
+            raise
+        
+        for name, writer in writers.items():
+            start = time.perf_counter()
+            try:
+                results[name]["result"] = writer.close()
+            except Exception as e:
+                print(f"Error exporting to {name}: {e}")
+                results[name].update(ok=False, error=str(e))
+            results[name]["seconds"] += time.perf_counter() - start
+            results[name]["finished"] = time.perf_counter() - started
+        
+        self.report(results)
+        return results
+    
+    @staticmethod
+    def report(results):
+        if not results:
+            return
+        parts = [f"{name} {outcome['seconds']:.2f}s" + ("" if outcome["ok"] else " (failed)")
+                 for name, outcome in results.items()]
+        print(f"Export timings: {', '.join(parts)}")
+
+
+class LineWriter:
+    """stdout stand-in that writes whole lines, so parallel exporters don't interleave mid-line
+    
+    Inside labeled(name), the current thread's lines are prefixed with [name].
+    """
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self._labels = {}
+        self._buffers = {}
+        self._lock = threading.Lock()
+    
+    @contextlib.contextmanager
+    def labeled(self, name):
+        """Prefix the lines the current thread writes inside the block with [name]"""
+        thread = threading.get_ident()
+        with self._lock:
+            self._labels[thread] = f"[{name}] "
+        try:
+            yield
+        finally:
+            # Thread ids are reused: write out the last partial line and drop the label
+            with self._lock:
+                rest = self._buffers.pop(thread, "")
+                prefix = self._labels.pop(thread)
+                if rest:
+                    self.stream.write(f"{prefix}{rest}\n")
+                    self.stream.flush()
+    
+    def write(self, text):
+        with self._lock:
+            thread = threading.get_ident()
+            lines, newline, rest = (self._buffers.pop(thread, "") + text).rpartition("\n")
+            if newline:
+                prefix = self._labels.get(thread)
+                if prefix:
+                    lines = "\n".join(f"{prefix}{line}" if line else line for line in lines.split("\n"))
+                self.stream.write(lines + newline)
+                self.stream.flush()
+            if rest:
+                self._buffers[thread] = rest
+        return len(text)
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        """Write what is left of unterminated lines"""
+        with self._lock:
+            for rest in self._buffers.values():
+                self.stream.write(rest + "\n")
+            self._buffers.clear()
+            self.stream.flush()
@@ -4,39 +4,100 @@ TSI Calendar Scraper
 Fetches calendar data from TSI mob-back portal
 """
 
-import requests
+import heapq
 import json
+import os
 import re
-from bs4 import BeautifulSoup
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from Cache import AtomicFile, MonthCache
+from Events import Event, EventStore
 import config
+import Metrics
+
+# requests (with Transport) and BeautifulSoup are imported on first use: a run
+# served entirely from the cache never touches the network
+
+
+_JSON_DECODER = json.JSONDecoder()
+_TOKEN_RE = re.compile(r'<input[^>]*name="_token"[^>]*>', re.IGNORECASE)
+_VALUE_RE = re.compile(r'value="([^"]*)"')
+_LOGOUT_RE = re.compile(r'logout', re.IGNORECASE)
+# Only whitespace and "=" may sit between the name and the literal
+_EVENTS_RE = re.compile(r'const events\s*=\s*')
 
 
 class TSICalendar:
-    """TSI Calendar scraper class"""
+    """TSI Calendar scraper class
+    
+    The HTTP session is created, and the login done, on the first request
+    that has to go to the portal; login() can still be called up front.
+    """
     
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
+        self._session = None
+        self.timeout = (config.HTTP["connect_timeout"], config.HTTP["read_timeout"])
+        self.timings = None
+        self.cache = MonthCache() if config.CACHE["enabled"] else None
+        self.events = []
+        self._session_lock = threading.Lock()
+        self._login_lock = threading.Lock()
+        self._login_generation = 0
+        self._logged_in = False
+    
+    @property
+    def session(self):
+        """requests session, created on first use"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+    
+    def _create_session(self):
+        import requests
+        import Transport
+        
+        session = requests.Session()
+        session.headers.update({
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Encoding": Transport.accept_encoding(),
             "Accept-Language": "en-US,en;q=0.5",
+            "Connection": "keep-alive",
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:144.0) Gecko/20100101 Firefox/144.0"
         })
-        self.events = []
+        # Pooled keep-alive connections (enough for parallel month requests) with retries
+        adapter = Transport.create_adapter()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self.timings = Transport.RequestTimings()
+        return session
     
     def login(self):
-        """Authenticate with TSI portal"""
+        """Authenticate with TSI portal (reusing saved session cookies while they are valid)"""
+        if self._load_cookies():
+            if not config.SESSION.get("probe", True) or self._session_valid():
+                Metrics.count("logins", method="saved_session")
+                print("Login successful (saved session)")
+                self._logged_in = True
+                return
+            self.session.cookies.clear()
+        
+        self._authenticate()
+    
+    def _authenticate(self):
+        """Log in with username and password"""
         # Get login page and extract CSRF token
-        resp = self.session.get(config.LOGIN_PAGE)
-        soup = BeautifulSoup(resp.text, "html.parser")
-        token_input = soup.find("input", attrs={"name": "_token"})
+        resp = self.session.get(config.LOGIN_PAGE, timeout=self.timeout)
+        csrf_token = self._extract_token(resp.text)
         
-        if not token_input or not token_input.get("value"):
+        if not csrf_token:
             raise RuntimeError("Could not find CSRF token")
         
-        csrf_token = token_input["value"]
-        
         # Login with multipart/form-data
         login_data = {
             "_token": (None, csrf_token),
@@ -49,96 +110,477 @@ class TSICalendar:
             "Origin": config.BASE_URL,
         }
         
-        resp = self.session.post(config.AUTH_URL, files=login_data, headers=headers, allow_redirects=True)
+        resp = self.session.post(config.AUTH_URL, files=login_data, headers=headers, allow_redirects=True,
+                                 timeout=self.timeout)
         
         # Check if login was successful
-        if "logout" not in resp.text.lower():
+        if not _LOGOUT_RE.search(resp.text):
             raise RuntimeError("Login failed - check credentials")
         
+        self._login_generation += 1
+        self._logged_in = True
+        self._save_cookies()
+        Metrics.count("logins", method="password")
         print("Login successful")
     
-    def fetch_month(self, year, month):
-        """Fetch calendar data for a specific month"""
+    @staticmethod
+    def _extract_token(html):
+        """CSRF token from the login form; regex first, BeautifulSoup as fallback"""
+        match = _TOKEN_RE.search(html)
+        if match:
+            value = _VALUE_RE.search(match.group(0))
+            if value and value.group(1):
+                return value.group(1)
+        
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, "html.parser")
+        token_input = soup.find("input", attrs={"name": "_token"})
+        return token_input.get("value") if token_input else None
+    
+    def _session_valid(self):
+        """Probe the calendar with one HEAD request; a redirect means the session expired"""
+        from requests import RequestException
+        try:
+            resp = self.session.head(config.CALENDAR_URL, allow_redirects=False, timeout=self.timeout)
+        except RequestException:
+            return False
+        return resp.status_code < 300
+    
+    def _is_login_redirect(self, resp):
+        return bool(resp.history) and resp.url.split("?")[0] == config.LOGIN_PAGE
+    
+    def _get(self, url, **kwargs):
+        """GET that logs in first if needed, and again (once) when the session has expired"""
+        if not self._logged_in:
+            with self._login_lock:
+                if not self._logged_in:
+                    self.login()
+        kwargs.setdefault("timeout", self.timeout)
+        generation = self._login_generation
+        resp = self._timed_get(url, **kwargs)
+        if not self._is_login_redirect(resp):
+            return resp
+        
+        # Parallel workers can all hit the expiry; only the first one logs in
+        with self._login_lock:
+            if self._login_generation == generation:
+                print("Session expired - logging in again")
+                self._authenticate()
+        return self._timed_get(url, **kwargs)
+    
+    def _timed_get(self, url, **kwargs):
+        started = self.timings.start()
+        resp = self.session.get(url, **kwargs)
+        self.timings.record(resp, started)
+        return resp
+    
+    def _load_cookies(self):
+        """Restore cookies saved by a previous run; True if there were any"""
+        cookie_file = config.SESSION.get("cookie_file")
+        if not cookie_file or not os.path.exists(cookie_file):
+            return False
+        try:
+            with open(cookie_file, encoding="utf-8") as f:
+                cookies = json.load(f)
+        except (OSError, ValueError):
+            return False
+        
+        for cookie in cookies:
+            self.session.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"],
+                                     path=cookie["path"], expires=cookie["expires"], secure=cookie["secure"])
+        return bool(cookies)
+    
+    def _save_cookies(self):
+        """Persist session cookies (readable by the owner only)"""
+        cookie_file = config.SESSION.get("cookie_file")
+        if not cookie_file:
+            return
+        cookies = [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+                    "expires": c.expires, "secure": c.secure} for c in self.session.cookies]
+        # The temp file is created 0o600; replacing also tightens an older, wider one
+        with AtomicFile(cookie_file, "w", encoding="utf-8") as f:
+            json.dump(cookies, f)
+    
+    def fetch_month(self, year, month, filters=None, revalidate=False):
+        """Fetch calendar data for a specific month (served from cache when fresh)
+        
+        With revalidate, even a fresh cache entry is checked with the server.
+        """
+        if filters is None:
+            filters = config.FILTERS
+        
         params = {
             "view": "month",
             "date": f"{year}-{month:02d}-01",
-            "room": config.FILTERS["room"],
-            "lecturer": config.FILTERS["lecturer"],
-            "group": config.FILTERS["group"],
-            "type[]": config.FILTERS["type"],
+            "room": filters["room"],
+            "lecturer": filters["lecturer"],
+            "group": filters["group"],
+            "type[]": filters["type"],
             "year": year,
             "month": month
         }
         
-        resp = self.session.get(config.CALENDAR_URL, params=params)
+        if self.cache is None:
+            resp = self._get(config.CALENDAR_URL, params=params)
+            resp.raise_for_status()
+            events = self._parse_events(resp.text)
+            return self._unparsed_month(year, month) if events is None else events
+        
+        key = MonthCache.make_key(year, month, filters)
+        entry = self.cache.get(key)
+        if entry and MonthCache.is_fresh(entry) and not revalidate:
+            self.cache.record("hits")
+            return [Event.from_dict(data) for data in entry["events"]]
+        
+        # Stale entry: ask the server whether the page changed since
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        
+        resp = self._get(config.CALENDAR_URL, params=params, headers=headers)
+        if resp.status_code == 304 and entry:
+            self.cache.record("revalidated")
+            self.cache.touch(key, entry)
+            return [Event.from_dict(data) for data in entry["events"]]
         resp.raise_for_status()
         
-        return self._parse_events(resp.text)
+        events = self._parse_events(resp.text)
+        if events is None:
+            return self._unparsed_month(year, month, entry)
+        self.cache.record("misses")
+        self.cache.put(key, [event.to_dict() for event in events],
+                       resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+        return events
+    
+    def _unparsed_month(self, year, month, entry=None):
+        """A page without the events literal (maintenance page, login form): never cached as an empty month
+        
+        The stored snapshot is served when there is one; otherwise the fetch fails.
+        """
+        Metrics.count("unparsed_pages")
+        if entry is not None:
+            print(f"Warning: no events data in the page for {year}-{month:02d}; using the cached copy")
+            self.cache.record("hits")
+            return [Event.from_dict(data) for data in entry["events"]]
+        print(f"Warning: no events data in the page for {year}-{month:02d}")
+        raise ValueError(f"calendar page for {year}-{month:02d} has no events data "
+                         f"(maintenance or login page?)")
     
+    @Metrics.timed("parse")
     def _parse_events(self, html):
-        """Parse events from calendar HTML"""
+        """Parse events from calendar HTML; None when the page has no events literal"""
+        events_by_date = self._extract_events_fast(html)
+        if events_by_date is None:
+            Metrics.count("parse_fallbacks")
+            events_by_date = self._extract_events_soup(html)
+        if events_by_date is None:
+            return None
+        
+        events = []
+        for date, date_events in events_by_date.items():
+            for event in date_events:
+                events.append(Event.from_dict(event, date))
+        Metrics.count("events_parsed", len(events))
+        return events
+    
+    @staticmethod
+    def _extract_events_fast(html):
+        """Decode the `const events = {...};` literal straight from the raw page
+        
+        Returns {} for a month without events (PHP encodes the empty map as
+        `[]`) and None when the page has no literal at all.
+        """
+        for match in _EVENTS_RE.finditer(html):
+            try:
+                events_by_date, _ = _JSON_DECODER.raw_decode(html, match.end())
+            except json.JSONDecodeError:
+                continue
+            if isinstance(events_by_date, dict):
+                return events_by_date
+            if events_by_date == []:
+                return {}
+        return None
+    
+    @staticmethod
+    def _extract_events_soup(html):
+        """Find the events literal by walking <script> tags (slow fallback)"""
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(html, "html.parser")
         scripts = soup.find_all("script")
         
         for script in scripts:
             if script.string and "const events" in script.string:
                 # Extract JSON with events
-                match = re.search(r'const events = (\{[^;]+\});', script.string, re.DOTALL)
+                match = re.search(r'const events = (\{[^;]+\}|\[\s*\]);', script.string, re.DOTALL)
                 if match:
                     try:
-                        events_by_date = json.loads(match.group(1))
-                        events = []
-                        for date, date_events in events_by_date.items():
-                            for event in date_events:
-                                event['date'] = date
-                                events.append(event)
-                        return events
+                        return json.loads(match.group(1)) or {}
                     except json.JSONDecodeError as e:
                         print(f"Warning: JSON parse error - {e}")
         
-        return []
+        return None
     
-    def fetch_period(self, from_year, from_month, to_year, to_month):
-        """Fetch calendar data for a period"""
+    @Metrics.timed("fetch")
+    def fetch_period(self, from_year, from_month, to_year, to_month, max_workers=None, filters=None):
+        """Fetch calendar data for a period (months are fetched in parallel)"""
         all_events = []
-        current_date = datetime(from_year, from_month, 1)
-        end_date = datetime(to_year, to_month, 1)
-        
-        while current_date <= end_date:
-            print(f"Fetching {current_date.strftime('%B %Y')}...", end=" ")
-            events = self.fetch_month(current_date.year, current_date.month)
-            print(f"Found {len(events)} events")
+        for _, events in self.iter_period(from_year, from_month, to_year, to_month, max_workers, filters):
             all_events.extend(events)
-            current_date = current_date + relativedelta(months=1)
-        
         self.events = all_events
         return all_events
     
+    def iter_period(self, from_year, from_month, to_year, to_month, max_workers=None, filters=None):
+        """Yield ((year, month), events) for each month of a period, in month order
+        
+        At most max_workers months are requested ahead of the one being
+        consumed, so only that window of months is held in memory at a time.
+        Months the fetch plan reuses are read from their snapshots when their
+        turn comes.
+        """
+        if max_workers is None:
+            max_workers = config.FETCH["max_workers"]
+        
+        months = month_range(from_year, from_month, to_year, to_month)
+        plan = None
+        if self.cache is not None and config.CACHE.get("plan", True):
+            plan = self.cache.plan(months, filters)
+            self._report_plan(plan, len(months))
+        to_fetch = months if plan is None else [ym for ym in months if ym in plan["refresh"]]
+        reused = set() if plan is None else set(plan["reuse"])
+        revalidate = plan is not None
+        
+        if max_workers <= 1 or len(to_fetch) <= 1:
+            for year, month in months:
+                if (year, month) in reused:
+                    yield (year, month), self._reuse_month(year, month, filters)
+                    continue
+                print(f"Fetching {datetime(year, month, 1).strftime('%B %Y')}...", end=" ")
+                events = self.fetch_month(year, month, filters, revalidate)
+                print(f"Found {len(events)} events")
+                yield (year, month), events
+        else:
+            print(f"Fetching {len(to_fetch)} months ({max_workers} parallel requests)...")
+            # All workers share self.session, so the login cookies are reused
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(to_fetch))) as pool:
+                upcoming = iter(months)
+                pending = deque()
+                in_flight = 0
+                while True:
+                    # Queue months until max_workers requests are running ahead
+                    for year, month in upcoming:
+                        future = None
+                        if (year, month) not in reused:
+                            future = pool.submit(self.fetch_month, year, month, filters, revalidate)
+                            in_flight += 1
+                        pending.append(((year, month), future))
+                        if in_flight >= max_workers:
+                            break
+                    if not pending:
+                        break
+                    (year, month), future = pending.popleft()
+                    if future is None:
+                        yield (year, month), self._reuse_month(year, month, filters)
+                        continue
+                    in_flight -= 1
+                    events = future.result()
+                    print(f"{datetime(year, month, 1).strftime('%B %Y')}: Found {len(events)} events")
+                    yield (year, month), events
+        
+        if self.cache is not None:
+            stats = self.cache.stats()
+            print(f"Cache: {stats['hits']} hits, {stats['revalidated']} revalidated, {stats['misses']} misses")
+        if self.timings is not None:
+            self.timings.report()
+    
+    def _reuse_month(self, year, month, filters):
+        """Events of a month the plan serves from its snapshot"""
+        entry = self.cache.get(MonthCache.make_key(year, month, filters))
+        if entry is None:
+            # Removed since the plan was made
+            return self.fetch_month(year, month, filters, revalidate=True)
+        self.cache.record("hits")
+        return [Event.from_dict(data) for data in entry["events"]]
+    
+    @staticmethod
+    def _report_plan(plan, requested):
+        """One line on what the fetch plan refreshes and how many requests it saves"""
+        reasons = {}
+        for reason in plan["refresh"].values():
+            reasons[reason] = reasons.get(reason, 0) + 1
+        details = ", ".join(f"{count} {reason}" for reason, count in sorted(reasons.items()))
+        saved = len(plan["reuse"])
+        Metrics.count("plan_requests_saved", saved)
+        print(f"Plan: {len(plan['refresh'])} of {requested} months to refresh"
+              + (f" ({details})" if details else "")
+              + f", {saved} reused from snapshots - {saved} requests saved")
+    
+    @Metrics.timed("fetch_targets")
+    def fetch_targets(self, targets, from_year, from_month, to_year, to_month, max_workers=None,
+                      split_locally=None):
+        """Fetch several filter targets in one run, returning {target name: events}
+        
+        With split_locally, every month is fetched once without filters and each
+        target's events are picked out locally. Otherwise every (target, month)
+        pair is requested, all sharing one pool of max_workers requests.
+        """
+        if max_workers is None:
+            max_workers = config.FETCH["max_workers"]
+        if split_locally is None:
+            split_locally = config.FETCH.get("split_locally", True)
+        
+        targets = resolve_targets(targets)
+        
+        # The portal's type[] values can't be matched locally
+        if split_locally and all(target["filters"]["type"] == RESET_FILTERS["type"] for target in targets):
+            print(f"Fetching all events once for {len(targets)} targets...")
+            all_events = self.fetch_period(from_year, from_month, to_year, to_month, max_workers, RESET_FILTERS)
+            store = EventStore(all_events)
+            results = {target["name"]: store.query(**local_criteria(target["filters"])) for target in targets}
+        else:
+            months = month_range(from_year, from_month, to_year, to_month)
+            jobs = [(target, year, month) for target in targets for year, month in months]
+            print(f"Fetching {len(jobs)} target months ({max_workers} parallel requests)...")
+            results = {target["name"]: [] for target in targets}
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as pool:
+                fetched = pool.map(lambda job: self.fetch_month(job[1], job[2], job[0]["filters"]), jobs)
+                for (target, year, month), events in zip(jobs, fetched):
+                    results[target["name"]].extend(events)
+            
+            if self.cache is not None:
+                stats = self.cache.stats()
+                print(f"Cache: {stats['hits']} hits, {stats['revalidated']} revalidated, {stats['misses']} misses")
+            if self.timings is not None:
+                self.timings.report()
+        
+        for name, events in results.items():
+            print(f"{name}: {len(events)} events")
+        
+        self.events = [event for events in results.values() for event in events]
+        return results
+    
     def get_events(self):
         """Get all fetched events"""
         return self.events
     
     def close(self):
-        """Close session"""
-        self.session.close()
+        """Close session (keeping its cookies for the next run)"""
+        # The portal may have refreshed them during the run
+        if self._logged_in:
+            self._save_cookies()
+        if self._session is not None:
+            self._session.close()
+
+
+RESET_FILTERS = {
+    "room": "reset_room",
+    "lecturer": "reset_lecturer",
+    "group": "reset_group",
+    "type": "reset_type"
+}
 
 
+def resolve_target(target):
+    """Complete a batch target with reset_* defaults and a name for its outputs"""
+    filters = {key: target.get(key) or reset for key, reset in RESET_FILTERS.items()}
+    name = target.get("name") or "_".join(
+        value for key, value in filters.items() if value != RESET_FILTERS[key]) or "all"
+    return {"name": name, "filters": filters}
+
+
+def resolve_targets(targets):
+    """resolve_target() for every target; names must be unique, as they key results and outputs"""
+    resolved = [resolve_target(target) for target in targets]
+    names = [target["name"] for target in resolved]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"duplicate target names: {', '.join(duplicates)} (set a distinct \"name\" per target)")
+    return resolved
+
+
+def local_criteria(filters):
+    """EventStore.query() arguments for the room, lecturer and group filters"""
+    return {key: filters[key] for key in ("room", "lecturer", "group") if filters[key] != RESET_FILTERS[key]}
+
+
+def month_range(from_year, from_month, to_year, to_month):
+    """List (year, month) pairs from start to end month inclusive"""
+    months = []
+    current_date = datetime(from_year, from_month, 1)
+    end_date = datetime(to_year, to_month, 1)
+    
+    while current_date <= end_date:
+        months.append((current_date.year, current_date.month))
+        current_date = current_date + relativedelta(months=1)
+    
+    return months
+
+
+SORT_KEYS = {
+    "date": lambda e: (e.date or '', e.start_time or ''),
+    "room": lambda e: (e.room or '', e.date or '', e.start_time or ''),
+    "lecturer": lambda e: (e.lecturer or '', e.date or '', e.start_time or ''),
+    "group": lambda e: (e.group or '', e.date or '', e.start_time or ''),
+    "time": lambda e: (e.start_time or '', e.date or '')
+}
+
+
+@Metrics.timed("sort")
 def sort_events(events, sort_by="date"):
     """Sort events by specified field"""
-    sort_keys = {
-        "date": lambda e: (e.get('date', ''), e.get('start_time', '')),
-        "room": lambda e: (e.get('room', ''), e.get('date', ''), e.get('start_time', '')),
-        "lecturer": lambda e: (e.get('lecturer', ''), e.get('date', ''), e.get('start_time', '')),
-        "group": lambda e: (e.get('group', ''), e.get('date', ''), e.get('start_time', '')),
-        "time": lambda e: (e.get('start_time', ''), e.get('date', ''))
-    }
+    return sorted(events, key=SORT_KEYS.get(sort_by, SORT_KEYS["date"]))
+
+
+def sort_stream(chunks, sort_by="date", chunk_size=None):
+    """Sort a stream of month chunks without holding all of them at once
+    
+    Months arrive in order, so date order only needs each chunk sorted. For
+    other keys every sorted chunk is spilled to a temporary NDJSON file and
+    the files are merged (heapq.merge keeps equal keys in chunk order, so the
+    result matches sort_events). Yields lists of at most chunk_size events
+    (config.FETCH["stream_chunk"]).
+    """
+    key = SORT_KEYS.get(sort_by, SORT_KEYS["date"])
+    if sort_by not in SORT_KEYS or sort_by == "date":
+        for chunk in chunks:
+            with Metrics.timer("sort"):
+                chunk = sorted(chunk, key=key)
+            yield chunk
+        return
     
-    return sorted(events, key=sort_keys.get(sort_by, sort_keys["date"]))
+    if chunk_size is None:
+        chunk_size = config.FETCH.get("stream_chunk", 5000)
+    with tempfile.TemporaryDirectory(prefix="tsi_sort_") as directory:
+        runs = []
+        for chunk in chunks:
+            with Metrics.timer("sort"):
+                path = os.path.join(directory, f"{len(runs)}.ndjson")
+                with open(path, "w", encoding="utf-8") as f:
+                    for event in sorted(chunk, key=key):
+                        f.write(json.dumps(event.to_dict(), ensure_ascii=False, separators=(',', ':')))
+                        f.write("\n")
+                runs.append(path)
+        
+        files = [open(path, "r", encoding="utf-8") for path in runs]
+        try:
+            merged = heapq.merge(*[(Event.from_dict(json.loads(line)) for line in f) for f in files], key=key)
+            chunk = []
+            for event in merged:
+                chunk.append(event)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        finally:
+            for f in files:
+                f.close()
 
 
+@Metrics.timed("filter")
 def filter_events(events):
     """Filter events based on display options"""
     if not config.DISPLAY["show_canceled"]:
-        events = [e for e in events if e.get('description', '').lower() != 'canceled']
+        events = [e for e in events if (e.description or '').lower() != 'canceled']
     return events
-
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+HTTP transport for the TSI portal: pooled keep-alive connections, timeouts,
+retries for idempotent requests and per-request timing
+"""
+
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+import config
+import Metrics
+
+# Optional: brotli-compressed responses (urllib3 decodes them when installed)
+try:
+    import brotli  # noqa: F401
+    HAS_BROTLI = True
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        HAS_BROTLI = True
+    except ImportError:
+        HAS_BROTLI = False
+
+
+# Connection setup time of the current thread's last request
+_connect_time = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_time.value = getattr(_connect_time, "value", 0.0) + time.perf_counter() - start
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_time.value = getattr(_connect_time, "value", 0.0) + time.perf_counter() - start
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections report how long they took to set up"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class RequestTimings:
+    """Per-request timing records with a summary for reports
+    
+    connect is the setup time (DNS lookup, TCP and TLS handshakes) of new
+    connections and is 0 for requests on a reused keep-alive connection;
+    urllib3 resolves names inside its connect call, so DNS is not split out.
+    ttfb runs from sending the request to the parsed response headers (it
+    includes connect), and download is the time spent reading the body.
+    """
+    
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def start():
+        _connect_time.value = 0.0
+        return time.perf_counter()
+    
+    def record(self, resp, started):
+        total = time.perf_counter() - started
+        ttfb = resp.elapsed.total_seconds()
+        entry = {
+            "url": resp.url,
+            "status": resp.status_code,
+            "bytes": len(resp.content),
+            "connect": getattr(_connect_time, "value", 0.0),
+            "ttfb": ttfb,
+            "download": max(0.0, total - ttfb),
+            "total": total,
+        }
+        with self._lock:
+            self.records.append(entry)
+        
+        Metrics.count("http_requests", status=resp.status_code)
+        Metrics.observe("http_request_seconds", total)
+        Metrics.observe("http_ttfb_seconds", ttfb)
+        # urllib3 keeps the Retry object it used on the raw response
+        retries = getattr(getattr(resp.raw, "retries", None), "history", None)
+        if retries:
+            Metrics.count("http_retries", len(retries))
+        return entry
+    
+    def summary(self):
+        """Count, new connections, and mean/p50/p95 of each phase in seconds"""
+        with self._lock:
+            records = list(self.records)
+        if not records:
+            return {"requests": 0}
+        
+        result = {
+            "requests": len(records),
+            "new_connections": sum(1 for r in records if r["connect"] > 0),
+            "bytes": sum(r["bytes"] for r in records),
+        }
+        for phase in ("connect", "ttfb", "download", "total"):
+            values = sorted(r[phase] for r in records if phase != "connect" or r["connect"] > 0)
+            if not values:
+                continue
+            result[phase] = {
+                "mean": sum(values) / len(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            }
+        return result
+    
+    def report(self):
+        summary = self.summary()
+        if not summary["requests"]:
+            return
+        parts = [f"{summary['requests']} requests", f"{summary['new_connections']} new connections",
+                 f"{summary['bytes'] / 1024:.0f} KiB"]
+        for phase in ("connect", "ttfb", "download", "total"):
+            if phase in summary:
+                parts.append(f"{phase} {summary[phase]['mean'] * 1000:.0f}/{summary[phase]['p95'] * 1000:.0f} ms")
+        print(f"HTTP (mean/p95): {', '.join(parts)}")
+
+
+def create_adapter(max_workers=None):
+    """Pooled, retrying adapter configured from config.HTTP"""
+    http = config.HTTP
+    if max_workers is None:
+        max_workers = config.FETCH["max_workers"]
+    
+    # Only idempotent requests are retried; the login POST never is
+    retry_options = {
+        "total": http["retries"],
+        "connect": http["retries"],
+        "read": http["retries"],
+        "status": http["retries"],
+        "backoff_factor": http["backoff"],
+        "backoff_jitter": http["backoff_jitter"],
+        "status_forcelist": (429, 500, 502, 503, 504),
+        "allowed_methods": frozenset({"GET", "HEAD"}),
+        "respect_retry_after_header": True,
+        "raise_on_status": False,
+    }
+    try:
+        retry = Retry(**retry_options)
+    except TypeError:
+        # urllib3 < 2 has no backoff_jitter
+        retry_options.pop("backoff_jitter")
+        retry = Retry(**retry_options)
+    return TimedHTTPAdapter(
+        pool_connections=http["pool_connections"],
+        pool_maxsize=http["pool_maxsize"] or max(10, max_workers),
+        max_retries=retry,
+    )
+
+
+def accept_encoding():
+    return "gzip, deflate, br" if HAS_BROTLI else "gzip, deflate"
+
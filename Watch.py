@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Watch mode: poll the portal on a schedule and re-export only what changed
+"""
+
+import hashlib
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from Cache import AtomicFile
+from Events import Event
+from TSICalendar import month_range
+import config
+import Metrics
+
+
+# Fields that identify a lecture; the rest (date, times, room, description) may change
+LECTURE_FIELDS = ('title', 'group', 'type', 'lecturer')
+CHANGE_FIELDS = ('date', 'start_time', 'end_time', 'room', 'description')
+
+
+class Watcher:
+    """Polls the watched months and hands the changed ones to an export callback
+    
+    The near months (current and next) are polled every near_interval seconds,
+    the others every far_interval. A month counts as changed when the hash of
+    its events differs from the previous poll; on_change(events, changed) then
+    gets all watched events plus {(year, month): events} for the changed months,
+    and may return the pipeline results so failed exports are retried.
+    clock() and sleep() can be replaced, e.g. by a fake clock.
+    """
+    
+    def __init__(self, calendar, on_change, filters=None, months=None, clock=time.time, sleep=time.sleep,
+                 state_file=None, change_log=None):
+        self.calendar = calendar
+        self.on_change = on_change
+        self.filters = filters or config.FILTERS
+        self.months = months or month_range(
+            config.DATE_RANGE["from_year"], config.DATE_RANGE["from_month"],
+            config.DATE_RANGE["to_year"], config.DATE_RANGE["to_month"])
+        self.clock = clock
+        self.sleep = sleep
+        self.state_file = state_file or config.WATCH["state_file"]
+        self.change_log = config.WATCH["change_log"] if change_log is None else change_log
+        self.state, self.events = self._load_state()
+    
+    def interval(self, year, month, now):
+        """Seconds between polls of a month, depending on how near it is"""
+        today = datetime.fromtimestamp(now)
+        first = datetime(today.year, today.month, 1)
+        last = first + relativedelta(months=config.WATCH["near_months"] - 1)
+        if first <= datetime(year, month, 1) <= last:
+            return config.WATCH["near_interval"]
+        return config.WATCH["far_interval"]
+    
+    def due_months(self, now):
+        """Months whose poll interval has elapsed (all of them on the first poll)"""
+        due = []
+        for year, month in self.months:
+            entry = self.state.get(_month_key(year, month))
+            if entry is None or now - entry["polled"] >= self.interval(year, month, now):
+                due.append((year, month))
+        return due
+    
+    def next_poll(self, now):
+        """Seconds until the next month falls due"""
+        wait = config.WATCH["far_interval"]
+        for year, month in self.months:
+            entry = self.state.get(_month_key(year, month))
+            if entry is None:
+                return 0.0
+            wait = min(wait, entry["polled"] + self.interval(year, month, now) - now)
+        return max(0.0, wait)
+    
+    @Metrics.timed("poll")
+    def poll(self):
+        """Fetch the due months once; return {(year, month): events} for those that changed
+        
+        The new hashes of changed months are only kept once on_change has
+        exported them. If it raises, or returns pipeline results with a failed
+        exporter, those months keep their previous hash and are exported again
+        on their next poll.
+        """
+        now = self.clock()
+        due = self.due_months(now)
+        if not due:
+            return {}
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(config.FETCH["max_workers"], len(due)))) as executor:
+            fetched = list(executor.map(
+                lambda ym: self.calendar.fetch_month(ym[0], ym[1], filters=self.filters, revalidate=True), due))
+        
+        changed = {}
+        hashes = {}
+        log_lines = []
+        for (year, month), events in zip(due, fetched):
+            key = _month_key(year, month)
+            digest = month_hash(events)
+            previous = self.state.get(key)
+            if previous is not None and previous["hash"] == digest:
+                self.state[key] = {"hash": digest, "polled": now}
+                continue
+            
+            if previous is None or previous["hash"] is None:
+                log_lines.append(f"{key}: {len(events)} events (first poll)")
+            else:
+                log_lines.extend(format_changes(*diff_events(self.events.get(key, []), events)))
+            hashes[key] = digest
+            changed[(year, month)] = events
+        
+        if changed:
+            self._log(now, log_lines)
+            try:
+                results = self.on_change(self.all_events(changed), changed)
+            except Exception:
+                self._keep_previous(changed, now)
+                self._save_state()
+                raise
+            if _export_failed(results):
+                print(f"[{_timestamp(now)}] Export failed; {len(changed)} changed months will be retried")
+                self._keep_previous(changed, now)
+                changed = {}
+            else:
+                for (year, month), events in changed.items():
+                    key = _month_key(year, month)
+                    self.state[key] = {"hash": hashes[key], "polled": now}
+                    self.events[key] = events
+                    Metrics.count("months_changed")
+        self._save_state()
+        return changed
+    
+    def _keep_previous(self, months, now):
+        """Record the poll of months whose export failed, keeping their old hash (None on a first poll)"""
+        for year, month in months:
+            key = _month_key(year, month)
+            previous = self.state.get(key)
+            self.state[key] = {"hash": previous["hash"] if previous else None, "polled": now}
+    
+    def run(self, polls=None):
+        """Poll until interrupted (or polls times); a failed poll is retried after near_interval"""
+        done = 0
+        while polls is None or done < polls:
+            try:
+                changed = self.poll()
+                if not changed:
+                    print(f"[{_timestamp(self.clock())}] No changes")
+                wait = self.next_poll(self.clock())
+            except Exception as e:
+                print(f"[{_timestamp(self.clock())}] Poll failed: {e}")
+                wait = config.WATCH["near_interval"]
+            Metrics.write()
+            done += 1
+            if polls is None or done < polls:
+                self.sleep(wait)
+    
+    def all_events(self, changed=None):
+        """Events of every watched month, in month order; changed overrides the stored events of some months"""
+        changed = changed or {}
+        events = []
+        for year, month in self.months:
+            if (year, month) in changed:
+                events.extend(changed[(year, month)])
+            else:
+                events.extend(self.events.get(_month_key(year, month), []))
+        return events
+    
+    def _log(self, now, lines):
+        stamp = _timestamp(now)
+        for line in lines:
+            print(f"[{stamp}] {line}")
+        if self.change_log:
+            with open(self.change_log, "a", encoding="utf-8") as f:
+                f.writelines(f"{stamp} {line}\n" for line in lines)
+    
+    def _load_state(self):
+        """Month hashes, poll times and events from the previous run"""
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return {}, {}
+        state = {key: {"hash": entry["hash"], "polled": entry["polled"]} for key, entry in saved.items()}
+        events = {key: [Event.from_dict(data) for data in entry["events"]] for key, entry in saved.items()}
+        return state, events
+    
+    def _save_state(self):
+        saved = {key: dict(entry, events=[event.to_dict() for event in self.events.get(key, [])])
+                 for key, entry in self.state.items()}
+        with AtomicFile(self.state_file, "w", encoding="utf-8") as f:
+            json.dump(saved, f, separators=(",", ":"), ensure_ascii=False)
+
+
+def _export_failed(results):
+    """True when on_change returned pipeline results ({format: outcome}) with a failed exporter"""
+    if not isinstance(results, dict):
+        return False
+    return any(isinstance(outcome, dict) and outcome.get("ok") is False for outcome in results.values())
+
+
+def month_hash(events):
+    """Digest of a month's events that doesn't depend on their order"""
+    rows = sorted(json.dumps(event.to_dict(), sort_keys=True, ensure_ascii=False) for event in events)
+    return hashlib.sha1("\n".join(rows).encode("utf-8")).hexdigest()
+
+
+def diff_events(old, new):
+    """Return (added, removed, moved); moved pairs (old, new) of the same lecture
+    
+    A lecture that keeps its title, group, type and lecturer but changes its
+    date, time, room or description counts as moved rather than removed and added.
+    """
+    removed = _difference(old, new)
+    added = _difference(new, old)
+    
+    unmatched = {}
+    for event in removed:
+        unmatched.setdefault(_lecture_key(event), []).append(event)
+    moved = []
+    added_only = []
+    for event in added:
+        candidates = unmatched.get(_lecture_key(event))
+        if candidates:
+            moved.append((candidates.pop(0), event))
+        else:
+            added_only.append(event)
+    removed_only = [event for candidates in unmatched.values() for event in candidates]
+    return added_only, removed_only, moved
+
+
+def format_changes(added, removed, moved):
+    """One compact change log line per added (+), removed (-) and moved (~) lecture"""
+    lines = [f"+ {_describe(event)}" for event in added]
+    lines += [f"- {_describe(event)}" for event in removed]
+    for before, after in moved:
+        changes = ", ".join(f"{field} {before.get(field, '') or '-'} -> {after.get(field, '') or '-'}"
+                            for field in CHANGE_FIELDS if before.get(field, '') != after.get(field, ''))
+        lines.append(f"~ {before.get('date', '')} {before.get('start_time', '')} "
+                     f"{before.get('title', '')} [{before.get('group', '')}]: {changes}")
+    return lines
+
+
+def _difference(events, other):
+    """Events not matched one-to-one by an identical event in other"""
+    remaining = Counter(_event_key(event) for event in other)
+    result = []
+    for event in events:
+        key = _event_key(event)
+        if remaining[key]:
+            remaining[key] -= 1
+        else:
+            result.append(event)
+    return result
+
+
+def _event_key(event):
+    return tuple(event.get(field, '') for field in Event.FIELDS)
+
+
+def _lecture_key(event):
+    return tuple(event.get(field, '') for field in LECTURE_FIELDS)
+
+
+def _describe(event):
+    return (f"{event.get('date', '')} {event.get('start_time', '')}-{event.get('end_time', '')} "
+            f"{event.get('title', '')} [{event.get('group', '')}] room {event.get('room', '-')}")
+
+
+def _month_key(year, month):
+    return f"{year}-{month:02d}"
+
+
+def _timestamp(now):
+    return datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
@@ -4,6 +4,12 @@
 USERNAME = "stXXXXX"
 PASSWORD = "XXXXXXXXX"
 
+# Login session reuse between runs
+SESSION = {
+    "cookie_file": ".tsi_session.json",  # Saved login cookies (None = log in every run)
+    "probe": True                        # Check saved cookies with one HEAD request before reusing them
+}
+
 # Calendar filters
 FILTERS = {
     "room": "reset_room",      # Example: "221", "L1 (125)", or "reset_room" for all
@@ -12,6 +18,13 @@ FILTERS = {
     "type": "reset_type"       # Event type filter or "reset_type" for all
 }
 
+# Batch mode: fetch several targets in one run and write one output per target.
+# Leave empty to use FILTERS. Missing keys default to reset_* (all).
+TARGETS = [
+    # {"name": "gercevs", "lecturer": "Gercevs"},
+    # {"name": "5502DTL", "group": "5502DTL"},
+]
+
 DATE_RANGE = {
     "from_year": 2025,
     "from_month": 9,    # September
@@ -19,17 +32,77 @@ DATE_RANGE = {
     "to_month": 12      # December
 }
 
+# Fetch options
+FETCH = {
+    "max_workers": 4,       # Months fetched in parallel (1 = one request at a time)
+    "split_locally": True,  # Batch mode: fetch everything once and split per target locally
+    "stream": False,        # Stream months from fetch to export instead of collecting them (--stream)
+    "stream_chunk": 5000    # Streaming: events per chunk after a merge sort (sort_by other than "date")
+}
+
+# HTTP transport
+HTTP = {
+    "connect_timeout": 5,       # Seconds
+    "read_timeout": 30,         # Seconds
+    "retries": 3,               # Retries for failed GET/HEAD requests (connection errors, 429, 5xx)
+    "backoff": 0.5,             # Seconds; doubled on every retry
+    "backoff_jitter": 0.5,      # Seconds of random jitter added to each backoff
+    "pool_connections": 4,      # Hosts kept in the connection pool
+    "pool_maxsize": None        # Connections per host (None = enough for FETCH["max_workers"])
+}
+
+# Month page cache (parsed events stored on disk between runs)
+CACHE = {
+    "enabled": True,
+    "directory": ".tsi_cache",
+    "past_ttl": 30 * 24 * 3600,     # Seconds; past months rarely change
+    "current_ttl": 3600,            # Seconds; current and future months
+    "plan": True                    # Periods: always refresh current/future months, reuse settled past ones
+}
+
+# Watch mode (python main.py --watch)
+WATCH = {
+    "near_interval": 15 * 60,       # Seconds between polls of the current and next month
+    "far_interval": 6 * 3600,       # Seconds between polls of the other months
+    "near_months": 2,               # Months from the current one that count as near
+    "state_file": ".tsi_watch.json",
+    "change_log": "tsi_changes.log"
+}
+
+# Run metrics (stage timers, counters, HTTP/API latency histograms)
+METRICS = {
+    "enabled": False,
+    "format": "jsonl",              # "jsonl" (one line appended per run) or "prometheus" (textfile, replaced)
+    "file": "tsi_metrics.jsonl"     # e.g. /var/lib/node_exporter/textfile_collector/tsi.prom for "prometheus"
+}
+
+# Schedule analysis (python main.py analyze)
+ANALYSIS = {
+    "day_start": "08:00",           # Working hours for free slots and occupancy
+    "day_end": "21:30",
+    "weekdays": [0, 1, 2, 3, 4, 5], # Monday = 0; Sunday is off
+    "min_free_minutes": 45          # Shortest free slot worth reporting
+}
+
 # Display options
 DISPLAY = {
     "sort_by": "date",  # Options: "date", "room", "lecturer", "group", "time"
-    "show_canceled": True  
+    "show_canceled": True,
+    "table_format": "table",  # "table", or "csv"/"tsv" for piping (python main.py --table-format csv > events.csv)
+    "page_size": 0,  # Rows per table page, each with its own header and column widths; 0 = one page
+    "max_width": None  # Table width limit; None = terminal width (unlimited when not a terminal)
 }
 
 
 OUTPUT = {
-    "formats": ["table", "ics"],  # Options: "table", "json", "ics", "google_calendar" for google folow MD file
+    "formats": ["table", "ics"],  # Options: "table", "json", "ics", "sqlite", "parquet", "google_calendar" for google folow MD file
     "json_file": "calendar_tsi.json",
+    "json_mode": "pretty",       # "pretty", "compact" or "ndjson" (one event per line)
+    "json_compression": None,    # None, "gzip" or "zstd" (requires zstandard)
     "ics_file": "calendar_tsi.ics",
+    "sqlite_file": "calendar_tsi.sqlite",  # Indexed archive; each export replaces the months it covers
+    "parquet_dir": "calendar_tsi_parquet", # Parquet dataset partitioned by month (requires pyarrow)
+    "max_workers": 4,            # Exporters run in parallel (1 = one after another)
 }
 
 # Google Calendar settings (only if using google_calendar output)
@@ -38,6 +111,16 @@ GOOGLE_CALENDAR = {
     "credentials_file": "credentials.json",
     "token_file": "token.json",
     "timezone": "Europe/Riga",
+    "sync_mode": "incremental",  # "incremental" (only push changes) or "replace" (clear and re-insert)
+    "page_size": 2500,           # Events per list page (API limit is 2500)
+    "batch_size": 50,            # Mutations per batch request (API limit is 1000)
+    "max_retries": 5,            # Retries for rate-limited (403/429) requests
+    "retry_backoff": 1.0,        # Seconds; doubled on every retry
+    "requests_per_second": None, # Per-calendar API request cap, halved while rate-limited (None = no cap)
+    "routes": [],                # Extra calendars by group, lecturer or type, e.g.
+                                 # {"name": "3401BNA", "calendar_id": "...", "group": "3401BNA"}
+    "default_calendar": True,    # With routes: also push every event into calendar_id
+    "max_calendars": 4,          # Calendars synced in parallel
     "location": "Transport and Telecommunication Institute, Lauvas iela 2, Riga, LV-1019, Latvia"
 }
 
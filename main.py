@@ -4,81 +4,312 @@ TSI Calendar Scraper - Main Entry Point
 Fetch calendar data and export to various formats
 """
 
-from TSICalendar import TSICalendar, sort_events, filter_events
-from Exporters import TableExporter, JSONExporter, ICSExporter, GoogleCalendarExporter
+import argparse
 import config
+import Metrics
+
+# Everything else is imported where it is used, so cron runs served from the
+# cache don't pay for requests, bs4 or the exporters they don't use
+
+
+def process_events(events):
+    """Step 2: Filter and sort"""
+    from TSICalendar import sort_events, filter_events
+    from Events import normalize_events
+    
+    print(f"\nStep 2: Processing events")
+    events = filter_events(events)
+    events = sort_events(events, config.DISPLAY['sort_by'])
+    # Parse and localize dates once for all exporters
+    with Metrics.timer("normalize"):
+        normalize_events(events, config.GOOGLE_CALENDAR['timezone'])
+    
+    print(f"After filtering: {len(events)} events")
+    print(f"Sorting by: {config.DISPLAY['sort_by']}")
+    return events
+
+
+def process_stream(months, totals):
+    """Step 2 for streamed runs: filter, sort and normalize each chunk as it arrives
+    
+    months yields ((year, month), events); totals gets the "months", "fetched"
+    and "exported" counts.
+    """
+    from TSICalendar import sort_stream, filter_events
+    from Events import normalize_events
+    
+    def filtered():
+        for _, events in months:
+            totals["months"] += 1
+            totals["fetched"] += len(events)
+            yield filter_events(events)
+    
+    for events in sort_stream(filtered(), config.DISPLAY['sort_by']):
+        # Parse and localize dates once for all exporters
+        with Metrics.timer("normalize"):
+            normalize_events(events, config.GOOGLE_CALENDAR['timezone'])
+        totals["exported"] += len(events)
+        yield events
+
+
+def export_events(pipeline, events, filters, target_name=None):
+    """Step 3: Export to requested formats"""
+    print(f"\nStep 3: Exporting to formats: {', '.join(pipeline.formats)}")
+    print("-" * 80)
+    pipeline.run(events, filters, target_name)
+
+
+def watch(calendar, pipeline, polls=None):
+    """Watch mode: poll on a schedule and re-export only when months change"""
+    from Watch import Watcher
+    
+    def export_changes(events, changed):
+        events = process_events(events)
+        print(f"\nExporting {len(changed)} changed months: {', '.join(pipeline.formats)}")
+        return pipeline.run(events, config.FILTERS, months=set(changed))
+    
+    if config.TARGETS:
+        print("Warning: watch mode uses FILTERS; TARGETS are ignored")
+    print(f"\nWatching {config.DATE_RANGE['from_year']}-{config.DATE_RANGE['from_month']:02d} "
+          f"to {config.DATE_RANGE['to_year']}-{config.DATE_RANGE['to_month']:02d} "
+          f"(near months every {config.WATCH['near_interval']}s, others every {config.WATCH['far_interval']}s)")
+    print("Press Ctrl+C to stop")
+    print("-" * 80)
+    try:
+        Watcher(calendar, export_changes).run(polls)
+    except KeyboardInterrupt:
+        print("\nWatch stopped")
+
+
+def analyze(calendar, args):
+    """Analyze subcommand: double-bookings, free room slots and an occupancy matrix"""
+    from calendar import monthrange
+    from Analysis import Schedule, format_conflict, write_occupancy
+    
+    date_range = config.DATE_RANGE
+    date_from = f"{date_range['from_year']}-{date_range['from_month']:02d}-01"
+    date_to = (f"{date_range['to_year']}-{date_range['to_month']:02d}-"
+               f"{monthrange(date_range['to_year'], date_range['to_month'])[1]:02d}")
+    print(f"\nAnalyzing {date_from} to {date_to}")
+    print(f"Filters: Room={config.FILTERS['room']}, Lecturer={config.FILTERS['lecturer']}, "
+          f"Group={config.FILTERS['group']}")
+    print("-" * 80)
+    
+    events = calendar.fetch_period(date_range['from_year'], date_range['from_month'],
+                                   date_range['to_year'], date_range['to_month'])
+    schedule = Schedule(events)
+    print(f"\n{len(events)} events, {len(schedule)} sessions, {len(schedule.resources('room'))} rooms")
+    
+    for kind in args.conflicts:
+        conflicts = schedule.conflicts(kind)
+        print(f"\n{kind.capitalize()} conflicts: {len(conflicts)}")
+        for conflict in conflicts[:args.limit]:
+            print(f"  {format_conflict(conflict)}")
+        if len(conflicts) > args.limit:
+            print(f"  ... {len(conflicts) - args.limit} more")
+    
+    if args.free_slots:
+        slots = schedule.free_slots(date_from, date_to, rooms=args.room)
+        print(f"\nFree slots ({config.ANALYSIS['day_start']}-{config.ANALYSIS['day_end']}, "
+              f"at least {config.ANALYSIS['min_free_minutes']} min):")
+        for room, room_slots in slots.items():
+            print(f"  {room}: {len(room_slots)} slots")
+            for day, start, end in room_slots[:args.limit]:
+                print(f"    {day} {start}-{end}")
+    
+    if args.occupancy:
+        write_occupancy(schedule.occupancy(date_from, date_to, resources=args.room), args.occupancy)
+        print(f"\nRoom occupancy matrix written to {args.occupancy}")
+
+
+# Import phases of a run, in order: (label, modules)
+STARTUP_PHASES = (
+    ("Startup", "main, TSICalendar, Pipeline and the configured exporters"),
+    ("First portal request", "requests, Transport"),
+    ("HTML fallback parser", "bs4"),
+)
+
+
+def profile_startup(top=8):
+    """Summarize `python -X importtime` for the imports of a run, phase by phase"""
+    import os
+    import subprocess
+    import sys
+    
+    # Each phase starts with a marker line on stderr, where -X importtime reports
+    code = "\n".join([
+        "import sys",
+        "sys.stderr.write('@phase Startup\\n')",
+        "import main, TSICalendar, Pipeline",
+        "for name in Pipeline.ExportPipeline().formats:",
+        "    if name in Pipeline.EXPORTERS:",
+        "        Pipeline.load_exporter(name)",
+        "sys.stderr.write('@phase First portal request\\n')",
+        "import requests, Transport",
+        "sys.stderr.write('@phase HTML fallback parser\\n')",
+        "import bs4",
+    ])
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1])
+        return
+    
+    phases = {"Interpreter": {}}
+    phase = phases["Interpreter"]
+    for line in result.stderr.splitlines():
+        if line.startswith("@phase "):
+            phase = phases.setdefault(line[len("@phase "):], {})
+        elif line.startswith("import time:") and "|" in line and "self [us]" not in line:
+            self_us, _, name = line[len("import time:"):].split("|")
+            package = name.strip().split(".")[0]
+            phase[package] = phase.get(package, 0) + int(self_us)
+    
+    print("Import time per phase (python -X importtime, self time summed per top-level package)")
+    descriptions = dict(STARTUP_PHASES, Interpreter="site and encodings")
+    total = 0
+    for label, packages in phases.items():
+        phase_total = sum(packages.values())
+        total += phase_total
+        print(f"\n{label} ({descriptions.get(label, '')}): {phase_total / 1000:.1f} ms")
+        for package, us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            print(f"    {package:<24} {us / 1000:7.1f} ms")
+    print(f"\nTotal: {total / 1000:.1f} ms; everything after Startup is only imported when that code runs")
 
 
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description="TSI Calendar Scraper")
+    parser.add_argument("--watch", action="store_true", help="keep running and re-export when the calendar changes")
+    parser.add_argument("--polls", type=int, help="watch mode: stop after this many polls")
+    parser.add_argument("--profile-startup", action="store_true", help="show where import time goes and exit")
+    parser.add_argument("--table-format", choices=("table", "csv", "tsv"),
+                        help="table output style (default: DISPLAY['table_format'])")
+    parser.add_argument("--stream", action="store_true",
+                        help="pass months from fetch to export one at a time (bounded memory)")
+    commands = parser.add_subparsers(dest="command")
+    analyze_parser = commands.add_parser("analyze", help="find double-bookings and free room slots")
+    analyze_parser.add_argument("--conflicts", nargs="*", choices=("room", "lecturer", "group"),
+                                default=["room", "lecturer", "group"], help="resources to check (default: all)")
+    analyze_parser.add_argument("--free-slots", action="store_true", help="list free slots per room")
+    analyze_parser.add_argument("--room", action="append", help="limit free slots and occupancy to this room")
+    analyze_parser.add_argument("--occupancy", metavar="FILE", help="write a room x date occupancy CSV")
+    analyze_parser.add_argument("--limit", type=int, default=20, help="lines shown per list")
+    args = parser.parse_args()
+    
+    if args.profile_startup:
+        profile_startup()
+        return
+    if args.table_format:
+        config.DISPLAY["table_format"] = args.table_format
+    
+    if config.DISPLAY.get("table_format", "table") != "table" and "table" in config.OUTPUT["formats"]:
+        import contextlib
+        import sys
+        from Exporters import TableExporter
+        
+        # Only the CSV/TSV rows go to stdout, so they can be piped; progress goes to stderr
+        TableExporter.stream = sys.stdout
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                run(args)
+        finally:
+            TableExporter.stream = None
+        return
+    run(args)
+
+
+def run(args):
+    """Fetch, process and export as configured"""
+    from TSICalendar import TSICalendar, resolve_targets
+    from Pipeline import ExportPipeline
+    
+    Metrics.configure()
     print("=" * 80)
     print("TSI Calendar Scraper")
     print("=" * 80)
     
     calendar = TSICalendar()
+    pipeline = ExportPipeline()
     
     try:
-        # Step 1: Login
-        print("\nStep 1: Authenticating...")
-        calendar.login()
+        if args.command == "analyze":
+            analyze(calendar, args)
+            return
+        if args.watch:
+            watch(calendar, pipeline, args.polls)
+            return
         
-        # Step 2: Fetch calendar data
-        print(f"\nStep 2: Fetching calendar data")
+        # Step 1: Fetch calendar data (logging in on the first request that reaches the portal)
+        print(f"\nStep 1: Fetching calendar data")
         print(f"Date range: {config.DATE_RANGE['from_year']}-{config.DATE_RANGE['from_month']:02d} "
               f"to {config.DATE_RANGE['to_year']}-{config.DATE_RANGE['to_month']:02d}")
-        print(f"Filters: Room={config.FILTERS['room']}, Lecturer={config.FILTERS['lecturer']}, "
-              f"Group={config.FILTERS['group']}")
-        print("-" * 80)
-        
-        events = calendar.fetch_period(
-            config.DATE_RANGE['from_year'],
-            config.DATE_RANGE['from_month'],
-            config.DATE_RANGE['to_year'],
-            config.DATE_RANGE['to_month']
-        )
-        
-        print(f"\nTotal events fetched: {len(events)}")
-        
-        # Step 3: Filter and sort
-        print(f"\nStep 3: Processing events")
-        events = filter_events(events)
-        events = sort_events(events, config.DISPLAY['sort_by'])
         
-        print(f"After filtering: {len(events)} events")
-        print(f"Sorting by: {config.DISPLAY['sort_by']}")
+        stream = args.stream or config.FETCH.get("stream", False)
+        if stream and config.TARGETS:
+            print("Warning: streaming is not supported in batch mode (TARGETS); fetching normally")
+            stream = False
         
-        if not events:
-            print("\nNo events found matching the criteria")
-            return
-        
-        # Step 4: Export to requested formats
-        print(f"\nStep 4: Exporting to formats: {', '.join(config.OUTPUT['formats'])}")
-        print("-" * 80)
-        
-        for format_type in config.OUTPUT['formats']:
-            format_type = format_type.lower().strip()
+        if config.TARGETS:
+            print(f"Targets: {len(config.TARGETS)}")
+            print("-" * 80)
+            if "google_calendar" in pipeline.formats:
+                # Every target would sync into the same calendar and remove the others' events
+                print("Warning: google_calendar output is not supported in batch mode (TARGETS)")
+                pipeline = ExportPipeline([f for f in pipeline.formats if f != "google_calendar"])
+            
+            results = calendar.fetch_targets(
+                config.TARGETS,
+                config.DATE_RANGE['from_year'],
+                config.DATE_RANGE['from_month'],
+                config.DATE_RANGE['to_year'],
+                config.DATE_RANGE['to_month']
+            )
+            
+            for resolved in resolve_targets(config.TARGETS):
+                print(f"\n{'=' * 80}\nTarget: {resolved['name']}")
+                events = process_events(results[resolved['name']])
+                if events:
+                    export_events(pipeline, events, resolved['filters'], resolved['name'])
+                else:
+                    print("No events found matching the criteria")
+        elif stream:
+            print(f"Filters: Room={config.FILTERS['room']}, Lecturer={config.FILTERS['lecturer']}, "
+                  f"Group={config.FILTERS['group']}")
+            print(f"Streaming: months are processed and exported as they arrive "
+                  f"(sorting by {config.DISPLAY['sort_by']}, exporting to {', '.join(pipeline.formats)})")
+            print("-" * 80)
             
-            if format_type == "table":
-                TableExporter.export(events)
+            totals = {"months": 0, "fetched": 0, "exported": 0}
+            months = calendar.iter_period(
+                config.DATE_RANGE['from_year'],
+                config.DATE_RANGE['from_month'],
+                config.DATE_RANGE['to_year'],
+                config.DATE_RANGE['to_month']
+            )
+            pipeline.run_stream(process_stream(months, totals), config.FILTERS)
+            print(f"\nStreamed {totals['months']} months: {totals['fetched']} events fetched, "
+                  f"{totals['exported']} after filtering")
+        else:
+            print(f"Filters: Room={config.FILTERS['room']}, Lecturer={config.FILTERS['lecturer']}, "
+                  f"Group={config.FILTERS['group']}")
+            print("-" * 80)
             
-            elif format_type == "json":
-                JSONExporter.export(events)
+            events = calendar.fetch_period(
+                config.DATE_RANGE['from_year'],
+                config.DATE_RANGE['from_month'],
+                config.DATE_RANGE['to_year'],
+                config.DATE_RANGE['to_month']
+            )
             
-            elif format_type == "ics":
-                ICSExporter.export(events)
+            print(f"\nTotal events fetched: {len(events)}")
             
-            elif format_type == "google_calendar":
-                try:
-                    google_exporter = GoogleCalendarExporter()
-                    google_exporter.export(events, clear_first=True)
-                except ImportError:
-                    print("Error: Google Calendar export requires google-auth, google-auth-oauthlib, "
-                          "and google-api-python-client packages")
-                except Exception as e:
-                    print(f"Error exporting to Google Calendar: {e}")
+            events = process_events(events)
+            if not events:
+                print("\nNo events found matching the criteria")
+                return
             
-            else:
-                print(f"Warning: Unknown export format '{format_type}'")
+            export_events(pipeline, events, config.FILTERS)
         
         print("\n" + "=" * 80)
         print("Export completed successfully!")
@@ -90,6 +321,9 @@ def main():
         traceback.print_exc()
     finally:
         calendar.close()
+        metrics_file = Metrics.write()
+        if metrics_file:
+            print(f"Metrics written to {metrics_file}")
 
 
 if __name__ == "__main__":